@@ -0,0 +1,137 @@
+"""
+Parity and latency check of the YOLO inference backends (PyTorch vs ONNX
+Runtime / OpenVINO exports, see INFERENCE_BACKEND in config.py).
+
+Every backend is swapped into the model registry in turn, so the comparison
+runs through the real detect_objects_by_image / perform_cap_ocr_yolo code
+paths. For each sample image it compares against the first backend:
+  - localization: same categories in the same order, boxes within --box-tolerance px
+  - CAP characters: identical recognised text on the preprocessed crop
+and reports the median latency of both models per backend. Exits non-zero on
+any mismatch.
+
+Usage:
+    python main.py --export-models onnx
+    python benchmarks/backend_parity.py [--backends torch onnx openvino] [--images samples/*.jpg] [--repeats 20]
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+import cv2
+
+# Add the project root to the Python path to allow imports from core and utils
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from core.models import registry, load_yolo, LOCALIZATION_MODEL_PATH, CAP_CHARACTER_MODEL_PATH
+from core.detection import detect_objects_by_image, select_detections
+from core.ocr import perform_cap_ocr_yolo
+from core.preprocessing import apply_preprocessing_pipeline
+from core.processing import crop_detection
+from utils.logger import log
+
+
+def use_backend(backend: str):
+    """Loads both YOLO models for `backend` and installs them in the model registry."""
+    localization = load_yolo(LOCALIZATION_MODEL_PATH, backend)
+    cap_characters = load_yolo(CAP_CHARACTER_MODEL_PATH, backend)
+    registry.register('localization', lambda: localization)
+    registry.register('cap_characters', lambda: cap_characters)
+
+
+def median_ms(fn, repeats: int) -> float:
+    fn() # warm-up
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(samples)
+
+
+def run_backend(backend: str, images: list, repeats: int) -> dict:
+    """Returns {'outputs': {path: (detections, cap_text)}, 'localization_ms', 'cap_ms'}."""
+    use_backend(backend)
+    outputs = {}
+    localization_times, cap_times = [], []
+
+    for path, image in images:
+        results, _, model = detect_objects_by_image(image)
+        detections = select_detections(results[0], model.names, top_k=None) if results else []
+
+        cap_text = None
+        cap_crop = None
+        if detections and detections[0]['category'] == 'CAP':
+            cap_crop = apply_preprocessing_pipeline(crop_detection(image, detections[0]), 'CAP')
+            cap_text = "".join(r['text'] for r in perform_cap_ocr_yolo(cap_crop))
+        outputs[path] = (detections, cap_text)
+
+        localization_times.append(median_ms(lambda: detect_objects_by_image(image), repeats))
+        if cap_crop is not None:
+            cap_times.append(median_ms(lambda: perform_cap_ocr_yolo(cap_crop), repeats))
+
+    return {
+        'outputs': outputs,
+        'localization_ms': statistics.median(localization_times) if localization_times else float('nan'),
+        'cap_ms': statistics.median(cap_times) if cap_times else float('nan'),
+    }
+
+
+def compare(reference: dict, candidate: dict, box_tolerance: int) -> list:
+    """Returns human readable mismatches of `candidate` against `reference`."""
+    mismatches = []
+    for path, (ref_detections, ref_text) in reference.items():
+        detections, text = candidate[path]
+        name = os.path.basename(path)
+        if [d['category'] for d in detections] != [d['category'] for d in ref_detections]:
+            mismatches.append(f"{name}: categories {[d['category'] for d in detections]} != "
+                              f"{[d['category'] for d in ref_detections]}")
+            continue
+        for det, ref in zip(detections, ref_detections):
+            worst = max(abs(a - b) for a, b in zip(det['box'], ref['box']))
+            if worst > box_tolerance:
+                mismatches.append(f"{name}: {det['category']} box {det['box']} vs {ref['box']} ({worst} px)")
+        if text != ref_text:
+            mismatches.append(f"{name}: CAP text '{text}' != '{ref_text}'")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare YOLO inference backends for parity and latency.")
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx"],
+                        help="Backends to compare; the first one is the reference.")
+    parser.add_argument("--images", default=os.path.join(PROJECT_ROOT, "samples", "*.jpg"),
+                        help="Glob of sample images.")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--box-tolerance", type=int, default=2,
+                        help="Maximum per-coordinate box difference in pixels.")
+    args = parser.parse_args()
+
+    log.disabled = True
+    images = [(path, cv2.imread(path)) for path in sorted(glob.glob(args.images))]
+    images = [(path, image) for path, image in images if image is not None]
+    if not images:
+        parser.error(f"No readable images match {args.images}")
+
+    runs = {backend: run_backend(backend, images, args.repeats) for backend in args.backends}
+    reference = args.backends[0]
+
+    print(f"{'backend':>10} {'localization ms':>16} {'CAP chars ms':>13}  parity")
+    failed = False
+    for backend, run in runs.items():
+        mismatches = [] if backend == reference else compare(runs[reference]['outputs'], run['outputs'], args.box_tolerance)
+        failed = failed or bool(mismatches)
+        status = "reference" if backend == reference else ("ok" if not mismatches else f"{len(mismatches)} mismatch(es)")
+        print(f"{backend:>10} {run['localization_ms']:>16.1f} {run['cap_ms']:>13.1f}  {status}")
+        for mismatch in mismatches:
+            print(f"    {mismatch}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""
+Accuracy and throughput benchmark of the full pipeline over labelled samples.
+
+The manifest is a CSV with the columns
+    image, category, formatted_top, formatted_bottom
+(image paths relative to the manifest). A blank expected value is not
+checked, and rows with neither formatted_top nor formatted_bottom only count
+towards the latency figures. samples/labels.csv labels the bundled samples.
+
+One run processes every image `--repeats` times through the batch pipeline
+(or the process pool with --workers > 1 / the thread pool with --threads > 1,
+as `main.py` does) and reports:
+  - per-stage latency percentiles (p50/p90/p99, from the payload timings)
+  - images per second over the timed runs
+  - peak RSS of this process and of the largest worker
+  - exact-match accuracy (top and bottom line both as expected), per category
+The result cache and debug artifacts are switched off so every repeat does
+the full work; --set overrides any config.py value, including those.
+
+With --baseline the run is compared to an earlier --output JSON report: the
+throughput/latency/accuracy deltas are printed together with every image that
+was correct in the baseline and isn't any more. Exits non-zero on such a
+regression when --fail-on-regression is given.
+
+Usage:
+    python benchmarks/run_benchmark.py --output baseline.json
+    python benchmarks/run_benchmark.py --set CASCADE_ENABLED=True --baseline baseline.json --output cascade.json
+    python benchmarks/run_benchmark.py --backend onnx --workers 4 --repeats 5 --output onnx_w4.csv
+    python benchmarks/run_benchmark.py --threads 4 --set "MODEL_CONCURRENCY={'easyocr': 'per_thread'}"
+    python benchmarks/run_benchmark.py --preset BOX=assets/pipeline_presets/tuned_box.json --baseline baseline.json
+    python benchmarks/run_benchmark.py --set MODEL_BACKEND=stub   # pipeline overhead only, no weights needed
+"""
+import argparse
+import ast
+import csv
+import json
+import os
+import sys
+import time
+import numpy as np
+
+# Add the project root to the Python path to allow imports from core and utils
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+import config
+from utils.logger import log
+
+try:
+    import resource # Not available on Windows
+except ImportError:
+    resource = None
+
+PERCENTILES = (50, 90, 99)
+# Config values every benchmark run starts from (see the module docstring)
+BENCHMARK_DEFAULTS = {
+    'RESULT_CACHE_ENABLED': False,
+    'ARTIFACT_POLICY': "off",
+}
+
+
+# --- Manifest ---
+def load_manifest(manifest_path: str) -> list:
+    """
+    Reads the labelled manifest.
+
+    Returns:
+        list: One dict per row with 'image_path' (absolute), 'category',
+              'formatted_top' and 'formatted_bottom' ('' = not checked).
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    samples = []
+    with open(manifest_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            image = (row.get('image') or '').strip()
+            if not image or image.startswith('#'):
+                continue
+            samples.append({
+                'image_path': image if os.path.isabs(image) else os.path.join(manifest_dir, image),
+                'category': (row.get('category') or '').strip(),
+                'formatted_top': (row.get('formatted_top') or '').strip(),
+                'formatted_bottom': (row.get('formatted_bottom') or '').strip(),
+            })
+    return samples
+
+
+def parse_overrides(args) -> dict:
+    """Collects the config.py overrides of a run from the command line."""
+    overrides = dict(BENCHMARK_DEFAULTS)
+    for item in args.set:
+        name, _, value = item.partition('=')
+        if not hasattr(config, name):
+            raise SystemExit(f"--set: config.py has no setting named '{name}'")
+        try:
+            overrides[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[name] = value # Plain strings don't need quoting
+    if args.backend:
+        overrides['INFERENCE_BACKEND'] = args.backend
+    if args.preset:
+        presets = dict(overrides.get('PRESET_OVERRIDES', config.PRESET_OVERRIDES))
+        for item in args.preset:
+            category, _, path = item.partition('=')
+            presets[category.upper()] = os.path.abspath(path)
+        overrides['PRESET_OVERRIDES'] = presets
+    return overrides
+
+
+# --- Running ---
+def _peak_rss_mb(who) -> float:
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(who).ru_maxrss / 1024.0
+
+
+def run_pipeline(image_paths: list, workers: int, threads: int, batch_size: int, repeats: int,
+                 overrides: dict) -> tuple:
+    """
+    Processes the images `repeats` times.
+
+    Returns:
+        tuple: (payloads of the timed runs in order, wall time in seconds)
+    """
+    runs = image_paths * repeats
+    if workers > 1:
+        from core.parallel import run_parallel
+        # One pool for all repeats; the worker start-up and model loads are part of the wall time
+        start = time.perf_counter()
+        payloads = list(run_parallel(runs, workers, config_overrides=overrides))
+        return payloads, time.perf_counter() - start
+
+    if threads > 1:
+        from core.pipeline import Pipeline
+        with Pipeline(threads) as pipeline:
+            pipeline.preload()
+            # Untimed warm-up pass, e.g. for the per-thread model copies
+            list(pipeline.map(image_paths))
+            start = time.perf_counter()
+            payloads = list(pipeline.map(runs))
+            return payloads, time.perf_counter() - start
+
+    from core.batch import iter_batch_results
+    # Untimed warm-up pass: loads the models and compiles the presets
+    for _ in iter_batch_results(image_paths, batch_size):
+        pass
+    start = time.perf_counter()
+    payloads = list(iter_batch_results(runs, batch_size))
+    return payloads, time.perf_counter() - start
+
+
+# --- Report ---
+def stage_percentiles(payloads: list) -> dict:
+    """Returns {stage: {'count', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms'}}."""
+    samples = {}
+    for payload in payloads:
+        for stage, seconds in payload['timings'].items():
+            samples.setdefault(stage, []).append(seconds * 1000.0)
+    stages = {}
+    for stage, values in sorted(samples.items()):
+        values = np.asarray(values)
+        stats = {'count': int(values.size), 'mean_ms': float(values.mean())}
+        for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+            stats[f'p{p}_ms'] = float(value)
+        stats['max_ms'] = float(values.max())
+        stages[stage] = stats
+    return stages
+
+
+def score_sample(sample: dict, payload: dict) -> bool:
+    """True if every expected field of a labelled sample matches; None for unlabelled samples."""
+    if not sample['formatted_top'] and not sample['formatted_bottom']:
+        return None
+    for field in ('category', 'formatted_top', 'formatted_bottom'):
+        if sample[field] and (payload.get(field) or '').strip() != sample[field]:
+            return False
+    return True
+
+
+def accuracy_summary(scored: list) -> dict:
+    """Exact-match accuracy over the labelled samples, overall and per expected category."""
+    def summarise(rows):
+        labelled = [row for row in rows if row['correct'] is not None]
+        correct = sum(1 for row in labelled if row['correct'])
+        return {
+            'labelled': len(labelled),
+            'correct': correct,
+            'exact_match': correct / len(labelled) if labelled else None,
+        }
+
+    summary = summarise(scored)
+    categories = sorted({row['category'] for row in scored if row['category']})
+    summary['categories'] = {category: summarise([row for row in scored if row['category'] == category])
+                             for category in categories}
+    return summary
+
+
+def build_report(samples: list, payloads: list, duration: float, args, overrides: dict) -> dict:
+    # Accuracy is scored on the first repeat; the pipeline is deterministic
+    scored = []
+    for sample, payload in zip(samples, payloads):
+        scored.append({
+            'image': os.path.relpath(sample['image_path'], PROJECT_ROOT),
+            'category': sample['category'] or payload.get('category') or '',
+            'expected_top': sample['formatted_top'],
+            'expected_bottom': sample['formatted_bottom'],
+            'status': payload['status'],
+            'formatted_top': payload['formatted_top'],
+            'formatted_bottom': payload['formatted_bottom'],
+            'tier': payload.get('tier'),
+            'correct': score_sample(sample, payload),
+        })
+
+    return {
+        'settings': {
+            'manifest': os.path.abspath(args.manifest),
+            'workers': args.workers,
+            'threads': args.threads,
+            'batch_size': args.batch_size,
+            'repeats': args.repeats,
+            'config': {name: overrides.get(name, getattr(config, name)) for name in sorted(
+                set(overrides) | {'INFERENCE_BACKEND', 'CASCADE_ENABLED', 'CROP_NORMALIZATION', 'EASYOCR_MODE'})},
+        },
+        'images': len(samples),
+        'processed': len(payloads),
+        'duration': duration,
+        'images_per_second': len(payloads) / duration if duration > 0 else 0.0,
+        'peak_rss_mb': _peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+        'peak_worker_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource and args.workers > 1 else None,
+        'stages': stage_percentiles(payloads),
+        'accuracy': accuracy_summary(scored),
+        'samples': scored,
+    }
+
+
+def _flatten(report: dict) -> list:
+    """(metric, value) rows of the summary figures, for the CSV output."""
+    rows = [(name, report[name]) for name in
+            ('images', 'processed', 'duration', 'images_per_second', 'peak_rss_mb', 'peak_worker_rss_mb')]
+    for stage, stats in report['stages'].items():
+        rows.extend((f"stage.{stage}.{key}", value) for key, value in stats.items())
+    accuracy = report['accuracy']
+    rows.extend((f"accuracy.{key}", accuracy[key]) for key in ('labelled', 'correct', 'exact_match'))
+    for category, stats in accuracy['categories'].items():
+        rows.extend((f"accuracy.{category}.{key}", value) for key, value in stats.items())
+    for row in report['samples']:
+        rows.append((f"sample.{row['image']}", 'ok' if row['correct'] else
+                     ('unlabelled' if row['correct'] is None else
+                      f"got '{row['formatted_top']}' / '{row['formatted_bottom']}'")))
+    return rows
+
+
+def write_report(report: dict, output_path: str):
+    """Writes the report as JSON, or as (metric, value) CSV rows for .csv outputs."""
+    if output_path.lower().endswith(".csv"):
+        with open(output_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["metric", "value"])
+            writer.writerows(_flatten(report))
+    else:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+def print_report(report: dict):
+    accuracy = report['accuracy']
+    print(f"{report['processed']} scans of {report['images']} images in {report['duration']:.1f} s "
+          f"({report['images_per_second']:.2f} images/s), peak RSS {report['peak_rss_mb'] or 0:.0f} MB"
+          + (f", largest worker {report['peak_worker_rss_mb']:.0f} MB" if report['peak_worker_rss_mb'] else ""))
+    print(f"\n{'stage':<36} {'count':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+    for stage, stats in report['stages'].items():
+        print(f"{stage:<36} {stats['count']:>6} {stats['p50_ms']:>9.1f} {stats['p90_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+
+    def fmt(stats):
+        if stats['exact_match'] is None:
+            return "no labelled samples"
+        return f"{stats['correct']}/{stats['labelled']} ({stats['exact_match']:.1%})"
+
+    print(f"\nExact match: {fmt(accuracy)}")
+    for category, stats in accuracy['categories'].items():
+        print(f"  {category:<8} {fmt(stats)}")
+    for row in report['samples']:
+        if row['correct'] is False:
+            print(f"  MISS {row['image']}: expected '{row['expected_top']}' / '{row['expected_bottom']}', "
+                  f"got '{row['formatted_top']}' / '{row['formatted_bottom']}' ({row['status']})")
+
+
+# --- Baseline Comparison ---
+def _delta(current, baseline, fmt="{:+.1f}"):
+    if current is None or baseline is None:
+        return "n/a"
+    return fmt.format(current - baseline)
+
+
+def compare_to_baseline(report: dict, baseline: dict) -> list:
+    """
+    Prints the differences to an earlier report.
+
+    Returns:
+        list: Images that were correct in the baseline and aren't any more.
+    """
+    print(f"\nAgainst baseline ({baseline['settings']['config']}):")
+    print(f"  images/s     {report['images_per_second']:.2f} ({_delta(report['images_per_second'], baseline['images_per_second'], '{:+.2f}')})")
+    print(f"  peak RSS MB  {report['peak_rss_mb'] or 0:.0f} ({_delta(report['peak_rss_mb'], baseline['peak_rss_mb'], '{:+.0f}')})")
+    current_accuracy, baseline_accuracy = report['accuracy']['exact_match'], baseline['accuracy']['exact_match']
+    print(f"  exact match  {_delta(current_accuracy, baseline_accuracy, '{:+.1%}')}")
+
+    for stage, stats in report['stages'].items():
+        before = baseline['stages'].get(stage)
+        if before:
+            print(f"  {stage:<34} p50 {_delta(stats['p50_ms'], before['p50_ms'])} ms, "
+                  f"p90 {_delta(stats['p90_ms'], before['p90_ms'])} ms")
+    for stage in sorted(set(baseline['stages']) - set(report['stages'])):
+        print(f"  {stage:<34} (only in baseline)")
+
+    before = {row['image']: row for row in baseline['samples']}
+    regressions = []
+    for row in report['samples']:
+        old = before.get(row['image'])
+        if old is None or row['correct'] is None:
+            continue
+        if old['correct'] and not row['correct']:
+            regressions.append(row['image'])
+            print(f"  REGRESSION {row['image']}: now '{row['formatted_top']}' / '{row['formatted_bottom']}'")
+        elif row['correct'] and old['correct'] is False:
+            print(f"  FIXED      {row['image']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline accuracy and throughput on labelled samples.")
+    parser.add_argument("--manifest", default=os.path.join(PROJECT_ROOT, "samples", "labels.csv"),
+                        help="CSV with image, category, formatted_top, formatted_bottom columns.")
+    parser.add_argument("--backend", choices=["torch", "onnx", "openvino"],
+                        help="YOLO inference backend (config.INFERENCE_BACKEND).")
+    parser.add_argument("--preset", action="append", default=[], metavar="CATEGORY=PATH",
+                        help="Preprocessing preset to use for a category (repeatable).")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="Override a config.py value, e.g. CASCADE_ENABLED=True (repeatable).")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes; 1 runs the in-process batch pipeline.")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="Concurrent scans in this process sharing one set of models (core/pipeline.py).")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Timed passes over the manifest.")
+    parser.add_argument("--output", help="Write the report here (.csv for metric rows, JSON otherwise).")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare against.")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit non-zero if an image correct in the baseline is now wrong.")
+    args = parser.parse_args()
+
+    log.disabled = True
+    samples = load_manifest(args.manifest)
+    if not samples:
+        parser.error(f"No images in {args.manifest}")
+    missing = [s['image_path'] for s in samples if not os.path.exists(s['image_path'])]
+    if missing:
+        parser.error(f"Images listed in the manifest don't exist: {missing}")
+
+    overrides = parse_overrides(args)
+    for name, value in overrides.items():
+        setattr(config, name, value)
+
+    payloads, duration = run_pipeline([s['image_path'] for s in samples], args.workers, args.threads,
+                                      max(1, args.batch_size), max(1, args.repeats), overrides)
+    report = build_report(samples, payloads, duration, args, overrides)
+    print_report(report)
+    if args.output:
+        write_report(report, args.output)
+        print(f"\nReport written to {args.output}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_to_baseline(report, json.load(f))
+    sys.exit(1 if regressions and args.fail_on_regression else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,4 +3,188 @@
 DEFAULT_IMAGE_PATH = None # Or set a default path like 'images/default.png'
 
 # Add other configurations as needed
-LOG_LEVEL = "INFO"
\ No newline at end of file
+LOG_LEVEL = "INFO"
+
+# --- Models ---
+# Models loaded up front by the long-running worker (--serve); everything else loads them on first use.
+# Names: "localization", "cap_characters", "easyocr"
+PRELOAD_MODELS = ("localization", "cap_characters", "easyocr")
+# Runtime for both YOLO models: "torch" (.pt), "onnx" (ONNX Runtime) or "openvino".
+# Create the exports with `python main.py --export-models onnx`; missing exports fall back to "torch".
+INFERENCE_BACKEND = "torch"
+# "default": the models above. "stub": deterministic fakes that replay the annotations in
+# STUB_FIXTURES (see core/backends/stub.py), to load-test the pipeline without the weights.
+MODEL_BACKEND = "default"
+# Fixture file of the stub backend (relative to the project folder)
+STUB_FIXTURES = "assets/stub_fixtures/samples.json"
+
+# --- EasyOCR (BOX / SOYJOY) ---
+# "detect": CRAFT text detection + recognition (readtext).
+# "recognize": recognition only, on text lines found from the crop's projection profile
+# (core/layout.py) and restricted to EASYOCR_ALLOWLISTS; falls back to "detect" when no line is found.
+EASYOCR_MODE = "detect"
+# Characters the recogniser may output per category in "recognize" mode
+EASYOCR_ALLOWLISTS = {
+    "BOX": "0123456789K",
+    "SOYJOY": "0123456789",
+}
+
+# --- Preprocessing Presets ---
+# Per-category preset file used instead of the default in core/preprocessing.py PRESET_FILES,
+# e.g. {"BOX": "assets/pipeline_presets/tuned_box.json"} while benchmarking a tuned preset
+PRESET_OVERRIDES = {}
+
+# --- Crop Normalisation ---
+# Rescale each crop to a fixed height per category before preprocessing/OCR so per-image cost is
+# bounded. OCR token boxes are mapped back to the original crop coordinates.
+CROP_NORMALIZATION = False
+CROP_TARGET_HEIGHTS = {
+    "CAP": 320,
+    "BOX": 320,
+    "SOYJOY": 240,
+}
+# Also enlarge crops smaller than the target (costs time, may help tiny prints)
+CROP_NORMALIZATION_UPSCALE = False
+
+# --- Crop Quality Gate ---
+# Reject crops that are too small, badly exposed or blurred right after cropping with a
+# "retake: ..." status instead of running preprocessing and OCR on them (see core/quality.py).
+# The thresholds sit well below the sample crops; check them on real scans before enabling.
+QUALITY_GATE_ENABLED = False
+# Height (px) the crop is scaled to before measuring sharpness
+QUALITY_ANALYSIS_HEIGHT = 96
+QUALITY_THRESHOLDS = {
+    # min_width/min_height: crop pixels (long/short side); min_sharpness: Laplacian variance;
+    # max_overexposed/max_underexposed: share of clipped pixels
+    "CAP": {"min_width": 120, "min_height": 60, "min_sharpness": 50.0,
+            "max_overexposed": 0.25, "max_underexposed": 0.5},
+    "BOX": {"min_width": 240, "min_height": 80, "min_sharpness": 50.0,
+            "max_overexposed": 0.25, "max_underexposed": 0.5},
+    "SOYJOY": {"min_width": 100, "min_height": 45, "min_sharpness": 50.0,
+               "max_overexposed": 0.25, "max_underexposed": 0.5},
+}
+
+# --- Crop Orientation ---
+# Turn sideways/upside-down crops upright before OCR by reading all four rotations in one
+# batched model call (see core/orientation.py). Costs that extra call on every scan.
+ORIENTATION_ENABLED = False
+# Rotate only when the best rotation scores this many times the upright crop
+ORIENTATION_MIN_GAIN = 1.5
+
+# --- Band-Restricted OCR ---
+# Run OCR only on the two lot-number lines found from the row profile of the crop (one
+# batched call), and split the text by the line each token was read on instead of at a
+# third of the crop height (see core/ocr.py). Crops with fewer than two lines are read whole.
+BAND_OCR_ENABLED = False
+
+# --- Cascaded OCR ---
+# Try a cheap tier first (fast preset without denoising, recognition-only EasyOCR) and only
+# escalate to the full pipeline when post-processing validation fails (see core/ocr_pipeline.py).
+# Check the fast tier's false-success rate on labelled scans before enabling it.
+CASCADE_ENABLED = False
+
+# --- Result Cache ---
+# Answer repeated uploads of the same image from a cache keyed by the decoded pixels
+# plus the model/preset versions (see core/cache.py). Cache hits don't produce debug artifacts.
+RESULT_CACHE_ENABLED = False
+# In-memory LRU size cap
+RESULT_CACHE_MEMORY_MB = 64
+# SQLite store shared by all workers (None = memory only)
+RESULT_CACHE_PATH = "cache/results.sqlite3"
+RESULT_CACHE_MAX_ENTRIES = 20000
+# Also match near-duplicates (re-encoded or resized copies) by perceptual hash.
+# Off by default: a different unit of the same product can look nearly identical.
+RESULT_CACHE_NEAR_DUPLICATES = False
+# Maximum differing bits (of 64) for a near-duplicate match
+RESULT_CACHE_NEAR_DUPLICATE_DISTANCE = 6
+
+# --- Token Store ---
+# Keep the raw OCR tokens of every scan in a SQLite sidecar so post-processing
+# rule changes can be replayed over history without re-running the models
+# (main.py --replay, see core/token_store.py)
+TOKEN_STORE_ENABLED = False
+TOKEN_STORE_PATH = "cache/tokens.sqlite3"
+
+# --- Video Mode ---
+# Gating and voting of main.py --video (see core/video.py)
+# Look at every Nth frame only
+VIDEO_FRAME_STRIDE = 1
+# Long side (px) of the grayscale thumbnail the frame gate measures on
+VIDEO_GATE_SIZE = 160
+# Skip frames whose thumbnail Laplacian variance is below this (blurred)
+VIDEO_MIN_SHARPNESS = 50.0
+# Skip frames whose thumbnail differs from the previous one by more than this mean grey level (moving)
+VIDEO_MAX_MOTION = 6.0
+# A detection belongs to the current product if its box overlaps the last one by this IoU
+VIDEO_SAME_OBJECT_IOU = 0.3
+# The box counts as still while consecutive boxes overlap by this IoU...
+VIDEO_STABLE_IOU = 0.85
+# ...and a product is only OCRed once it has been still for this many localized frames
+VIDEO_STABLE_FRAMES = 2
+# Readings fused per product
+VIDEO_MAX_OCR_PER_TRACK = 5
+# Frames without a detection after which a product has left and its result is reported
+VIDEO_TRACK_GAP = 15
+
+# --- Parallel Batch Processing ---
+# Worker processes for bulk scans (None or 0 -> one per CPU core)
+PARALLEL_WORKERS = None
+# Torch/OpenCV threads inside each worker; keep at 1 so N workers don't oversubscribe N cores
+THREADS_PER_WORKER = 1
+
+# --- Threaded Pipeline ---
+# Concurrent scans inside one process with one copy of the models (core/pipeline.py),
+# used by `--serve --threads N` and `--threads N` batch runs
+PIPELINE_THREADS = 4
+# How the threads share each model: "shared" (model must be thread-safe), "locked" (one call
+# at a time) or "per_thread" (a copy per thread: no waiting, but N times the memory).
+# ultralytics predictors keep per-call state, so the two small YOLO models get a copy per thread
+# and their inference runs in parallel. The EasyOCR reader (CRAFT + CRNN, by far the largest
+# model) stays "locked": a copy per thread multiplies its memory, and its torch kernels already
+# use several cores per call. Switch it to "per_thread" when memory allows.
+MODEL_CONCURRENCY = {
+    "localization": "per_thread",
+    "cap_characters": "per_thread",
+    "easyocr": "locked",
+}
+
+# --- Debug Artifacts ---
+# Intermediate images saved in a folder next to each upload:
+# "off", "errors" (only scans that fail validation), "sampled" or "always".
+# Opt in to "sampled"/"always" for debugging: each kept scan encodes and writes several images.
+ARTIFACT_POLICY = "errors"
+# Fraction of scans kept when ARTIFACT_POLICY is "sampled"
+ARTIFACT_SAMPLE_RATE = 0.05
+# "jpg", "png" or "webp"; quality is 0-100
+ARTIFACT_FORMAT = "jpg"
+ARTIFACT_QUALITY = 90
+# Artifacts waiting for the background writer; new ones are dropped when full
+ARTIFACT_QUEUE_SIZE = 64
+
+# --- Detection Selection ---
+# Localization detections below this confidence are ignored
+DETECTION_MIN_CONFIDENCE = 0.0
+# Number of objects (largest first) run through OCR per image; extra objects are reported under 'objects'
+DETECTION_TOP_K = 1
+
+# --- Downscaled Detection ---
+# Frame fed to the localization model; crops for OCR always come from the full-resolution image.
+# "off": full frame, "reduced": JPEG decoder downscales by DETECTION_REDUCE_FACTOR (2, 4 or 8),
+# "resize": full decode, then resize so the long side is DETECTION_INPUT_SIZE.
+# Changes the detector input (and so boxes and crops): compare against a full-frame run with
+# benchmarks/run_benchmark.py --set DETECTION_DOWNSCALE_MODE=reduced --baseline ... before enabling.
+DETECTION_DOWNSCALE_MODE = "off"
+DETECTION_REDUCE_FACTOR = 4
+# Localization model input size; frames are never downscaled below it
+DETECTION_INPUT_SIZE = 640
+
+# --- Profiling ---
+# Report the peak Python/NumPy allocations per stage with tracemalloc (slow); otherwise the
+# per-stage RSS delta (not a peak) is reported. tracemalloc peaks are only valid while one scan
+# runs at a time, so overlapping scans (--threads > 1, threaded --serve) report the RSS delta
+# either way. The payload's "memory_metric" says which one "memory" holds.
+PROFILE_TRACEMALLOC = False
+# Keep cProfile traces of the N slowest scans (0 = off, cProfile adds noticeable overhead)
+PROFILE_SLOWEST_N = 0
+# Where dump_slowest_profiles() writes the .prof files (relative to the working directory)
+PROFILE_DIR = "profiles"
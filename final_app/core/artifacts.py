@@ -0,0 +1,139 @@
+# core/artifacts.py
+import os
+import queue
+import random
+import threading
+import cv2
+from utils.logger import log
+import config
+
+# --- Debug Artifacts ---
+# Intermediate images (detection preview, raw crop, preprocessed crop, OCR
+# boxes) are written next to the upload in a folder named after it. Capture is
+# governed by config.ARTIFACT_POLICY and all encoding/drawing/disk I/O happens
+# on a background writer thread, so it never adds to scan latency.
+
+ARTIFACT_POLICIES = ("off", "errors", "sampled", "always")
+
+
+def _encode_params(fmt: str, quality: int) -> list:
+    """Returns the cv2.imencode parameters for the configured format and quality."""
+    if fmt in ("jpg", "jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if fmt == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    if fmt == "png":
+        # Map 0-100 quality onto PNG's 9-0 compression level
+        return [cv2.IMWRITE_PNG_COMPRESSION, max(0, min(9, 9 - int(quality) // 11))]
+    return []
+
+
+class ArtifactWriter:
+    """Background thread that renders, encodes and writes artifacts from a bounded queue."""
+
+    def __init__(self, queue_size: int):
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="artifact-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, path: str, render, fmt: str, quality: int) -> bool:
+        """Queues an artifact. Drops it (returns False) instead of blocking when the queue is full."""
+        try:
+            self._queue.put_nowait((path, render, fmt, quality))
+            return True
+        except queue.Full:
+            log.warning(f"Artifact queue full, dropping {path}")
+            return False
+
+    def flush(self):
+        """Blocks until every queued artifact has been written."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            path, render, fmt, quality = self._queue.get()
+            try:
+                image = render()
+                if image is not None:
+                    ok, encoded = cv2.imencode(f".{fmt}", image, _encode_params(fmt, quality))
+                    if not ok:
+                        raise ValueError(f"cv2.imencode failed for format '{fmt}'")
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, 'wb') as f:
+                        f.write(encoded.tobytes())
+            except Exception as e:
+                log.error(f"Failed to write artifact {path}: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> ArtifactWriter:
+    """Returns the process-wide artifact writer, starting it on first use."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = ArtifactWriter(config.ARTIFACT_QUEUE_SIZE)
+    return _writer
+
+
+def flush():
+    """Waits for pending artifacts; call before a one-shot process exits."""
+    if _writer is not None:
+        _writer.flush()
+
+
+class ArtifactSession:
+    """
+    Collects the artifacts of one scan and hands them to the writer on commit.
+
+    Artifacts are added as callables that produce the image, so nothing is
+    copied or drawn unless the policy decides the scan is actually kept.
+    """
+
+    def __init__(self, image_path: str = None, policy: str = None):
+        self.policy = policy or config.ARTIFACT_POLICY
+        if self.policy not in ARTIFACT_POLICIES:
+            log.warning(f"Unknown artifact policy '{self.policy}', using 'off'")
+            self.policy = "off"
+
+        self.output_dir = None
+        if image_path:
+            base_name = os.path.splitext(os.path.basename(image_path))[0]
+            self.output_dir = os.path.join(os.path.dirname(image_path), base_name)
+
+        if self.policy == "sampled":
+            self.enabled = random.random() < config.ARTIFACT_SAMPLE_RATE
+        else:
+            self.enabled = self.policy != "off"
+        self.enabled = self.enabled and self.output_dir is not None
+        self._pending = {}
+
+    def add(self, name: str, render):
+        """
+        Registers an artifact. Adding a name again replaces the earlier image
+        (e.g. when a cascaded OCR run escalates to the next tier).
+
+        Args:
+            name (str): File name without extension, e.g. '02_preprocessed'.
+            render (callable): Returns the image to save; called on the writer thread.
+        """
+        if self.enabled:
+            self._pending[name] = render
+
+    def commit(self, success: bool = True):
+        """Queues the collected artifacts for writing if the policy keeps this scan."""
+        pending, self._pending = self._pending, {}
+        if not self.enabled or not pending:
+            return
+        if self.policy == "errors" and success:
+            return
+
+        fmt = config.ARTIFACT_FORMAT.lower().lstrip('.')
+        writer = get_writer()
+        for name, render in pending.items():
+            writer.submit(os.path.join(self.output_dir, f"{name}.{fmt}"), render, fmt, config.ARTIFACT_QUALITY)
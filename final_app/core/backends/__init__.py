@@ -0,0 +1,2 @@
+# core/backends/__init__.py
+from core.backends.base import Boxes, DetectionResult, Detector, TextRecognizer
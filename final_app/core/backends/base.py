@@ -0,0 +1,79 @@
+# core/backends/base.py
+from abc import ABC, abstractmethod
+from collections import namedtuple
+import numpy as np
+
+# --- Backend Interface ---
+# The pipeline needs three models, each loaded through core/models.py:
+#   'localization'    Detector       - finds the CAP/BOX/SOYJOY object in a frame
+#   'cap_characters'  Detector       - finds the single characters of a CAP print
+#   'easyocr'         TextRecognizer - reads the BOX/SOYJOY text lines
+# The shapes follow what the pipeline was written against (ultralytics results
+# and the EasyOCR reader), so the real implementations pass their native
+# outputs straight through and other backends build the same shapes.
+#
+# The batch calls optionally take one Region per image (None for a whole
+# crop): the crop an image was cut from and its [x1, y1, x2, y2] box in it,
+# e.g. for the text-line bands of core/ocr.py (BAND_OCR_ENABLED). The real
+# models read pixels only and ignore it; the stubs match their fixtures on it.
+Region = namedtuple("Region", ["parent", "box"])
+
+
+class Boxes:
+    """Detections of one image as parallel arrays, like ultralytics' Results.boxes."""
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=np.float32).reshape(-1)
+        self.cls = np.asarray(cls, dtype=np.float32).reshape(-1)
+
+    def __len__(self):
+        return len(self.conf)
+
+
+class DetectionResult:
+    """Detections of one image (`boxes`) with the detector's class id -> name mapping (`names`)."""
+
+    def __init__(self, boxes: Boxes, names: dict):
+        self.boxes = boxes
+        self.names = names
+
+
+class Detector(ABC):
+    """
+    An object detector. Called with one image or a list of images (run as one
+    batch) and returns one result per image; each result has `.boxes`
+    (xyxy/conf/cls) and `.names`.
+    """
+
+    @property
+    @abstractmethod
+    def names(self) -> dict:
+        """Class id -> class name."""
+
+    @abstractmethod
+    def predict(self, images: list, regions: list = None) -> list:
+        """Returns one result per image, in input order (`regions`: optional Region or None per image)."""
+
+    def __call__(self, source, regions: list = None):
+        images = source if isinstance(source, list) else [source]
+        return self.predict(images, regions)
+
+
+class TextRecognizer(ABC):
+    """
+    A text line reader. Both methods return EasyOCR-style
+    (polygon [[x, y] x 4], text, confidence) tuples.
+    """
+
+    @abstractmethod
+    def readtext(self, image: np.ndarray) -> list:
+        """Finds and reads every text line in the image."""
+
+    @abstractmethod
+    def recognize(self, image: np.ndarray, horizontal_list: list, free_list: list, allowlist: str = None) -> list:
+        """Reads the given line boxes ([x_min, x_max, y_min, y_max]) only, restricted to `allowlist`."""
+
+    def readtext_batch(self, images: list, regions: list = None) -> list:
+        """readtext for several images; backends that can batch them override this."""
+        return [self.readtext(image) for image in images]
@@ -0,0 +1,32 @@
+# core/backends/easyocr_reader.py
+from core.backends.base import TextRecognizer
+
+
+class EasyOCRRecognizer(TextRecognizer):
+    """An easyocr.Reader (CRAFT text detection + CRNN recognition)."""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    @classmethod
+    def load(cls, languages=('en',), gpu: bool = False):
+        import easyocr
+        return cls(easyocr.Reader(list(languages), gpu=gpu))
+
+    def readtext(self, image):
+        return self.reader.readtext(image)
+
+    def readtext_batch(self, images: list, regions: list = None) -> list:
+        # readtext_batched needs equally sized images, so batch per shape
+        results = [None] * len(images)
+        by_shape = {}
+        for index, image in enumerate(images):
+            by_shape.setdefault(image.shape, []).append(index)
+        for indices in by_shape.values():
+            for index, result in zip(indices, self.reader.readtext_batched([images[i] for i in indices])):
+                results[index] = result
+        return results
+
+    def recognize(self, image, horizontal_list: list, free_list: list, allowlist: str = None):
+        return self.reader.recognize(image, horizontal_list=horizontal_list, free_list=free_list,
+                                     allowlist=allowlist)
@@ -0,0 +1,233 @@
+# core/backends/stub.py
+import json
+import os
+import threading
+import cv2
+import numpy as np
+from core.backends.base import Boxes, DetectionResult, Detector, TextRecognizer
+from core.cache import difference_hash
+from utils.logger import log
+
+# --- Stub Backends ---
+# Deterministic stand-ins for the three models, driven by a fixture file of
+# annotated images (config.MODEL_BACKEND = "stub"). They answer in microseconds,
+# so a stub run measures only the pipeline around the models: decoding,
+# preprocessing, overlap suppression, splitting and post-processing.
+#
+# Fixture file (paths relative to the file):
+#   {"images": [{"image": "../../samples/cap.jpg", "category": "CAP",
+#                "box": [x1, y1, x2, y2], "confidence": 0.9,
+#                "lines": ["28.10.24 K2", "06:49"]}, ...]}
+#
+# The stubs only ever see arrays, so inputs are matched to fixture entries by:
+#   frames  the nearest difference hash of the whole frame (any downscale mode)
+#   crops   the entry whose box has the crop's size, within CROP_SIZE_TOLERANCE
+#           (preprocessing changes a crop's pixels but not its size), else the
+#           nearest aspect ratio (e.g. for rescaled crops, see CROP_NORMALIZATION)
+#   bands   images passed with a Region (text-line bands, BAND_OCR_ENABLED) are
+#           matched on the crop they were cut from, and get one fixture line
+#           each: the bands of a crop in a call, top to bottom
+# Images that aren't in the fixture get the nearest entry, so any image set
+# can be pushed through the pipeline.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(os.path.dirname(SCRIPT_DIR))
+
+# Confidence of the stub characters and text lines
+STUB_TEXT_CONFIDENCE = 0.99
+# Vertical extent of the first and second text line, as fractions of the crop
+# height (the first line lies above split_text_top_bottom's 1/3 split)
+LINE_ROWS = ((0.08, 0.28), (0.5, 0.8))
+# Horizontal extent of the text lines, as fractions of the crop width
+LINE_COLUMNS = (0.05, 0.95)
+# Vertical extent of the text line within a band image, as fractions of the band height
+BAND_ROWS = (0.1, 0.9)
+# Pixels a crop may differ from its fixture box per side (rounding of downscaled detection)
+CROP_SIZE_TOLERANCE = 10
+# Categories read by the EasyOCR recogniser (CAP goes to the character detector)
+RECOGNIZER_CATEGORIES = ("BOX", "SOYJOY")
+
+
+class FixtureEntry:
+    """One annotated image: its object box (as fractions of the frame) and text lines."""
+
+    def __init__(self, spec: dict, base_dir: str):
+        path = spec['image'] if os.path.isabs(spec['image']) else os.path.join(base_dir, spec['image'])
+        image = cv2.imread(path)
+        if image is None:
+            raise FileNotFoundError(f"Stub fixture image not found: {path}")
+        height, width = image.shape[:2]
+        x1, y1, x2, y2 = spec['box']
+
+        self.image = os.path.basename(path)
+        self.category = spec['category'].upper()
+        self.confidence = float(spec.get('confidence', 0.9))
+        self.lines = list(spec.get('lines', []))
+        self.relative_box = np.array([x1 / width, y1 / height, x2 / width, y2 / height], dtype=np.float32)
+        self.size = (x2 - x1, y2 - y1)
+        self.aspect = (x2 - x1) / float(max(1, y2 - y1))
+        self.dhash = np.unpackbits(np.frombuffer(difference_hash(image), dtype=np.uint8))
+
+
+def _match_crop(entries: list, image: np.ndarray) -> FixtureEntry:
+    """Returns the entry whose box has the size of the crop, else the one with the nearest aspect ratio."""
+    height, width = image.shape[:2]
+    size_errors = [max(abs(entry.size[0] - width), abs(entry.size[1] - height)) for entry in entries]
+    best = int(np.argmin(size_errors))
+    if size_errors[best] <= 2 * CROP_SIZE_TOLERANCE:
+        return entries[best]
+    aspect = width / float(max(1, height))
+    # Compare on a log scale so 2:1 and 1:2 are equally far from 1:1
+    return min(entries, key=lambda entry: abs(np.log(entry.aspect / aspect)))
+
+
+def _line_boxes(width: int, height: int, count: int) -> list:
+    """[x1, y1, x2, y2] of the stub text lines of a crop."""
+    x1, x2 = int(LINE_COLUMNS[0] * width), int(LINE_COLUMNS[1] * width)
+    return [[x1, int(top * height), x2, int(bottom * height)] for top, bottom in LINE_ROWS[:count]]
+
+
+def _text_lines(entries: list, image: np.ndarray, regions: list = None, index: int = 0) -> list:
+    """(text, [x1, y1, x2, y2]) of the stub text lines of the `index`-th input image."""
+    region = regions[index] if regions else None
+    height, width = image.shape[:2]
+    if region is None:
+        entry = _match_crop(entries, image)
+        return list(zip(entry.lines, _line_boxes(width, height, len(entry.lines))))
+
+    entry = _match_crop(entries, region.parent)
+    # The bands of the same crop in this call, top to bottom, read the fixture lines in order
+    tops = sorted(other.box[1] for other in regions if other is not None and other.parent is region.parent)
+    line_index = tops.index(region.box[1])
+    if line_index >= len(entry.lines):
+        return []
+    box = [int(LINE_COLUMNS[0] * width), int(BAND_ROWS[0] * height),
+           int(LINE_COLUMNS[1] * width), int(BAND_ROWS[1] * height)]
+    return [(entry.lines[line_index], box)]
+
+
+def _polygon(box) -> list:
+    x1, y1, x2, y2 = box
+    return [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+
+
+class StubLocalizer(Detector):
+    """Returns the fixture box of the most similar fixture image, scaled to the frame."""
+
+    def __init__(self, entries: list, names: dict):
+        self.entries = entries
+        self._names = names
+        self._class_ids = {name: class_id for class_id, name in names.items()}
+        self._hashes = np.stack([entry.dhash for entry in entries])
+
+    @property
+    def names(self) -> dict:
+        return self._names
+
+    def match(self, frame: np.ndarray) -> FixtureEntry:
+        bits = np.unpackbits(np.frombuffer(difference_hash(frame), dtype=np.uint8))
+        return self.entries[int(np.argmin((self._hashes != bits).sum(axis=1)))]
+
+    def predict(self, images: list, regions: list = None) -> list:
+        results = []
+        for frame in images:
+            entry = self.match(frame)
+            height, width = frame.shape[:2]
+            box = entry.relative_box * np.array([width, height, width, height], dtype=np.float32)
+            results.append(DetectionResult(
+                Boxes([box], [entry.confidence], [self._class_ids[entry.category]]), self._names))
+        return results
+
+
+class StubCharacterDetector(Detector):
+    """Returns the characters of the fixture CAP lines, evenly spaced along two text lines."""
+
+    def __init__(self, entries: list):
+        self.entries = entries
+        characters = sorted({c for entry in entries for line in entry.lines for c in line if c.isalnum()})
+        self._names = dict(enumerate(characters))
+        self._class_ids = {c: class_id for class_id, c in self._names.items()}
+
+    @property
+    def names(self) -> dict:
+        return self._names
+
+    def predict(self, images: list, regions: list = None) -> list:
+        results = []
+        for index, image in enumerate(images):
+            xyxy, classes = [], []
+            for line, (x1, y1, x2, y2) in _text_lines(self.entries, image, regions, index):
+                step = (x2 - x1) / float(max(1, len(line)))
+                for i, c in enumerate(line):
+                    if c in self._class_ids:
+                        # Leave a gap between neighbours so no box overlaps another
+                        xyxy.append([x1 + i * step, y1, x1 + (i + 0.8) * step, y2])
+                        classes.append(self._class_ids[c])
+            results.append(DetectionResult(
+                Boxes(xyxy, [STUB_TEXT_CONFIDENCE] * len(classes), classes), self._names))
+        return results
+
+
+class StubTextRecognizer(TextRecognizer):
+    """Returns the fixture lines of the matching BOX/SOYJOY entry."""
+
+    def __init__(self, entries: list):
+        self.entries = entries
+
+    def readtext(self, image: np.ndarray) -> list:
+        return [(_polygon(box), line, STUB_TEXT_CONFIDENCE) for line, box in _text_lines(self.entries, image)]
+
+    def readtext_batch(self, images: list, regions: list = None) -> list:
+        return [[(_polygon(box), line, STUB_TEXT_CONFIDENCE)
+                 for line, box in _text_lines(self.entries, image, regions, index)]
+                for index, image in enumerate(images)]
+
+    def recognize(self, image: np.ndarray, horizontal_list: list, free_list: list, allowlist: str = None) -> list:
+        entry = _match_crop(self.entries, image)
+        if len(horizontal_list) == len(entry.lines):
+            # One fixture line per requested line box, top to bottom
+            boxes = [[x_min, y_min, x_max, y_max] for x_min, x_max, y_min, y_max
+                     in sorted(horizontal_list, key=lambda b: b[2])]
+        else:
+            height, width = image.shape[:2]
+            boxes = _line_boxes(width, height, len(entry.lines))
+        results = []
+        for line, box in zip(entry.lines, boxes):
+            if allowlist:
+                line = "".join(c for c in line if c in allowlist)
+            results.append((_polygon(box), line, STUB_TEXT_CONFIDENCE))
+        return results
+
+
+class StubModels:
+    """The three stub models built from one fixture file."""
+
+    def __init__(self, fixture_path: str):
+        with open(fixture_path, 'r', encoding='utf-8') as f:
+            specs = json.load(f)['images']
+        base_dir = os.path.dirname(os.path.abspath(fixture_path))
+        entries = [FixtureEntry(spec, base_dir) for spec in specs]
+        if not entries:
+            raise ValueError(f"Stub fixture {fixture_path} has no images")
+
+        categories = sorted({entry.category for entry in entries} | {"BOX", "CAP", "SOYJOY"})
+        self.localizer = StubLocalizer(entries, dict(enumerate(categories)))
+        cap_entries = [entry for entry in entries if entry.category == "CAP"] or entries
+        text_entries = [entry for entry in entries if entry.category in RECOGNIZER_CATEGORIES] or entries
+        self.character_detector = StubCharacterDetector(cap_entries)
+        self.text_recognizer = StubTextRecognizer(text_entries)
+        log.info(f"Loaded stub models for {len(entries)} fixture images from {fixture_path}")
+
+
+_stub_models = {}
+_stub_lock = threading.Lock()
+
+
+def load_stub_models(fixture_path: str) -> StubModels:
+    """Returns the stub models of a fixture file (relative paths are resolved against the project folder)."""
+    if not os.path.isabs(fixture_path):
+        fixture_path = os.path.join(PROJECT_ROOT, fixture_path)
+    with _stub_lock:
+        if fixture_path not in _stub_models:
+            _stub_models[fixture_path] = StubModels(fixture_path)
+        return _stub_models[fixture_path]
@@ -0,0 +1,17 @@
+# core/backends/yolo.py
+from core.backends.base import Detector
+
+
+class YoloDetector(Detector):
+    """An ultralytics YOLO model (PyTorch weights or an ONNX Runtime / OpenVINO export)."""
+
+    def __init__(self, model):
+        self.model = model
+
+    @property
+    def names(self) -> dict:
+        return self.model.names
+
+    def predict(self, images: list, regions: list = None) -> list:
+        # A list input is run as one batch; the Results objects are passed through unchanged
+        return list(self.model(images))
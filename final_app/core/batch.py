@@ -0,0 +1,310 @@
+# core/batch.py
+import csv
+import glob
+import os
+import queue
+import threading
+import time
+import cv2
+from core.artifacts import ArtifactSession
+from core.cache import get_result_cache, is_cacheable
+from core.detection import detect_objects_batch, read_detection_frame, map_detection_to_source
+from core.ocr_pipeline import run_ocr_pipeline_batch
+from core.processing import select_for_ocr, attach_detection, prepare_crop, finish_crop, summarize_object
+from core.result_schema import build_result_payload, dumps
+from utils.logger import log
+from utils import profiling
+
+# --- Configuration ---
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+DEFAULT_BATCH_SIZE = 8
+# Number of decoded images the prefetch thread may keep ready ahead of inference
+PREFETCH_QUEUE_SIZE = 16
+
+CSV_COLUMNS = [
+    "image_path", "status", "message", "category",
+    "formatted_top", "formatted_bottom",
+    "detection_box", "detection_confidence", "duration",
+]
+
+
+# --- Input Collection ---
+def collect_image_paths(input_dir: str = None, pattern: str = None, manifest: str = None) -> list:
+    """
+    Collects the images to process from a directory, a glob pattern and/or a
+    manifest file (one image path per line, relative paths resolved against the
+    manifest's folder, blank lines and '#' comments ignored).
+
+    Returns:
+        list: Sorted, de-duplicated list of image paths.
+    """
+    paths = []
+
+    if input_dir:
+        for name in os.listdir(input_dir):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(input_dir, name))
+
+    if pattern:
+        paths.extend(p for p in glob.glob(pattern, recursive=True) if p.lower().endswith(IMAGE_EXTENSIONS))
+
+    if manifest:
+        manifest_dir = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                paths.append(line if os.path.isabs(line) else os.path.join(manifest_dir, line))
+
+    return sorted(set(paths))
+
+
+def _prefetch_images(image_paths: list, queue_size: int = PREFETCH_QUEUE_SIZE):
+    """
+    Yields (image_path, detection_frame, full_frame) tuples (see
+    read_detection_frame) while a background thread decodes the next images,
+    so JPEG decoding overlaps with inference. `detection_frame` is None if the
+    file could not be read.
+    """
+    decoded = queue.Queue(maxsize=queue_size)
+    done = object()
+
+    def reader():
+        for image_path in image_paths:
+            with profiling.stage('decode'):
+                frames = read_detection_frame(image_path)
+            decoded.put((image_path, *frames))
+        decoded.put(done)
+
+    thread = threading.Thread(target=reader, name="image-prefetch", daemon=True)
+    thread.start()
+
+    while True:
+        item = decoded.get()
+        if item is done:
+            break
+        yield item
+
+
+def _chunks(iterable, size: int):
+    """Groups an iterable into lists of at most `size` items."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# --- Batch Processing ---
+def process_chunk(chunk: list) -> list:
+    """
+    Processes a list of (image_path, detection_frame, full_frame) tuples: one
+    batched localization pass, then the full-resolution crops grouped by
+    category for a batched OCR stage.
+
+    Returns:
+        list: One process_image-style result per input, in input order.
+    """
+    results = [None] * len(chunk)
+
+    valid = [(index, image_path, frame, image) for index, (image_path, frame, image) in enumerate(chunk) if frame is not None]
+    for index, (image_path, frame, _) in enumerate(chunk):
+        if frame is None:
+            log.error(f"Could not read image file: {image_path}")
+            results[index] = {"error": f"Could not read image file: {image_path}"}
+
+    # Images already in the result cache skip detection and OCR
+    result_cache = get_result_cache()
+    cache_probes = {}
+    if result_cache is not None:
+        remaining = []
+        for item in valid:
+            probe = result_cache.probe(item[2])
+            cached_result = result_cache.get(probe)
+            if cached_result is not None:
+                results[item[0]] = cached_result
+            else:
+                cache_probes[item[0]] = probe
+                remaining.append(item)
+        valid = remaining
+
+    if not valid:
+        return results
+
+    batch_timings = {}
+    with profiling.stage('detection_batch', batch_timings):
+        detections, model = detect_objects_batch([frame for _, _, frame, _ in valid])
+    # Attribute the shared detection time evenly to every image of the batch
+    detection_time = batch_timings['detection_batch'] / len(valid)
+
+    if detections is None:
+        for index, _, _, _ in valid:
+            results[index] = {"error": "Detection failed"}
+        return results
+
+    # Group the crops by category for the second stage. The extra objects (DETECTION_TOP_K > 1)
+    # are OCRed in the same batches; their slot is their position under 'objects', None for the largest.
+    groups = {}  # category -> list of (index, slot, artifacts, cropped_image, detection, orientation angle)
+    objects = {}  # index -> summaries of the extra objects
+    for (index, image_path, frame, image), detection_result in zip(valid, detections):
+        selected = select_for_ocr(detection_result, model)
+        if not selected:
+            log.warning(f"No valid detections found in image: {image_path}")
+            results[index] = "No valid detections"
+            continue
+        if image is None:
+            # Full-resolution decode only for images that have something to crop
+            image = cv2.imread(image_path)
+            if image is None:
+                results[index] = {"error": f"Could not read image file: {image_path}"}
+                continue
+        selected = [map_detection_to_source(d, frame.shape, image.shape) for d in selected]
+        largest_detection = selected[0]
+        artifacts = ArtifactSession(image_path)
+        cropped_image, angle, rejection = prepare_crop(image, largest_detection, artifacts)
+        if rejection is not None:
+            results[index] = attach_detection(rejection, largest_detection, detection_time)
+            continue
+        groups.setdefault(largest_detection['category'], []).append(
+            (index, None, artifacts, cropped_image, largest_detection, angle))
+
+        if len(selected) > 1:
+            objects[index] = [None] * (len(selected) - 1)
+            for slot, detection in enumerate(selected[1:]):
+                object_crop, object_angle, object_rejection = prepare_crop(image, detection)
+                if object_rejection is not None:
+                    objects[index][slot] = summarize_object(object_rejection, detection)
+                    continue
+                groups.setdefault(detection['category'], []).append(
+                    (index, slot, None, object_crop, detection, object_angle))
+
+    for category, items in groups.items():
+        ocr_results = run_ocr_pipeline_batch(
+            [item[3] for item in items], category, [item[2] for item in items])
+        for (index, slot, artifacts, cropped_image, detection, angle), ocr_result in zip(items, ocr_results):
+            finish_crop(chunk[index][0], ocr_result, cropped_image, angle, artifacts)
+            if slot is None:
+                results[index] = attach_detection(ocr_result, detection, detection_time)
+            else:
+                objects[index][slot] = summarize_object(ocr_result, detection)
+
+    # Cache only once the extra objects are attached, like process_image
+    for index, result in enumerate(results):
+        if not isinstance(result, dict) or 'tokens' not in result:
+            continue
+        if index in objects:
+            result['objects'] = objects[index]
+        if index in cache_probes and is_cacheable(result):
+            result_cache.put(cache_probes[index], result)
+
+    return results
+
+
+def iter_batch_results(image_paths: list, batch_size: int = DEFAULT_BATCH_SIZE):
+    """
+    Processes the images in chunks of `batch_size` and yields one schema
+    payload (see core/result_schema.py) per image, in input order.
+    """
+    for chunk in _chunks(_prefetch_images(image_paths), batch_size):
+        chunk_start = time.perf_counter()
+        try:
+            chunk_results = process_chunk(chunk)
+        except Exception as e:
+            log.error(f"Error processing batch: {e}", exc_info=True)
+            chunk_results = [{"error": str(e)}] * len(chunk)
+        duration = (time.perf_counter() - chunk_start) / len(chunk)
+        for _ in chunk:
+            profiling.observe('total', duration)
+
+        for (image_path, _, _), result in zip(chunk, chunk_results):
+            payload = build_result_payload(result, image_path)
+            payload['timings']['total'] = duration
+            yield payload
+
+
+# --- Output ---
+def _csv_row(payload: dict) -> dict:
+    """Flattens a result payload into one CSV row."""
+    detection = payload.get('detection') or {}
+    return {
+        "image_path": payload['image_path'],
+        "status": payload['status'],
+        "message": payload['message'],
+        "category": payload['category'] or '',
+        "formatted_top": payload['formatted_top'],
+        "formatted_bottom": payload['formatted_bottom'],
+        "detection_box": " ".join(str(v) for v in detection.get('box', [])),
+        "detection_confidence": detection.get('confidence', ''),
+        "duration": f"{payload['timings'].get('total', 0):.4f}",
+    }
+
+
+def write_results(payloads, output_path: str) -> dict:
+    """
+    Writes one row per image as they are produced. `.jsonl`/`.ndjson` outputs
+    keep the full payload, anything else is written as CSV.
+
+    Returns:
+        dict: Summary counts {'total', 'success', 'error', 'categories'}.
+    """
+    summary = {'total': 0, 'success': 0, 'error': 0, 'categories': {}}
+    as_json = output_path.lower().endswith((".jsonl", ".ndjson"))
+
+    with open(output_path, 'w', encoding='utf-8', newline='') as f:
+        writer = None if as_json else csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        if writer:
+            writer.writeheader()
+
+        for payload in payloads:
+            if as_json:
+                f.write(dumps(payload) + "\n")
+            else:
+                writer.writerow(_csv_row(payload))
+            f.flush()
+
+            summary['total'] += 1
+            summary['success' if payload['status'] == 'success' else 'error'] += 1
+            category = payload['category'] or 'NONE'
+            summary['categories'][category] = summary['categories'].get(category, 0) + 1
+
+    return summary
+
+
+def run_batch(image_paths: list, output_path: str, batch_size: int = DEFAULT_BATCH_SIZE, workers: int = 1,
+              threads: int = 1) -> dict:
+    """
+    Processes all images and writes the results to `output_path`.
+
+    With `workers` > 1 the images are spread over a process pool (see
+    core/parallel.py), with `threads` > 1 over a thread pool sharing one set
+    of models (see core/pipeline.py), instead of being batched inside this process.
+    """
+    start_time = time.perf_counter()
+    pipeline = None
+    if workers > 1:
+        from core.parallel import run_parallel
+        log.info(f"Starting parallel run of {len(image_paths)} images on {workers} workers.")
+        payloads = run_parallel(image_paths, workers)
+    elif threads > 1:
+        from core.pipeline import Pipeline
+        log.info(f"Starting threaded run of {len(image_paths)} images on {threads} threads.")
+        pipeline = Pipeline(threads)
+        pipeline.preload()
+        payloads = pipeline.map(image_paths)
+    else:
+        log.info(f"Starting batch of {len(image_paths)} images (batch size {batch_size}).")
+        payloads = iter_batch_results(image_paths, batch_size)
+
+    try:
+        summary = write_results(payloads, output_path)
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+    summary['duration'] = time.perf_counter() - start_time
+    summary['images_per_second'] = summary['total'] / summary['duration'] if summary['duration'] > 0 else 0.0
+    log.info(f"Batch finished: {summary}")
+    return summary
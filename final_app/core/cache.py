@@ -0,0 +1,312 @@
+# core/cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import cv2
+import numpy as np
+from core.models import YOLO_MODEL_PATHS, exported_model_path
+from core.preprocessing import PRESET_FILES, FAST_PRESET_FILES
+from core.result_schema import dumps
+from utils.logger import log
+import config
+
+# --- Result Cache ---
+# Re-shot or re-uploaded images are answered without running detection or OCR.
+# Entries are keyed by a hash of the decoded detection frame together with a
+# fingerprint of everything that can change a result: the model files, the
+# preset files, the relevant config values and PIPELINE_VERSION. Editing a
+# preset or swapping a model therefore misses the old entries automatically.
+#
+# Layers, checked in order:
+#   memory          - exact key, in-process LRU capped at RESULT_CACHE_MEMORY_MB
+#   disk            - exact key, SQLite file at RESULT_CACHE_PATH (shared by workers)
+#   near_duplicate  - optional difference-hash match within a Hamming distance. The
+#                     result was read from a similar frame, not this one: its
+#                     detection box is moved to cache.matched_detection and
+#                     'detection' is null, as nothing was localised in this frame.
+
+# Bump when a code change alters the results for the same inputs
+PIPELINE_VERSION = 1
+
+# Config values that influence a result
+FINGERPRINT_CONFIG = (
+    "MODEL_BACKEND", "STUB_FIXTURES", "INFERENCE_BACKEND", "PRESET_OVERRIDES",
+    "EASYOCR_MODE", "EASYOCR_ALLOWLISTS", "CASCADE_ENABLED",
+    "QUALITY_GATE_ENABLED", "QUALITY_ANALYSIS_HEIGHT", "QUALITY_THRESHOLDS",
+    "ORIENTATION_ENABLED", "ORIENTATION_MIN_GAIN", "BAND_OCR_ENABLED",
+    "CROP_NORMALIZATION", "CROP_TARGET_HEIGHTS", "CROP_NORMALIZATION_UPSCALE",
+    "DETECTION_MIN_CONFIDENCE", "DETECTION_TOP_K",
+    "DETECTION_DOWNSCALE_MODE", "DETECTION_REDUCE_FACTOR", "DETECTION_INPUT_SIZE",
+)
+
+# The fingerprint is memoized: recomputed at once when a FINGERPRINT_CONFIG value
+# changes, and the model/preset files are re-stat'ed at most this often (seconds)
+FINGERPRINT_RECHECK_SECONDS = 2.0
+
+# Side of the difference hash grid (hash has DHASH_SIZE * DHASH_SIZE bits)
+DHASH_SIZE = 8
+# Near-duplicate candidates kept in memory for the Hamming search
+NEAR_DUPLICATE_INDEX_SIZE = 5000
+
+
+def _file_signature(path: str) -> str:
+    try:
+        stat = os.stat(path)
+        return f"{path}:{stat.st_mtime_ns}:{stat.st_size}"
+    except OSError:
+        return f"{path}:missing"
+
+
+# Config values -> (time the files were checked, fingerprint); one entry per set of
+# settings in use (Pipelines may scan under different ones, see core/settings.py)
+_fingerprint_memo = {}
+# Sets of settings remembered before the memo starts over
+FINGERPRINT_MEMO_SIZE = 16
+
+
+def _file_signatures() -> list:
+    """Signatures of the model and preset files a result depends on (one os.stat each)."""
+    signatures = []
+    for model_path in YOLO_MODEL_PATHS.values():
+        signatures.append(_file_signature(model_path))
+        signatures.append(_file_signature(exported_model_path(model_path, config.INFERENCE_BACKEND)))
+    for presets in (PRESET_FILES, FAST_PRESET_FILES):
+        for category in sorted(presets):
+            signatures.append(_file_signature(presets[category]))
+    for category in sorted(config.PRESET_OVERRIDES):
+        signatures.append(_file_signature(config.PRESET_OVERRIDES[category]))
+    return signatures
+
+
+def pipeline_fingerprint() -> str:
+    """
+    Returns a short hash of the model files, preset files and result-relevant config.
+
+    Runs on every cache probe and token store write, so the hash is memoized:
+    a changed FINGERPRINT_CONFIG value is picked up immediately, a changed
+    model or preset file within FINGERPRINT_RECHECK_SECONDS.
+    """
+    config_parts = tuple(f"{name}={getattr(config, name, None)!r}" for name in FINGERPRINT_CONFIG)
+    now = time.monotonic()
+    memo = _fingerprint_memo.get(config_parts)
+    if memo is not None and now - memo[0] < FINGERPRINT_RECHECK_SECONDS:
+        return memo[1]
+
+    parts = [f"pipeline:{PIPELINE_VERSION}", *_file_signatures(), *config_parts]
+    fingerprint = hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+    if len(_fingerprint_memo) >= FINGERPRINT_MEMO_SIZE:
+        _fingerprint_memo.clear()
+    # Each entry is stored in one assignment, so concurrent scans always see a consistent one
+    _fingerprint_memo[config_parts] = (now, fingerprint)
+    return fingerprint
+
+
+def frame_key(frame: np.ndarray, fingerprint: str) -> str:
+    """Content hash of a decoded frame under a pipeline fingerprint."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(fingerprint.encode("ascii"))
+    digest.update(str(frame.shape).encode("ascii"))
+    digest.update(np.ascontiguousarray(frame).data)
+    return digest.hexdigest()
+
+
+def difference_hash(frame: np.ndarray, size: int = DHASH_SIZE) -> bytes:
+    """Perceptual difference hash: sign of horizontal gradients on a tiny grayscale thumbnail."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return np.packbits(bits.reshape(-1)).tobytes()
+
+
+class CacheProbe:
+    """Keys of one frame, computed once and used for both lookup and store."""
+
+    def __init__(self, frame: np.ndarray, fingerprint: str, near_duplicates: bool):
+        self.fingerprint = fingerprint
+        self.key = frame_key(frame, fingerprint)
+        self.dhash = difference_hash(frame) if near_duplicates else None
+
+
+class ResultCache:
+    """In-memory LRU over an optional SQLite store, with an optional near-duplicate layer."""
+
+    def __init__(self, db_path: str = None, memory_bytes: int = 64 * 1024 * 1024, max_entries: int = 20000,
+                 near_duplicates: bool = False, max_distance: int = 6):
+        self.memory_bytes = memory_bytes
+        self.max_entries = max_entries
+        self.near_duplicates = near_duplicates
+        self.max_distance = max_distance
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> serialized result
+        self._memory_size = 0
+        self._near = OrderedDict()    # key -> (fingerprint, dhash bytes)
+        self._near_matrix = None      # cached (keys, fingerprints, uint8 matrix) of _near
+        self._inserts = 0
+
+        self._db = None
+        if db_path:
+            self._open_db(db_path)
+
+    # --- Storage ---
+    def _open_db(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=5.0, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, dhash BLOB,"
+            " result TEXT NOT NULL, last_used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results(last_used)")
+        # Entries of other fingerprints stay: the file is shared by processes that may run under
+        # other settings (benchmark A/B runs, workers with config overrides). The fingerprint is
+        # part of every key, so they are never read here, and _prune ages them out.
+        self._db.commit()
+
+        if self.near_duplicates:
+            rows = self._db.execute(
+                "SELECT key, fingerprint, dhash FROM results WHERE dhash IS NOT NULL "
+                "ORDER BY last_used DESC LIMIT ?", (NEAR_DUPLICATE_INDEX_SIZE,)).fetchall()
+            for key, row_fingerprint, dhash in reversed(rows):
+                self._near[key] = (row_fingerprint, bytes(dhash))
+
+    def _remember(self, key: str, serialized: str):
+        """Inserts into the memory LRU, evicting least recently used entries over the byte cap."""
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = serialized
+        self._memory_size += len(serialized)
+        while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _index_near_duplicate(self, key: str, fingerprint: str, dhash: bytes):
+        self._near[key] = (fingerprint, dhash)
+        self._near.move_to_end(key)
+        while len(self._near) > NEAR_DUPLICATE_INDEX_SIZE:
+            self._near.popitem(last=False)
+        self._near_matrix = None
+
+    def _find_near_duplicate(self, probe: CacheProbe):
+        """Returns the key of the closest indexed frame within max_distance, or None."""
+        if not self._near:
+            return None
+        if self._near_matrix is None:
+            keys = list(self._near)
+            fingerprints = np.array([self._near[k][0] for k in keys])
+            matrix = np.frombuffer(b"".join(self._near[k][1] for k in keys), dtype=np.uint8).reshape(len(keys), -1)
+            self._near_matrix = (keys, fingerprints, matrix)
+        keys, fingerprints, matrix = self._near_matrix
+
+        probe_bits = np.frombuffer(probe.dhash, dtype=np.uint8)
+        distances = np.unpackbits(matrix ^ probe_bits, axis=1).sum(axis=1)
+        distances[fingerprints != probe.fingerprint] = np.iinfo(distances.dtype).max
+        best = int(np.argmin(distances))
+        if distances[best] > self.max_distance:
+            return None
+        return keys[best]
+
+    def _load(self, key: str):
+        """Returns the serialized result for an exact key from memory or disk, with the layer name."""
+        serialized = self._memory.get(key)
+        if serialized is not None:
+            self._memory.move_to_end(key)
+            return serialized, "memory"
+        if self._db is not None:
+            row = self._db.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+                self._db.commit()
+                self._remember(key, row[0])
+                return row[0], "disk"
+        return None, None
+
+    # --- Public API ---
+    def probe(self, frame: np.ndarray) -> CacheProbe:
+        """Computes the cache keys of a decoded frame."""
+        return CacheProbe(frame, pipeline_fingerprint(), self.near_duplicates)
+
+    def get(self, probe: CacheProbe):
+        """
+        Looks a frame up in every layer.
+
+        Returns:
+            dict: A fresh copy of the cached result marked with
+                  'cache': {'hit': True, 'layer': ...}, or None on a miss.
+                  Near-duplicate hits carry the matched frame's box under
+                  'cache': {'matched_detection': ...} instead of 'detection'.
+        """
+        with self._lock:
+            serialized, layer = self._load(probe.key)
+            if serialized is None and probe.dhash is not None:
+                near_key = self._find_near_duplicate(probe)
+                if near_key is not None:
+                    serialized, _ = self._load(near_key)
+                    layer = "near_duplicate" if serialized is not None else None
+
+        if serialized is None:
+            return None
+        result = json.loads(serialized)
+        result['cache'] = {'hit': True, 'layer': layer}
+        if layer == "near_duplicate":
+            # The box was found in the other frame; don't report it as this frame's
+            result['cache']['matched_detection'] = result.get('detection')
+            result['detection'] = None
+        return result
+
+    def put(self, probe: CacheProbe, result: dict):
+        """Stores a pipeline result (without its timings) for the probed frame."""
+        stored = {k: v for k, v in result.items() if k not in ('timings', 'memory', 'memory_metric', 'cache')}
+        serialized = dumps(stored)
+        with self._lock:
+            self._remember(probe.key, serialized)
+            if probe.dhash is not None:
+                self._index_near_duplicate(probe.key, probe.fingerprint, probe.dhash)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, fingerprint, dhash, result, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (probe.key, probe.fingerprint, probe.dhash, serialized, time.time()))
+                self._inserts += 1
+                if self._inserts % 100 == 0:
+                    self._prune()
+                self._db.commit()
+
+    def _prune(self):
+        """Keeps only the max_entries most recently used rows on disk."""
+        self._db.execute(
+            "DELETE FROM results WHERE key NOT IN (SELECT key FROM results ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,))
+
+
+def is_cacheable(result) -> bool:
+    """Only completed pipeline results are cached (not read/detection failures or exceptions)."""
+    # Pipeline exceptions are reported as 'Error: ...' statuses
+    return isinstance(result, dict) and result.get('status') in ('success', 'error')
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Returns the process-wide result cache, or None when RESULT_CACHE_ENABLED is off."""
+    global _cache
+    if not config.RESULT_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache(
+                    db_path=config.RESULT_CACHE_PATH,
+                    memory_bytes=int(config.RESULT_CACHE_MEMORY_MB * 1024 * 1024),
+                    max_entries=config.RESULT_CACHE_MAX_ENTRIES,
+                    near_duplicates=config.RESULT_CACHE_NEAR_DUPLICATES,
+                    max_distance=config.RESULT_CACHE_NEAR_DUPLICATE_DISTANCE,
+                )
+    return _cache
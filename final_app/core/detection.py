@@ -1,33 +1,150 @@
 # core/detection.py
-from ultralytics import YOLO
 from utils.logger import log
+from utils.arrays import to_numpy
 import numpy as np
 import cv2
-import os # Import os to construct the path relative to this file if needed, or use absolute path
+import math
+import config
+from core.models import get_model
 
 # --- Configuration ---
-# Path to the folder containing YOLO models
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
-YOLO_MODEL_FOLDER = os.path.join(PROJECT_ROOT, 'assets','models')
-# Name of your specific model file within that folder
-YOLO_MODEL_NAME = "localization_model.pt" # <<< IMPORTANT: Replace this with your actual model file name
-YOLO_MODEL_PATH = os.path.join(YOLO_MODEL_FOLDER, YOLO_MODEL_NAME)
-
-
-# --- Model Loading ---
-model = None # Initialize model as None
-if not os.path.exists(YOLO_MODEL_PATH):
-    log.error(f"YOLO model file not found at: {YOLO_MODEL_PATH}")
-    log.error("Please ensure the model file exists in the 'yolo' folder and the name is correct in 'core/detection.py'.")
-else:
-    try:
-        # Load the YOLO model from the specified path
-        model = YOLO(YOLO_MODEL_PATH)
-        log.info(f"Successfully loaded YOLO model from: {YOLO_MODEL_PATH}")
-    except Exception as e:
-        log.error(f"Failed to load YOLO model from {YOLO_MODEL_PATH}: {e}")
-        model = None # Ensure model is None if loading fails
+# Detected classes that have an OCR pipeline (compared case-insensitively)
+VALID_CATEGORIES = ("CAP", "BOX", "SOYJOY")
+
+# The localization YOLO model is loaded on first use through core/models.py
+# (see models.LOCALIZATION_MODEL_PATH for its location).
+
+# --- Detection Frame Loading ---
+# cv2.imread flags that let the JPEG decoder produce a 1/N scaled image directly
+REDUCED_READ_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+def _detection_frame(read, mode: str = None):
+    """
+    Produces the (detection_frame, full_frame) pair of read_detection_frame
+    from `read(flags)`, which decodes the image with the given cv2.IMREAD_* flags.
+    """
+    if mode is None:
+        mode = config.DETECTION_DOWNSCALE_MODE
+    target_size = config.DETECTION_INPUT_SIZE
+
+    if mode == "reduced":
+        flag = REDUCED_READ_FLAGS.get(config.DETECTION_REDUCE_FACTOR)
+        if flag is not None:
+            small = read(flag)
+            if small is None:
+                return None, None
+            if max(small.shape[:2]) >= target_size:
+                return small, None
+            # Source is too small to reduce without going below the detector input size
+        full = read(cv2.IMREAD_COLOR)
+        return full, full
+
+    full = read(cv2.IMREAD_COLOR)
+    if full is None:
+        return None, None
+
+    if mode == "resize":
+        return _resized_frame(full, target_size), full
+
+    return full, full
+
+def _resized_frame(full, target_size: int):
+    """Downscales a frame so its long side is `target_size` (never upscales)."""
+    scale = target_size / float(max(full.shape[:2]))
+    if scale >= 1.0:
+        return full
+    return cv2.resize(full, (round(full.shape[1] * scale), round(full.shape[0] * scale)),
+                      interpolation=cv2.INTER_AREA)
+
+def read_detection_frame(image_path: str, mode: str = None):
+    """
+    Reads the frame used for localization according to DETECTION_DOWNSCALE_MODE.
+
+    Args:
+        image_path (str): The path to the image file.
+        mode (str): 'off', 'reduced' or 'resize' (defaults to config.DETECTION_DOWNSCALE_MODE).
+
+    Returns:
+        tuple: (detection_frame, full_frame). `full_frame` is the full-resolution
+               image if it was decoded anyway, otherwise None (decode it with
+               cv2.imread only once it is needed for cropping). Both are None
+               if the image can't be read.
+    """
+    return _detection_frame(lambda flags: cv2.imread(image_path, flags), mode)
+
+def decode_detection_frame(data, mode: str = None):
+    """
+    Like read_detection_frame, but decodes an encoded image (JPEG, PNG, ...)
+    from memory.
+
+    Args:
+        data: The encoded image: bytes, bytearray, memoryview, mmap or a uint8 array.
+        mode (str): 'off', 'reduced' or 'resize' (defaults to config.DETECTION_DOWNSCALE_MODE).
+
+    Returns:
+        tuple: (detection_frame, full_frame), see read_detection_frame. Decode
+               the full frame with decode_image(data) when it is None.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        return None, None
+    return _detection_frame(lambda flags: cv2.imdecode(buffer, flags), mode)
+
+def decode_image(data):
+    """Decodes an encoded image from memory at full resolution (None if it can't be decoded)."""
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+def array_detection_frame(image, mode: str = None):
+    """
+    The localization frame of an already decoded image. 'reduced' has no
+    decoder to do the work here, so it downscales by DETECTION_REDUCE_FACTOR
+    with a resize instead.
+
+    Returns:
+        tuple: (detection_frame, image)
+    """
+    if image is None:
+        return None, None
+    if mode is None:
+        mode = config.DETECTION_DOWNSCALE_MODE
+    target_size = config.DETECTION_INPUT_SIZE
+
+    if mode == "reduced" and config.DETECTION_REDUCE_FACTOR in REDUCED_READ_FLAGS:
+        # Same lower bound as the decoder path: never go below the detector input size
+        target_size = max(target_size, max(image.shape[:2]) // config.DETECTION_REDUCE_FACTOR)
+        return _resized_frame(image, target_size), image
+    if mode == "resize":
+        return _resized_frame(image, target_size), image
+    return image, image
+
+def map_detection_to_source(detection: dict, detection_shape, source_shape) -> dict:
+    """
+    Maps a detection found on a downscaled frame back to source-image pixel
+    coordinates. The box should still hold the detector's float coordinates
+    (select_detections(exact=True)) so it is rounded only once, after scaling,
+    and outwards so the crop never loses pixels. On a full-resolution frame
+    the coordinates are truncated like select_detections does.
+    """
+    x1, y1, x2, y2 = detection['box']
+    if tuple(detection_shape[:2]) == tuple(source_shape[:2]):
+        return {**detection, 'box': [int(x1), int(y1), int(x2), int(y2)]}
+
+    scale_x = source_shape[1] / float(detection_shape[1])
+    scale_y = source_shape[0] / float(detection_shape[0])
+    box = [
+        max(0, math.floor(x1 * scale_x)),
+        max(0, math.floor(y1 * scale_y)),
+        min(source_shape[1], math.ceil(x2 * scale_x)),
+        min(source_shape[0], math.ceil(y2 * scale_y)),
+    ]
+    return {**detection, 'box': box}
 
 # --- Detection Function ---
 def detect_objects(image_path: str):
@@ -41,18 +158,20 @@ def detect_objects(image_path: str):
         tuple: A tuple containing:
             - results: The detection results from the YOLO model.
             - image: The loaded image (NumPy array).
-        Returns (None, None) if the model isn't loaded or the image can't be read.
+            - model: The YOLO model used (for class names).
+        Returns (None, None, None) if the model isn't loaded or the image can't be read.
     """
+    model = get_model('localization')
     if model is None:
         log.error("YOLO model is not loaded or failed to load. Cannot perform detection.")
-        return None, None
+        return None, None, None
 
     try:
         # Read the image using OpenCV
         img = cv2.imread(image_path)
         if img is None:
             log.error(f"Could not read image file for detection: {image_path}")
-            return None, None
+            return None, None, None
 
         log.info(f"Performing YOLO detection on: {image_path}")
         # Perform detection
@@ -63,7 +182,7 @@ def detect_objects(image_path: str):
 
     except Exception as e:
         log.error(f"An error occurred during YOLO detection: {e}")
-        return None, None
+        return None, None, None
 
 def detect_objects_by_image(image):
     """
@@ -76,17 +195,19 @@ def detect_objects_by_image(image):
         tuple: A tuple containing:
             - results: The detection results from the YOLO model.
             - image: The loaded image (NumPy array).
-        Returns (None, None) if the model isn't loaded or the image can't be read.
+            - model: The YOLO model used (for class names).
+        Returns (None, None, None) if the model isn't loaded or the image can't be read.
     """
+    model = get_model('localization')
     if model is None:
         log.error("YOLO model is not loaded or failed to load. Cannot perform detection.")
-        return None, None
+        return None, None, None
 
     try:
         # Read the image using OpenCV
         img = image
         if img is None:
-            return None, None
+            return None, None, None
 
         # Perform detection
         results = model(img) # Pass the loaded image (NumPy array) to the model
@@ -96,6 +217,107 @@ def detect_objects_by_image(image):
 
     except Exception as e:
         log.error(f"An error occurred during YOLO detection: {e}")
+        return None, None, None
+
+def detect_objects_batch(images: list):
+    """
+    Performs object detection on several already-decoded images in a single
+    forward pass of the YOLO model.
+
+    Args:
+        images (list): List of images (NumPy arrays).
+
+    Returns:
+        tuple: A tuple containing:
+            - results: One YOLO result per input image (None if detection failed).
+            - model: The YOLO model used (for class names).
+    """
+    model = get_model('localization')
+    if model is None:
+        log.error("YOLO model is not loaded or failed to load. Cannot perform detection.")
         return None, None
 
+    if not images:
+        return [], model
+
+    try:
+        results = model(images) # A list input is run as one batch
+        log.info(f"Batched detection complete for {len(images)} images.")
+        return list(results), model
+
+    except Exception as e:
+        log.error(f"An error occurred during batched YOLO detection: {e}")
+        return None, model
+
+# --- Detection Selection ---
+_class_table_cache = {}
+
+def _class_table(names):
+    """
+    Precomputes, per class id, the uppercase category name and whether it is a
+    valid category. Cached per names mapping (it never changes for a model).
+    """
+    key = id(names)
+    cached = _class_table_cache.get(key)
+    if cached is not None and cached[0] is names:
+        return cached[1], cached[2]
+
+    items = list(names.items()) if isinstance(names, dict) else list(enumerate(names))
+    size = max((int(class_id) for class_id, _ in items), default=-1) + 1
+    upper_names = np.full(size, "", dtype=object)
+    for class_id, name in items:
+        upper_names[int(class_id)] = str(name).upper()
+    valid_mask = np.isin(upper_names, VALID_CATEGORIES)
+
+    _class_table_cache[key] = (names, upper_names, valid_mask)
+    return upper_names, valid_mask
+
+def select_detections(result, names, min_confidence: float = 0.0, top_k: int = 1, exact: bool = False) -> list:
+    """
+    Selects the largest valid ('CAP', 'BOX', 'SOYJOY') detections of a single
+    image, working on the result tensors as arrays.
+
+    Args:
+        result: One YOLO result (has .boxes with xyxy/conf/cls).
+        names: The model's class id -> name mapping.
+        min_confidence (float): Detections below this confidence are ignored.
+        top_k (int): Maximum number of detections to return (None for all).
+        exact (bool): Return the detector's float box coordinates instead of
+                      truncated ints, for map_detection_to_source to round.
+
+    Returns:
+        list: Dicts {'category', 'box', 'confidence'} sorted by box area, largest first.
+    """
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return []
+
+    # Coordinates are truncated to ints, as used for cropping (unless exact)
+    exact_xyxy = to_numpy(boxes.xyxy).astype(np.float64).reshape(-1, 4)
+    xyxy = exact_xyxy.astype(np.int64)
+    confidences = to_numpy(boxes.conf).astype(np.float64).reshape(-1)
+    class_ids = to_numpy(boxes.cls).astype(np.int64).reshape(-1)
+
+    upper_names, valid_mask = _class_table(names)
+    in_range = (class_ids >= 0) & (class_ids < len(valid_mask))
+    keep = in_range & (confidences >= min_confidence)
+    keep[keep] = valid_mask[class_ids[keep]]
+    if not keep.any():
+        return []
+
+    indices = np.flatnonzero(keep)
+    areas = (xyxy[indices, 2] - xyxy[indices, 0]) * (xyxy[indices, 3] - xyxy[indices, 1])
+    # Stable sort keeps the first detection on equal areas, like the old max loop
+    indices = indices[np.argsort(-areas, kind='stable')]
+    if top_k is not None:
+        indices = indices[:top_k]
+
+    return [
+        {
+            'category': upper_names[class_ids[i]],
+            'box': (exact_xyxy if exact else xyxy)[i].tolist(),
+            'confidence': float(confidences[i]),
+        }
+        for i in indices
+    ]
 
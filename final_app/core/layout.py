@@ -0,0 +1,116 @@
+# core/layout.py
+import cv2
+import numpy as np
+from utils.logger import log
+
+# --- Text Line Layout ---
+# Lot-number prints are a few horizontal lines of text on a plain background,
+# so the text lines can be found from the horizontal projection profile (ink
+# pixels per row) instead of running a learned text detector.
+
+# A row belongs to a text line when its ink exceeds this fraction of the busiest row
+ROW_INK_FRACTION = 0.15
+# Gaps between rows of ink up to this fraction of the image height are bridged
+MAX_ROW_GAP_FRACTION = 0.02
+# Bands lower than this fraction of the image height are treated as noise
+MIN_BAND_HEIGHT_FRACTION = 0.06
+# Padding added around each band, as a fraction of its height
+BAND_PADDING_FRACTION = 0.15
+
+
+def ink_mask(image: np.ndarray) -> np.ndarray:
+    """
+    Returns a boolean mask of the text pixels. Works on colour, grayscale or
+    already binarised crops and on either polarity (ink is the minority class).
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    if gray.dtype != np.uint8:
+        gray = cv2.normalize(gray, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = binary > 0
+    # Text covers less of the crop than the background
+    if mask.mean() > 0.5:
+        mask = ~mask
+    return mask
+
+
+def _runs(active: np.ndarray, max_gap: int) -> list:
+    """Returns [start, end) runs of True values, bridging gaps of up to `max_gap`."""
+    indices = np.flatnonzero(active)
+    if indices.size == 0:
+        return []
+    # A new run starts wherever the distance to the previous active index exceeds the gap
+    breaks = np.flatnonzero(np.diff(indices) > max_gap + 1)
+    starts = np.concatenate(([indices[0]], indices[breaks + 1]))
+    ends = np.concatenate((indices[breaks], [indices[-1]])) + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def find_text_bands(image: np.ndarray) -> list:
+    """
+    Finds the horizontal text lines of a crop from its projection profiles.
+
+    Args:
+        image (np.ndarray): The (preprocessed) crop.
+
+    Returns:
+        list: Boxes [x1, y1, x2, y2] of the text lines, top to bottom. Empty if
+              no line could be found.
+    """
+    if image is None or image.size == 0:
+        return []
+
+    height, width = image.shape[:2]
+    mask = ink_mask(image)
+    row_profile = mask.sum(axis=1)
+    if row_profile.max() == 0:
+        return []
+
+    rows = _runs(row_profile > ROW_INK_FRACTION * row_profile.max(),
+                 int(MAX_ROW_GAP_FRACTION * height))
+    min_height = max(1, int(MIN_BAND_HEIGHT_FRACTION * height))
+
+    bands = []
+    for y1, y2 in rows:
+        if y2 - y1 < min_height:
+            continue
+        # Horizontal extent of the line from the column profile inside the band
+        columns = np.flatnonzero(mask[y1:y2].any(axis=0))
+        if columns.size == 0:
+            continue
+        pad = int(round(BAND_PADDING_FRACTION * (y2 - y1)))
+        bands.append([
+            max(0, int(columns[0]) - pad),
+            max(0, y1 - pad),
+            min(width, int(columns[-1]) + 1 + pad),
+            min(height, y2 + pad),
+        ])
+
+    log.debug(f"Found {len(bands)} text bands: {bands}")
+    return bands
+
+
+def _union(boxes: list) -> list:
+    return [min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)]
+
+
+def find_lot_lines(image: np.ndarray):
+    """
+    Finds the top and bottom line of a two-line lot-number print. The text
+    bands are split into two groups at the widest vertical gap between
+    neighbouring bands, and each group becomes one line, so a line that the
+    profile broke in two (or a stray band next to it) isn't dropped.
+
+    Args:
+        image (np.ndarray): The (preprocessed) crop.
+
+    Returns:
+        tuple: (top_box, bottom_box) as [x1, y1, x2, y2], or None if fewer
+               than two bands were found.
+    """
+    bands = find_text_bands(image)
+    if len(bands) < 2:
+        return None
+    gaps = [bands[i + 1][1] - bands[i][3] for i in range(len(bands) - 1)]
+    split = int(np.argmax(gaps)) + 1
+    return _union(bands[:split]), _union(bands[split:])
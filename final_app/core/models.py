@@ -0,0 +1,267 @@
+# core/models.py
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from utils.logger import log
+from utils import profiling
+import config
+
+# --- Model Registry ---
+# Models are loaded on first use instead of at import time, so a one-shot scan
+# of a SOYJOY image never pays for the CAP character model and tools that only
+# need preprocessing never import torch at all. The heavy libraries
+# (ultralytics, easyocr) are imported inside the loaders for the same reason.
+# Long-running modes call preload() once so no request pays the load cost.
+#
+# The YOLO models can run through PyTorch or through an exported ONNX Runtime /
+# OpenVINO model (config.INFERENCE_BACKEND). Exported models are loaded with
+# ultralytics as well, so letterboxing, NMS and the Results objects are the
+# same whichever backend runs the network.
+#
+# Each model is used through the interface in core/backends/base.py; with
+# config.MODEL_BACKEND = "stub" the loaders return the fixture-driven stubs of
+# core/backends/stub.py instead, so the pipeline runs without any weights.
+
+# --- Configuration ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+MODEL_FOLDER = os.path.join(PROJECT_ROOT, 'assets', 'models')
+LOCALIZATION_MODEL_PATH = os.path.join(MODEL_FOLDER, 'localization_model.pt')
+CAP_CHARACTER_MODEL_PATH = os.path.join(MODEL_FOLDER, 'cap_character_model.pt')
+# YOLO models that can be exported to another inference backend
+YOLO_MODEL_PATHS = {
+    'localization': LOCALIZATION_MODEL_PATH,
+    'cap_characters': CAP_CHARACTER_MODEL_PATH,
+}
+INFERENCE_BACKENDS = ("torch", "onnx", "openvino")
+MODEL_BACKENDS = ("default", "stub")
+
+
+class ModelRegistry:
+    """
+    Loads named models on first use and keeps them for the life of the process.
+
+    A loader that raises is logged once and remembered as unavailable, so a
+    missing model file doesn't cost a retry on every request.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.RLock()
+
+    def register(self, name: str, loader):
+        """
+        Registers a model loader.
+
+        Args:
+            name (str): Model name used with get(), e.g. 'localization'.
+            loader (callable): Takes no arguments and returns the loaded model.
+        """
+        with self._lock:
+            self._loaders[name] = loader
+            self._models.pop(name, None)
+            self._stats.pop(name, None)
+
+    def get(self, name: str):
+        """Returns the model, loading it on first use. Returns None if it can't be loaded."""
+        if name in self._models:
+            return self._models[name]
+
+        with self._lock:
+            # Another thread may have finished loading while we waited for the lock
+            if name in self._models:
+                return self._models[name]
+
+            model = self.create(name)
+            self._models[name] = model
+            return model
+
+    def create(self, name: str):
+        """
+        Loads a new, uncached instance of the model (e.g. one per thread, see
+        core/pipeline.py). Returns None if it can't be loaded.
+        """
+        with self._lock:
+            loader = self._loaders.get(name)
+        if loader is None:
+            raise KeyError(f"Unknown model: {name}")
+
+        rss_before = profiling.current_rss_mb()
+        start = time.perf_counter()
+        try:
+            model = loader()
+            error = None
+        except Exception as e:
+            log.error(f"Failed to load model '{name}': {e}")
+            model, error = None, str(e)
+        load_seconds = time.perf_counter() - start
+        rss_after = profiling.current_rss_mb()
+
+        stats = {
+            'loaded': model is not None,
+            'load_seconds': load_seconds,
+            'rss_delta_mb': (rss_after - rss_before) if rss_before is not None and rss_after is not None else None,
+            'error': error,
+        }
+        with self._lock:
+            self._stats[name] = stats
+        profiling.observe(f"model_load.{name}", load_seconds)
+        if model is not None:
+            log.info(f"Loaded model '{name}' in {load_seconds:.2f} seconds "
+                     f"(+{stats['rss_delta_mb'] or 0:.0f} MB RSS)")
+        return model
+
+    def clone(self):
+        """Returns a new, empty registry with the same loaders (each model is loaded again on first use)."""
+        with self._lock:
+            registry = ModelRegistry()
+            registry._loaders = dict(self._loaders)
+        return registry
+
+    def is_loaded(self, name: str) -> bool:
+        """True if the model has been loaded successfully."""
+        return self._models.get(name) is not None
+
+    def preload(self, names=None) -> dict:
+        """
+        Loads the given models (all registered ones by default) up front.
+
+        Returns:
+            dict: The load statistics, see stats().
+        """
+        for name in (names if names is not None else list(self._loaders)):
+            self.get(name)
+        return self.stats()
+
+    def stats(self) -> dict:
+        """Returns {name: {'loaded', 'load_seconds', 'rss_delta_mb', 'error'}} for every attempted load."""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+
+# --- Loaders ---
+def exported_model_path(model_path: str, backend: str) -> str:
+    """Returns where ultralytics puts the `backend` export of a .pt model."""
+    base = os.path.splitext(model_path)[0]
+    if backend == "onnx":
+        return base + ".onnx"
+    if backend == "openvino":
+        return base + "_openvino_model"
+    return model_path
+
+
+def load_yolo(model_path: str, backend: str = None):
+    """
+    Loads a YOLO model for the given backend ('torch', 'onnx' or 'openvino',
+    defaults to config.INFERENCE_BACKEND). Falls back to the .pt weights when
+    the export is missing.
+    """
+    backend = backend or config.INFERENCE_BACKEND
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}', expected one of {INFERENCE_BACKENDS}")
+
+    path = exported_model_path(model_path, backend)
+    if backend != "torch" and not os.path.exists(path):
+        log.warning(f"No {backend} export found at {path}, using the PyTorch weights. "
+                    f"Run 'python main.py --export-models {backend}' to create it.")
+        path = model_path
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"YOLO model file not found at: {path}")
+
+    from ultralytics import YOLO
+    from core.backends.yolo import YoloDetector
+    log.info(f"Loading YOLO model from: {path}")
+    # The task can't always be inferred from exported files
+    return YoloDetector(YOLO(path, task='detect'))
+
+
+def export_yolo_models(backend: str, names=None, imgsz: int = None) -> dict:
+    """
+    Exports the YOLO models to an ONNX Runtime or OpenVINO model next to the .pt file.
+
+    Args:
+        backend (str): 'onnx' or 'openvino'.
+        names (list): Models to export (defaults to all of YOLO_MODEL_PATHS).
+        imgsz (int): Export input size (defaults to the size the model was trained with).
+
+    Returns:
+        dict: {name: exported path}.
+    """
+    if backend not in ("onnx", "openvino"):
+        raise ValueError(f"Can only export to 'onnx' or 'openvino', not '{backend}'")
+
+    from ultralytics import YOLO
+    exported = {}
+    for name in (names or list(YOLO_MODEL_PATHS)):
+        model_path = YOLO_MODEL_PATHS[name]
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"YOLO model file not found at: {model_path}")
+        options = {'format': backend, 'dynamic': True} # dynamic batch for the batched scan modes
+        if imgsz:
+            options['imgsz'] = imgsz
+        log.info(f"Exporting {model_path} to {backend}...")
+        exported[name] = YOLO(model_path).export(**options)
+    return exported
+
+
+def _stub_models():
+    """Returns the stub models when config.MODEL_BACKEND is "stub", else None."""
+    if config.MODEL_BACKEND not in MODEL_BACKENDS:
+        raise ValueError(f"Unknown model backend '{config.MODEL_BACKEND}', expected one of {MODEL_BACKENDS}")
+    if config.MODEL_BACKEND != "stub":
+        return None
+    from core.backends.stub import load_stub_models
+    return load_stub_models(config.STUB_FIXTURES)
+
+
+def _load_localization_model():
+    stubs = _stub_models()
+    if stubs is not None:
+        return stubs.localizer
+    return load_yolo(LOCALIZATION_MODEL_PATH)
+
+
+def _load_cap_character_model():
+    stubs = _stub_models()
+    if stubs is not None:
+        return stubs.character_detector
+    return load_yolo(CAP_CHARACTER_MODEL_PATH)
+
+
+def _load_easyocr_reader():
+    stubs = _stub_models()
+    if stubs is not None:
+        return stubs.text_recognizer
+    from core.backends.easyocr_reader import EasyOCRRecognizer
+    # Add languages needed, e.g., ['en'] for English
+    return EasyOCRRecognizer.load(['en'], gpu=False)
+
+
+registry = ModelRegistry()
+registry.register('localization', _load_localization_model)
+registry.register('cap_characters', _load_cap_character_model)
+registry.register('easyocr', _load_easyocr_reader)
+
+
+# Model source of the scan running in the current thread (see core/pipeline.py)
+_active_models = contextvars.ContextVar("active_models", default=None)
+
+
+@contextmanager
+def use_models(models):
+    """Makes get_model() resolve to `models` (anything with a get(name) method) inside the block."""
+    token = _active_models.set(models)
+    try:
+        yield models
+    finally:
+        _active_models.reset(token)
+
+
+def get_model(name: str):
+    """Returns a model of the active model source (the default registry unless set by use_models)."""
+    models = _active_models.get()
+    return (models if models is not None else registry).get(name)
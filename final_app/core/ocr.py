@@ -1,98 +1,160 @@
 # core/ocr.py
-import easyocr
 import numpy as np
 from utils.logger import log
-import os
+from utils.arrays import to_numpy
+from core.models import get_model
+from core.backends.base import Region
+from core.layout import find_text_bands, find_lot_lines
+import config
 import cv2
 import re # Import the regular expression module
 
-# --- EasyOCR Initialization ---
-# Initialize EasyOCR reader only once. Specify languages needed.
-# Use GPU if available (cuda=True), otherwise CPU (cuda=False)
-try:
-    log.info("Initializing EasyOCR Reader...")
-    # Add languages needed, e.g., ['en'] for English
-    reader = easyocr.Reader(['en'], gpu=False) # Or gpu=False if no CUDA/GPU
-    log.info("EasyOCR Reader initialized successfully.")
-    EASYOCR_AVAILABLE = True
-except Exception as e:
-    log.error(f"Failed to initialize EasyOCR: {e}. EasyOCR will not be available.")
-    log.warning("Ensure PyTorch and CUDA (if using GPU) are correctly installed.")
-    reader = None
-    EASYOCR_AVAILABLE = False
-
-# --- YOLO OCR Model Initialization (Placeholder) ---
-# TODO: Implement loading and inference for your CAP YOLO character model
-# This will be similar to core/detection.py but for a different model
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
-YOLO_MODEL_FOLDER = os.path.join(PROJECT_ROOT, 'assets','models')
-# CAP_OCR_MODEL_PATH = r".\assets\models\cap_character_model.pt" # <<< IMPORTANT: Replace with your CAP character model path
-CAP_OCR_MODEL_PATH = os.path.join(YOLO_MODEL_FOLDER, 'cap_character_model.pt') # <<< IMPORTANT: Replace with your CAP character model path
-CAP_OCR_MODEL = None
-CAP_OCR_AVAILABLE = False
-try:
-    if os.path.exists(CAP_OCR_MODEL_PATH):
-        from ultralytics import YOLO # Assuming same library
-        CAP_OCR_MODEL = YOLO(CAP_OCR_MODEL_PATH)
-        log.info(f"Successfully loaded CAP OCR YOLO model from: {CAP_OCR_MODEL_PATH}")
-        CAP_OCR_AVAILABLE = True
-    else:
-        log.warning(f"CAP OCR YOLO model not found at: {CAP_OCR_MODEL_PATH}")
-except Exception as e:
-    log.error(f"Failed to load CAP OCR YOLO model: {e}")
-
-# log.warning("CAP OCR YOLO model loading is currently commented out/placeholder.") # Placeholder warning # Removed this line
+# --- Models ---
+# The EasyOCR reader and the CAP character YOLO model are loaded on first use
+# through core/models.py ('easyocr' and 'cap_characters'), so a scan only
+# pays for the recogniser its category needs.
+
+# Overlapping character boxes above this IoU are treated as duplicates (very strict)
+CAP_CHAR_IOU_THRESHOLD = 0.1
+
+# --- Band-Restricted OCR ---
+# With config.BAND_OCR_ENABLED the OCR models only see the two text lines that
+# core.layout.find_lot_lines locates from the row profile, read together in
+# one batched call, instead of the whole crop. Each token is labelled with the
+# line it was read on ('line': 'top' / 'bottom'), which split_text_top_bottom
+# then uses instead of the 1/3 height split. Crops where fewer than two lines
+# are found are read whole, as before.
+LINE_LABELS = ("top", "bottom")
+
+
+def _to_crop_tokens(tokens: list, band: list, line: str) -> list:
+    """Moves tokens read on a band image into crop coordinates and labels them with the band's line."""
+    x_offset, y_offset = band[0], band[1]
+    for token in tokens:
+        x1, y1, x2, y2 = token['box']
+        token['box'] = [x1 + x_offset, y1 + y_offset, x2 + x_offset, y2 + y_offset]
+        if token.get('bbox') is not None:
+            token['bbox'] = [[x + x_offset, y + y_offset] for x, y in token['bbox']]
+        token['line'] = line
+    return tokens
+
+
+def _band_image(image: np.ndarray, band: list) -> np.ndarray:
+    x1, y1, x2, y2 = band
+    return image[y1:y2, x1:x2]
 
 # --- OCR Functions ---
 
-def perform_easyocr(image: np.ndarray) -> list:
+def _format_easyocr_results(results: list) -> list:
+    """Turns EasyOCR (bbox, text, confidence) tuples into the OCR result dicts."""
+    formatted_results = []
+
+    # Debug the raw results
+    log.debug(f"Raw EasyOCR results: {results}")
+
+    for (bbox, text, prob) in results:
+        # bbox is [[tl_x, tl_y], [tr_x, tr_y], [br_x, br_y], [bl_x, bl_y]]
+        # Keep the original polygon format for drawing
+        # Also add a simplified box format for text splitting
+        x_coords = [p[0] for p in bbox]
+        y_coords = [p[1] for p in bbox]
+        simple_box = [min(x_coords), min(y_coords), max(x_coords), max(y_coords)]
+
+        cleaned_text_final = text
+
+        # Only add if the cleaned text is not empty
+        if cleaned_text_final:
+            formatted_results.append({
+                'box': simple_box,  # For text splitting
+                'bbox': bbox,       # Original polygon for drawing
+                'text': cleaned_text_final,
+                'confidence': prob
+            })
+            log.debug(f"EasyOCR detected: '{text}' at box={simple_box}, bbox={bbox}")
+        else:
+            log.debug(f"EasyOCR detected: '{text}' -> Discarded after cleaning")
+    return formatted_results
+
+def _recognize_text_bands(reader, image: np.ndarray, category: str):
+    """
+    Runs only the EasyOCR recogniser on the projection-profile text lines of
+    the crop, skipping the CRAFT detector. Returns None when no line is found.
+    """
+    bands = find_text_bands(image)
+    if not bands:
+        log.info("No text bands found, falling back to full EasyOCR detection.")
+        return None
+    # EasyOCR expects horizontal boxes as [x_min, x_max, y_min, y_max]
+    horizontal_list = [[x1, x2, y1, y2] for x1, y1, x2, y2 in bands]
+    return reader.recognize(image, horizontal_list=horizontal_list, free_list=[],
+                            allowlist=config.EASYOCR_ALLOWLISTS.get(category))
+
+def _read_lot_lines(reader, image: np.ndarray, category: str, mode: str):
+    """
+    Reads only the two lot-number lines of the crop (see BAND_OCR_ENABLED).
+    Returns the labelled OCR results, or None when the lines can't be found.
+    """
+    lines = find_lot_lines(image)
+    if lines is None:
+        log.info("Fewer than two text lines found, reading the whole crop.")
+        return None
+
+    if mode == "recognize":
+        horizontal_list = [[x1, x2, y1, y2] for x1, y1, x2, y2 in lines]
+        results = _format_easyocr_results(reader.recognize(
+            image, horizontal_list=horizontal_list, free_list=[],
+            allowlist=config.EASYOCR_ALLOWLISTS.get(category)))
+        # The recogniser answers in crop coordinates; label each token by the line its centre is closer to
+        boundary = (lines[0][3] + lines[1][1]) / 2.0
+        for result in results:
+            result['line'] = LINE_LABELS[0] if (result['box'][1] + result['box'][3]) / 2.0 < boundary else LINE_LABELS[1]
+        return results
+
+    band_results = reader.readtext_batch([_band_image(image, band) for band in lines],
+                                         [Region(image, band) for band in lines])
+    results = []
+    for band, line, band_result in zip(lines, LINE_LABELS, band_results):
+        results.extend(_to_crop_tokens(_format_easyocr_results(band_result), band, line))
+    return results
+
+def perform_easyocr(image: np.ndarray, category: str = None, mode: str = None) -> list:
     """
     Performs OCR using EasyOCR.
 
     Args:
         image (np.ndarray): The image array (output from preprocessing/extraction).
+        category (str): The crop category, selects the allowlist in 'recognize' mode.
+        mode (str): 'detect' (CRAFT text detection + recognition) or 'recognize'
+                    (recognition on projection-profile text lines only).
+                    Defaults to config.EASYOCR_MODE.
 
     Returns:
         list: A list of tuples, where each tuple contains (bounding_box, text, confidence).
               Returns empty list if EasyOCR is unavailable or fails.
               Text is cleaned to contain only alphanumeric characters with O->0 and I->1 substitutions.
     """
-    if not EASYOCR_AVAILABLE or reader is None:
+    reader = get_model('easyocr')
+    if reader is None:
         log.error("EasyOCR is not available.")
         return []
 
-    log.info("Performing OCR using EasyOCR...")
+    if mode is None:
+        mode = config.EASYOCR_MODE
+    log.info(f"Performing OCR using EasyOCR ({mode})...")
     try:
-        # EasyOCR works best with BGR images, ensure input format if needed
-        results = reader.readtext(image)
-        # Format results slightly for consistency
-        formatted_results = []
-        
-        # Debug the raw results
-        log.debug(f"Raw EasyOCR results: {results}")
-        
-        for (bbox, text, prob) in results:
-            # bbox is [[tl_x, tl_y], [tr_x, tr_y], [br_x, br_y], [bl_x, bl_y]]
-            # Keep the original polygon format for drawing
-            # Also add a simplified box format for text splitting
-            x_coords = [p[0] for p in bbox]
-            y_coords = [p[1] for p in bbox]
-            simple_box = [min(x_coords), min(y_coords), max(x_coords), max(y_coords)]
-            
-            cleaned_text_final = text
-            
-            # Only add if the cleaned text is not empty
-            if cleaned_text_final:
-                formatted_results.append({
-                    'box': simple_box,  # For text splitting
-                    'bbox': bbox,       # Original polygon for drawing
-                    'text': cleaned_text_final, 
-                    'confidence': prob
-                })
-                log.debug(f"EasyOCR detected: '{text}' at box={simple_box}, bbox={bbox}")
-            else:
-                log.debug(f"EasyOCR detected: '{text}' -> Discarded after cleaning")
+        formatted_results = None
+        if config.BAND_OCR_ENABLED:
+            formatted_results = _read_lot_lines(reader, image, category, mode)
+        if formatted_results is None:
+            results = None
+            if mode == "recognize":
+                results = _recognize_text_bands(reader, image, category)
+            if results is None:
+                # EasyOCR works best with BGR images, ensure input format if needed
+                results = reader.readtext(image)
+
+            # Format results slightly for consistency
+            formatted_results = _format_easyocr_results(results)
 
         log.info(f"EasyOCR finished. Found {len(formatted_results)} valid text blocks.")
         return formatted_results
@@ -100,6 +162,47 @@ def perform_easyocr(image: np.ndarray) -> list:
         log.error(f"Error during EasyOCR execution: {e}", exc_info=True)
         return []
 
+def _to_bgr(image: np.ndarray) -> np.ndarray:
+    """Converts a grayscale image to BGR as expected by the CAP YOLO model."""
+    if len(image.shape) == 2:
+        log.debug("Converted grayscale image to BGR for CAP YOLO OCR.")
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return image # Assume it's already BGR
+
+def _format_cap_yolo_result(yolo_result_obj) -> list:
+    """
+    Turns one ultralytics result of the CAP character model into the OCR result
+    list, suppressing overlapping characters and ordering them left to right.
+    """
+    boxes = yolo_result_obj.boxes
+    if not boxes:
+        return []
+
+    # Pull all boxes out of the result once; coordinates are truncated to ints as before
+    xyxy = to_numpy(boxes.xyxy).astype(np.int64).reshape(-1, 4)
+    confidences = to_numpy(boxes.conf).astype(np.float64).reshape(-1)
+    class_ids = to_numpy(boxes.cls).astype(np.int64).reshape(-1)
+
+    # Skip invalid class IDs
+    valid = class_ids < len(yolo_result_obj.names)
+    xyxy, confidences, class_ids = xyxy[valid], confidences[valid], class_ids[valid]
+
+    # Filter out overlapping detections, keeping only the highest confidence one
+    kept = suppress_overlaps(xyxy, confidences, CAP_CHAR_IOU_THRESHOLD)
+
+    # Sort results by x-coordinate for proper reading order
+    kept = kept[np.argsort(xyxy[kept, 0], kind='stable')]
+
+    formatted_results = []
+    for (x1, y1, x2, y2), class_id, confidence in zip(xyxy[kept].tolist(), class_ids[kept].tolist(), confidences[kept].tolist()):
+        formatted_results.append({
+            'box': [x1, y1, x2, y2],
+            'bbox': [[x1, y1], [x2, y1], [x2, y2], [x1, y2]],
+            'text': yolo_result_obj.names[class_id],
+            'confidence': confidence
+        })
+    return formatted_results
+
 def perform_cap_ocr_yolo(image: np.ndarray) -> list:
     """
     Performs OCR using a custom YOLO character model for CAP.
@@ -111,79 +214,26 @@ def perform_cap_ocr_yolo(image: np.ndarray) -> list:
         list: A list of dictionaries [{'box': [x1,y1,x2,y2], 'text': char, 'confidence': conf}].
               Returns empty list if model unavailable or fails.
     """
-    if not CAP_OCR_AVAILABLE or CAP_OCR_MODEL is None:
+    if config.BAND_OCR_ENABLED:
+        # The two line bands go through the model as one batch
+        return perform_cap_ocr_yolo_batch([image])[0]
+
+    cap_model = get_model('cap_characters')
+    if cap_model is None:
         log.error("CAP OCR YOLO model is not available.")
         return []
 
     log.info("Performing OCR using CAP YOLO model...")
     try:
-        # --- Implement YOLO inference for characters ---
         # Ensure image is in the right format for YOLO (usually BGR for OpenCV-based models)
-        if len(image.shape) == 2:
-            # Convert grayscale to BGR if needed by the model
-            ocr_image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
-            log.debug("Converted grayscale image to BGR for CAP YOLO OCR.")
-        else:
-            ocr_image = image # Assume it's already BGR
+        ocr_image = _to_bgr(image)
 
         # Perform detection
         log.debug("Running inference with CAP YOLO model...")
-        results = CAP_OCR_MODEL(ocr_image)
+        results = cap_model(ocr_image)
         log.debug("Inference complete.")
 
-        formatted_results = []
-
-        if results:
-            yolo_result_obj = results[0]
-            boxes = yolo_result_obj.boxes
-            if boxes:
-                # Convert all boxes to a list of dictionaries for easier processing
-                all_detections = []
-                for box in boxes:
-                    x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
-                    class_id = int(box.cls[0].item())
-                    confidence = float(box.conf[0].item())
-                    
-                    if class_id < len(yolo_result_obj.names):
-                        char = yolo_result_obj.names[class_id]
-                    else:
-                        continue  # Skip invalid class IDs
-                    
-                    all_detections.append({
-                        'box': [x1, y1, x2, y2],
-                        'class_id': class_id,
-                        'char': char,
-                        'confidence': confidence
-                    })
-
-                # Sort by confidence (highest first)
-                all_detections.sort(key=lambda x: x['confidence'], reverse=True)
-
-                # Filter out overlapping detections, keeping only the highest confidence one
-                kept_detections = []
-                for detection in all_detections:
-                    should_keep = True
-                    for kept in kept_detections:
-                        iou = calculate_iou(detection['box'], kept['box'])
-                        if iou > 0.1:  # Very strict threshold for overlapping
-                            should_keep = False
-                            break
-                    
-                    if should_keep:
-                        kept_detections.append(detection)
-
-                # Format the results
-                for det in kept_detections:
-                    x1, y1, x2, y2 = det['box']
-                    formatted_results.append({
-                        'box': [x1, y1, x2, y2],
-                        'bbox': [[x1, y1], [x2, y1], [x2, y2], [x1, y2]],
-                        'text': det['char'],
-                        'confidence': det['confidence']
-                    })
-
-        # Sort results by x-coordinate for proper reading order
-        formatted_results.sort(key=lambda det: det['box'][0])
+        formatted_results = _format_cap_yolo_result(results[0]) if results else []
         log.info(f"CAP YOLO OCR finished. Found {len(formatted_results)} characters after filtering.")
         return formatted_results
 
@@ -191,6 +241,92 @@ def perform_cap_ocr_yolo(image: np.ndarray) -> list:
         log.error(f"Error during CAP YOLO OCR execution: {e}", exc_info=True)
         return []
 
+def perform_cap_ocr_yolo_batch(images: list) -> list:
+    """
+    Performs CAP character OCR on several images in a single YOLO forward pass.
+
+    Args:
+        images (list): List of image arrays.
+
+    Returns:
+        list: One OCR result list (same format as perform_cap_ocr_yolo) per input image.
+    """
+    cap_model = get_model('cap_characters')
+    if cap_model is None:
+        log.error("CAP OCR YOLO model is not available.")
+        return [[] for _ in images]
+
+    if not images:
+        return []
+
+    # Model inputs with their Region and, per input, (image index, band, line); band None means the whole image
+    inputs, regions, owners = [], [], []
+    for index, image in enumerate(images):
+        lines = find_lot_lines(image) if config.BAND_OCR_ENABLED else None
+        if lines is None:
+            inputs.append(_to_bgr(image))
+            regions.append(None)
+            owners.append((index, None, None))
+            continue
+        for band, line in zip(lines, LINE_LABELS):
+            inputs.append(_to_bgr(_band_image(image, band)))
+            regions.append(Region(image, band))
+            owners.append((index, band, line))
+
+    log.info(f"Performing batched OCR using CAP YOLO model on {len(inputs)} images...")
+    try:
+        results = [[] for _ in images]
+        for (index, band, line), result in zip(owners, cap_model(inputs, regions)):
+            tokens = _format_cap_yolo_result(result)
+            results[index].extend(tokens if band is None else _to_crop_tokens(tokens, band, line))
+        return results
+    except Exception as e:
+        log.error(f"Error during batched CAP YOLO OCR execution: {e}", exc_info=True)
+        return [[] for _ in images]
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Vectorised Intersection over Union between two sets of [x1, y1, x2, y2] boxes.
+
+    Returns:
+        np.ndarray: (len(boxes_a), len(boxes_b)) matrix of IoU values (0 where the union is empty).
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+
+    iou = np.zeros_like(intersection)
+    np.divide(intersection, union, out=iou, where=union > 0)
+    return iou
+
+def suppress_overlaps(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """
+    Greedy non-maximum suppression: walks the boxes from highest to lowest score
+    and drops every box whose IoU with an already kept box exceeds the threshold.
+
+    Returns:
+        np.ndarray: Indices of the kept boxes, highest score first.
+    """
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    if len(order) == 0:
+        return order
+
+    ious = iou_matrix(boxes[order], boxes[order])
+    keep = np.ones(len(order), dtype=bool)
+    for i in range(len(order)):
+        if keep[i]:
+            keep[i + 1:] &= ious[i, i + 1:] <= iou_threshold
+    return order[keep]
 
 def calculate_iou(box1, box2):
     """Calculate Intersection over Union between two boxes"""
@@ -210,10 +346,12 @@ def calculate_iou(box1, box2):
 # --- Text Splitting Logic ---
 def split_text_top_bottom(ocr_results: list, image_height: int) -> dict:
     """
-    Splits OCR text results into top and bottom sections based on bounding box position.
+    Splits OCR text results into top and bottom sections based on bounding box
+    position, or on their 'line' labels when every result has one.
 
     Args:
-        ocr_results (list): List of OCR detection dictionaries, each with 'box' and 'text'.
+        ocr_results (list): List of OCR detection dictionaries, each with 'box' and 'text'
+                            (and optionally 'line': 'top' / 'bottom').
                             Box format: [x_min, y_min, x_max, y_max]
         image_height (int): The height of the image the OCR was performed on.
 
@@ -225,6 +363,8 @@ def split_text_top_bottom(ocr_results: list, image_height: int) -> dict:
         return {'top_text': '', 'bottom_text': ''}
 
     threshold_y = image_height / 3.0
+    # Tokens read on the layout bands already know their line (see BAND_OCR_ENABLED)
+    labelled = all(result.get('line') in LINE_LABELS for result in ocr_results)
 
     top_texts = []
     bottom_texts = []
@@ -236,7 +376,12 @@ def split_text_top_bottom(ocr_results: list, image_height: int) -> dict:
         y_min = result['box'][1]
         text = result['text']
 
-        if y_min < threshold_y:
+        if labelled:
+            is_top = result['line'] == LINE_LABELS[0]
+        else:
+            is_top = y_min < threshold_y
+
+        if is_top:
             top_texts.append(text)
         else:
             bottom_texts.append(text)
@@ -1,12 +1,15 @@
 # core/ocr_pipeline.py
 from utils.logger import log
 import numpy as np
-import os
-import cv2
-from core.preprocessing import apply_preprocessing_pipeline
-from core.ocr import perform_easyocr, perform_cap_ocr_yolo, split_text_top_bottom, draw_ocr_results
+from collections import namedtuple
+from functools import partial
+from core.artifacts import ArtifactSession
+from core.preprocessing import apply_preprocessing_pipeline, normalize_crop, FAST_PRESET_FILES
+from core.ocr import perform_easyocr, perform_cap_ocr_yolo, perform_cap_ocr_yolo_batch, split_text_top_bottom, draw_ocr_results
 # Import the new post-processing function
 from core.postprocessing import apply_post_processing
+from utils import profiling
+import config
 
 # --- Placeholder Functions ---
 # Keep extract_characters for now, unless OCR handles it directly
@@ -26,8 +29,13 @@ def extract_characters(image: np.ndarray, category: str) -> np.ndarray:
 # The 'character_data' from extract_characters is now just the image for OCR
 OCR_FUNCTIONS = {
     "CAP": perform_cap_ocr_yolo,
-    "BOX": perform_easyocr,
-    "SOYJOY": perform_easyocr,
+    "BOX": partial(perform_easyocr, category="BOX"),
+    "SOYJOY": partial(perform_easyocr, category="SOYJOY"),
+}
+
+# Categories whose OCR model can recognise several crops in one forward pass
+BATCH_OCR_FUNCTIONS = {
+    "CAP": perform_cap_ocr_yolo_batch,
 }
 
 # Define the processing steps for each category
@@ -38,82 +46,263 @@ PIPELINE_STEPS = {
     "SOYJOY": [apply_preprocessing_pipeline, extract_characters, OCR_FUNCTIONS["SOYJOY"]],
 }
 
-def run_ocr_pipeline(image: np.ndarray, category: str, image_path: str = None) -> dict:
+# --- Cascaded OCR ---
+# With config.CASCADE_ENABLED each crop first goes through a cheap tier (fast
+# preset without the denoising filters, and for EasyOCR the recognition-only
+# mode) and only escalates to the next tier when apply_post_processing doesn't
+# report success. The last tier is the regular full pipeline, so hard images
+# end up exactly where they did before. A tier's preset_path None means the
+# category's regular preset; batch_function None means no batched OCR.
+CascadeTier = namedtuple("CascadeTier", ["name", "preset_path", "ocr_function", "batch_function"])
+
+def _full_tier(category: str) -> CascadeTier:
+    return CascadeTier("full", None, PIPELINE_STEPS[category][2], BATCH_OCR_FUNCTIONS.get(category))
+
+CASCADE_TIERS = {
+    "CAP": [
+        CascadeTier("fast", FAST_PRESET_FILES["CAP"], perform_cap_ocr_yolo, perform_cap_ocr_yolo_batch),
+        _full_tier("CAP"),
+    ],
+    "BOX": [
+        CascadeTier("fast", FAST_PRESET_FILES["BOX"], partial(perform_easyocr, category="BOX", mode="recognize"), None),
+        _full_tier("BOX"),
+    ],
+    "SOYJOY": [
+        CascadeTier("fast", FAST_PRESET_FILES["SOYJOY"], partial(perform_easyocr, category="SOYJOY", mode="recognize"), None),
+        _full_tier("SOYJOY"),
+    ],
+}
+
+def get_tiers(category: str) -> list:
+    """Returns the tiers to run for a category: the cascade if enabled, else just the full pipeline."""
+    if config.CASCADE_ENABLED and category in CASCADE_TIERS:
+        return CASCADE_TIERS[category]
+    return [_full_tier(category)]
+
+def _error_result(category: str, message: str, timings: dict = None) -> dict:
+    """Builds the result returned when a pipeline stage raises."""
+    return {
+        'category': category,
+        'status': f'Error: {message}',
+        'formatted_top': '',
+        'formatted_bottom': '',
+        'timings': timings or {},
+    }
+
+def _pipeline_succeeded(result: dict) -> bool:
+    """True if the pipeline produced a validly formatted result."""
+    return isinstance(result, dict) and result.get('status') == 'success'
+
+def prepare_ocr_input(image: np.ndarray, category: str, artifacts: ArtifactSession = None, timings: dict = None,
+                      preset_path: str = None) -> np.ndarray:
+    """
+    Runs the preprocessing and character extraction steps for the category,
+    returning the image that should be fed to the OCR function.
+    `preset_path` overrides the category's preset (see CASCADE_TIERS).
+    """
+    pipeline = PIPELINE_STEPS[category]
+    if timings is None:
+        timings = {}
+
+    # Step 1: Preprocessing
+    with profiling.stage('preprocessing', timings):
+        preprocessed_image = pipeline[0](image, category, preset_path)
+    if artifacts:
+        artifacts.add("02_preprocessed", lambda: preprocessed_image)
+
+    # Step 2: Character Extraction (currently pass-through)
+    image_for_ocr = pipeline[1](preprocessed_image, category)
+    # if artifacts:
+    #     artifacts.add("03_extraction", lambda: image_for_ocr)
+    return image_for_ocr
+
+def _to_crop_coordinates(box, scale: float) -> list:
+    """Maps an OCR box on the normalised crop back to the original crop."""
+    if scale == 1.0:
+        return box
+    return [round(float(v) / scale, 1) for v in box]
+
+def finish_ocr_pipeline(image_for_ocr: np.ndarray, ocr_results: list, category: str,
+                        artifacts: ArtifactSession = None, timings: dict = None, scale: float = 1.0) -> dict:
+    """
+    Takes the raw OCR results for an image, splits them into top/bottom text
+    and applies the category post-processing rules. `scale` is the crop
+    normalisation factor; token boxes are returned in original crop coordinates.
+    """
+    if timings is None:
+        timings = {}
+
+    log.debug(f"OCR Results for {category}: {len(ocr_results)} items found")
+    if len(ocr_results) > 0:
+        log.debug(f"First result sample: {ocr_results[0]}")
+
+    # Draw bounding boxes on the image and save (drawing happens on the artifact writer thread)
+    if artifacts and ocr_results:
+        artifacts.add("03_ocr_results", lambda: draw_ocr_results(image_for_ocr, ocr_results))
+
+    # Step 4: Split text based on position
+    with profiling.stage('postprocessing', timings):
+        image_height = image_for_ocr.shape[0]
+        split_texts = split_text_top_bottom(ocr_results, image_height) # Returns {'top_text': ..., 'bottom_text': ...}
+        log.debug(f"Split texts for {category}: {split_texts}")
+
+        # Step 5: Apply post-processing to the split text
+        post_processing_result = apply_post_processing(category,split_texts)
+
+    # Combine all results into a single dictionary
+    return {
+        'category': category,
+        **post_processing_result, # Unpack the post-processing result (status, formatted_top, formatted_bottom)
+        'tokens': [_export_token(r, scale) for r in ocr_results],
+        'timings': timings,
+    }
+
+def _export_token(result: dict, scale: float) -> dict:
+    """The token as returned to callers: text, box in crop coordinates, confidence and the line it was read on, if known."""
+    token = {'text': result['text'], 'box': _to_crop_coordinates(result['box'], scale), 'confidence': result['confidence']}
+    if 'line' in result:
+        token['line'] = result['line']
+    return token
+
+def run_ocr_pipeline(image: np.ndarray, category: str, image_path: str = None, artifacts: ArtifactSession = None) -> dict:
     """
     Runs the appropriate OCR pipeline based on the category, splits text,
-    and applies post-processing.
+    and applies post-processing. With the cascade enabled, the tiers of
+    CASCADE_TIERS are tried in order and the result records the last one
+    run under 'tier'.
+
+    Intermediate images go to `artifacts` when given (the caller saved the
+    raw crop and commits it); otherwise a session for `image_path` is created
+    and committed here.
     """
     if category not in PIPELINE_STEPS:
         return {'category': category, 'status': 'Error: Unknown category', 'formatted_top': '', 'formatted_bottom': ''}
 
-    pipeline = PIPELINE_STEPS[category]
-    current_data = image # Start with the cropped image
-    
-    # Create output directory for intermediate images if image_path is provided
-    output_dir = None
-    if image_path:
-        # Get the base filename without extension
-        base_name = os.path.splitext(os.path.basename(image_path))[0]
-        # Create output directory
-        output_dir = os.path.join(os.path.dirname(image_path), base_name)
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Save the original cropped image
-        cv2.imwrite(os.path.join(output_dir, "01_raw.jpg"), image)
+    timings = {}
+    owns_artifacts = artifacts is None
+    if owns_artifacts:
+        artifacts = ArtifactSession(image_path)
+        # Save the crop as given, before normalisation (callers passing a
+        # session saved it before orientation, see crop_detection)
+        artifacts.add("01_raw", lambda: image)
 
-    try:
-        # Step 1: Preprocessing
-        preprocessed_image = pipeline[0](current_data, category)
-        if output_dir:
-            cv2.imwrite(os.path.join(output_dir, "02_preprocessed.jpg"), preprocessed_image)
-
-        # Step 2: Character Extraction (currently pass-through)
-        image_for_ocr = pipeline[1](preprocessed_image, category)
-        # if output_dir:
-        #     cv2.imwrite(os.path.join(output_dir, "03_extraction.jpg"), image_for_ocr)
-
-        # Step 3: Perform OCR using the category-specific function
-        ocr_function = pipeline[2]
-        ocr_results = ocr_function(image_for_ocr) # Returns list of {'box':..., 'text':..., 'conf':...}
-        
-        log.debug(f"OCR Results for {category}: {len(ocr_results)} items found")
-        if len(ocr_results) > 0:
-            log.debug(f"First result sample: {ocr_results[0]}")
-        
-        # Draw bounding boxes on the image and save
-        if output_dir and ocr_results:
+    with profiling.stage('normalize', timings):
+        image, scale = normalize_crop(image, category)
+
+    tiers = get_tiers(category)
+    for tier in tiers:
+        with profiling.stage(f"tier.{tier.name}", timings):
             try:
-                # Draw boxes and save
-                image_with_boxes = draw_ocr_results(image_for_ocr.copy(), ocr_results)
-                cv2.imwrite(os.path.join(output_dir, "03_ocr_results.jpg"), image_with_boxes)
+                image_for_ocr = prepare_ocr_input(image, category, artifacts, timings, tier.preset_path)
+
+                # Step 3: Perform OCR using the category-specific function
+                with profiling.stage('ocr', timings):
+                    ocr_results = tier.ocr_function(image_for_ocr) # Returns list of {'box':..., 'text':..., 'conf':...}
+
+                result = finish_ocr_pipeline(image_for_ocr, ocr_results, category, artifacts, timings, scale)
+
             except Exception as e:
-                log.error(f"Error drawing or saving OCR results: {e}", exc_info=True)
+                error_msg = f"Error in OCR pipeline for {category}: {str(e)}"
+                log.error(error_msg, exc_info=True)
+                result = _error_result(category, str(e), timings)
 
-        # Step 4: Split text based on position
-        image_height = image_for_ocr.shape[0]
-        split_texts = split_text_top_bottom(ocr_results, image_height) # Returns {'top_text': ..., 'bottom_text': ...}
-        log.debug(f"Splitssssss texts for {category}: {split_texts}")
-        # print("SPLIT TEXTSSSS ",split_texts)
-        # print("SPLIT TEXTSSSS ",split_texts['top_text'])
-        # print("CATEGORYYY ",category)
+        if len(tiers) > 1:
+            result['tier'] = tier.name
+        if _pipeline_succeeded(result):
+            break
+        if tier is not tiers[-1]:
+            log.info(f"OCR tier '{tier.name}' failed validation for {category}, escalating.")
 
-        # Step 5: Apply post-processing to the split text
-        post_processing_result = apply_post_processing(category,split_texts)
-        
-        # Combine all results into a single dictionary
-        result = {
-            'category': category,
-            **post_processing_result, # Unpack the post-processing result (status, formatted_top, formatted_bottom)
-        }
-        
-        return result
-        
+    if owns_artifacts:
+        artifacts.commit(_pipeline_succeeded(result))
+    return result
+
+def _run_tier_batch(tier: CascadeTier, images: list, category: str, artifact_sessions: list, timings_list: list,
+                    scales: list) -> list:
+    """Runs one tier for several (normalised) crops of the same category, batching the OCR call when possible."""
+    prepared = []  # (index, image_for_ocr, artifacts, timings)
+    results = [None] * len(images)
+    for index, (image, artifacts, timings) in enumerate(zip(images, artifact_sessions, timings_list)):
+        try:
+            image_for_ocr = prepare_ocr_input(image, category, artifacts, timings, tier.preset_path)
+            prepared.append((index, image_for_ocr, artifacts, timings))
+        except Exception as e:
+            log.error(f"Error in OCR pipeline for {category}: {str(e)}", exc_info=True)
+            results[index] = _error_result(category, str(e), timings)
+
+    if not prepared:
+        return results
+
+    batch_timings = {}
+    try:
+        with profiling.stage('ocr_batch', batch_timings):
+            if tier.batch_function is not None:
+                batch_ocr_results = tier.batch_function([item[1] for item in prepared])
+            else:
+                batch_ocr_results = [tier.ocr_function(item[1]) for item in prepared]
     except Exception as e:
-        error_msg = f"Error in OCR pipeline for {category}: {str(e)}"
-        log.error(error_msg, exc_info=True)
-        return {
-            'category': category,
-            'status': f'Error: {str(e)}',
-            'formatted_top': '',
-            'formatted_bottom': ''
-        }
\ No newline at end of file
+        log.error(f"Error in batched OCR for {category}: {str(e)}", exc_info=True)
+        for index, _, _, timings in prepared:
+            results[index] = _error_result(category, str(e), timings)
+        return results
+    # Attribute the shared OCR time evenly to every crop of the batch
+    ocr_time = batch_timings['ocr_batch'] / len(prepared)
+
+    for (index, image_for_ocr, artifacts, timings), ocr_results in zip(prepared, batch_ocr_results):
+        timings['ocr'] = timings.get('ocr', 0.0) + ocr_time
+        try:
+            results[index] = finish_ocr_pipeline(image_for_ocr, ocr_results, category, artifacts, timings, scales[index])
+        except Exception as e:
+            log.error(f"Error in OCR pipeline for {category}: {str(e)}", exc_info=True)
+            results[index] = _error_result(category, str(e), timings)
+
+    return results
+
+def run_ocr_pipeline_batch(images: list, category: str, artifact_sessions: list = None) -> list:
+    """
+    Runs the OCR pipeline for several crops of the same category. Preprocessing
+    still runs per crop, but categories with a batch OCR function (see
+    BATCH_OCR_FUNCTIONS) recognise all crops in a single model call. With the
+    cascade enabled, only the crops that fail a tier are batched into the next.
+
+    Args:
+        images (list): Cropped images.
+        category (str): The category shared by all crops.
+        artifact_sessions (list): Optional ArtifactSession per image; committing them is left to the caller.
+
+    Returns:
+        list: One result dictionary per input image, in input order.
+    """
+    if artifact_sessions is None:
+        artifact_sessions = [None] * len(images)
+
+    if category not in PIPELINE_STEPS:
+        return [run_ocr_pipeline(image, category, artifacts=artifacts)
+                for image, artifacts in zip(images, artifact_sessions)]
+
+    results = [None] * len(images)
+    timings_list = [{} for _ in images]
+    scales = []
+    normalized = []
+    for image, timings in zip(images, timings_list):
+        with profiling.stage('normalize', timings):
+            image, scale = normalize_crop(image, category)
+        normalized.append(image)
+        scales.append(scale)
+
+    pending = list(range(len(images)))
+    tiers = get_tiers(category)
+    for tier in tiers:
+        tier_results = _run_tier_batch(
+            tier, [normalized[i] for i in pending], category,
+            [artifact_sessions[i] for i in pending], [timings_list[i] for i in pending],
+            [scales[i] for i in pending])
+        for index, result in zip(pending, tier_results):
+            if len(tiers) > 1:
+                result['tier'] = tier.name
+            results[index] = result
+        pending = [index for index in pending if not _pipeline_succeeded(results[index])]
+        if not pending:
+            break
+
+    return results
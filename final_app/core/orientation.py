@@ -0,0 +1,96 @@
+# core/orientation.py
+import cv2
+import numpy as np
+from core.models import get_model
+from core.ocr import perform_cap_ocr_yolo_batch
+from core.preprocessing import apply_preprocessing_pipeline, FAST_PRESET_FILES
+from utils.logger import log
+import config
+
+# --- Crop Orientation ---
+# Sideways or upside-down prints fail format validation, so with
+# config.ORIENTATION_ENABLED the crop is turned upright before OCR: the four
+# rotations of the fast-preset crop are read in ONE batched call of the
+# category's OCR model (CAP character detector, or the text recogniser for
+# BOX/SOYJOY) and scored by how much confident text each gives. The crop is
+# rotated only when a rotation clearly beats the upright read
+# (ORIENTATION_MIN_GAIN), so prints that read poorly either way stay as they are.
+# No cheaper text-line axis heuristic narrows the candidates down first: cap
+# rims and box edges swamp the projection profiles of these crops.
+# Token boxes of a rotated scan refer to the rotated crop.
+
+# Clockwise rotation in degrees -> cv2.rotate code
+ROTATIONS = {
+    90: cv2.ROTATE_90_CLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_COUNTERCLOCKWISE,
+}
+# Rotations scored, the upright crop first
+ANGLES = (0, 90, 180, 270)
+
+
+def rotate(image: np.ndarray, angle: int) -> np.ndarray:
+    """Rotates an image clockwise by 0, 90, 180 or 270 degrees."""
+    if angle == 0:
+        return image
+    return cv2.rotate(image, ROTATIONS[angle])
+
+
+def _score_cap(variants: list, category: str) -> list:
+    """Summed confidence of the characters the CAP model finds in each variant."""
+    return [sum(token['confidence'] for token in tokens) for tokens in perform_cap_ocr_yolo_batch(variants)]
+
+
+def _score_text(variants: list, category: str) -> list:
+    """Confidence-weighted count of the alphanumeric characters the recogniser reads in each variant."""
+    reader = get_model('easyocr')
+    if reader is None:
+        log.error("EasyOCR is not available, can't score orientations.")
+        return [0.0] * len(variants)
+    return [sum(float(confidence) * sum(c.isalnum() for c in text) for _, text, confidence in results)
+            for results in reader.readtext_batch(variants)]
+
+
+ORIENTATION_SCORERS = {
+    "CAP": _score_cap,
+    "BOX": _score_text,
+    "SOYJOY": _score_text,
+}
+
+
+def detect_orientation(image: np.ndarray, category: str):
+    """
+    Finds the clockwise rotation that makes the crop's text upright.
+
+    Returns:
+        tuple: (angle, scores) with the chosen angle (0 if the crop stays as it
+               is) and the score of each rotation.
+    """
+    scorer = ORIENTATION_SCORERS.get(category)
+    if scorer is None:
+        return 0, {}
+
+    preprocessed = apply_preprocessing_pipeline(image, category, FAST_PRESET_FILES.get(category))
+    scores = dict(zip(ANGLES, scorer([rotate(preprocessed, angle) for angle in ANGLES], category)))
+
+    # max() keeps the first of equal scores, so ties stay upright
+    best = max(ANGLES, key=lambda angle: scores[angle])
+    if best != 0 and scores[best] > config.ORIENTATION_MIN_GAIN * scores[0]:
+        return best, scores
+    return 0, scores
+
+
+def orient_crop(image: np.ndarray, category: str):
+    """
+    Turns the crop upright when config.ORIENTATION_ENABLED is on.
+
+    Returns:
+        tuple: (image, angle) with the possibly rotated crop and the clockwise
+               rotation applied to it (0 when it was left as it was).
+    """
+    if not config.ORIENTATION_ENABLED:
+        return image, 0
+    angle, scores = detect_orientation(image, category)
+    if angle:
+        log.info(f"Rotating {category} crop by {angle} degrees (scores {scores})")
+    return rotate(image, angle), angle
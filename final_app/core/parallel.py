@@ -0,0 +1,108 @@
+# core/parallel.py
+import multiprocessing
+import multiprocessing.util
+import os
+import time
+from core import artifacts
+from core.result_schema import build_result_payload
+from utils.logger import log
+from utils import profiling
+import config
+
+# NOTE: core.processing is imported inside the worker initializer, *after* the
+# thread limits are set, and the models (torch/ultralytics/easyocr) are only
+# loaded on first use, so each worker starts its native thread pools with the
+# pinned size and only holds the models its images actually need.
+
+_process_image = None
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+def _init_worker(threads_per_worker: int, log_disabled: bool, config_overrides: dict = None):
+    """Process pool initializer: pins thread counts and imports the pipeline once per worker."""
+    global _process_image
+    # Spawned workers don't run main(), so mirror the parent's logging switch
+    log.disabled = log_disabled
+    # ...and any config values the parent changed at runtime
+    for name, value in (config_overrides or {}).items():
+        setattr(config, name, value)
+
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads_per_worker)
+
+    import cv2
+    cv2.setNumThreads(threads_per_worker)
+    try:
+        import torch
+        torch.set_num_threads(threads_per_worker)
+        torch.set_num_interop_threads(1)
+    except (ImportError, RuntimeError) as e:
+        # set_num_interop_threads raises if torch was already used in this process
+        log.debug(f"Could not pin torch threads: {e}")
+
+    from core.processing import process_image
+    _process_image = process_image
+    # Write out the artifacts still queued when the worker exits (run_parallel closes the pool
+    # instead of terminating it), so no image waits for the writer before returning
+    multiprocessing.util.Finalize(None, artifacts.flush, exitpriority=10)
+    log.info(f"Worker {os.getpid()} initialised with {threads_per_worker} thread(s).")
+
+
+def _run_one(image_path: str) -> dict:
+    """Processes one image inside a worker and returns its schema payload."""
+    start_time = time.perf_counter()
+    try:
+        result = _process_image(image_path)
+    except Exception as e:
+        log.error(f"Failed to process image {image_path}: {e}", exc_info=True)
+        result = {'error': str(e)}
+    payload = build_result_payload(result, image_path)
+    payload['timings']['total'] = time.perf_counter() - start_time
+    return payload
+
+
+def resolve_worker_count(workers: int = None) -> int:
+    """Returns the number of worker processes to use (config default, at least 1)."""
+    if workers is None:
+        workers = config.PARALLEL_WORKERS
+    if not workers:
+        workers = os.cpu_count() or 1
+    return max(1, workers)
+
+
+def run_parallel(image_paths: list, workers: int = None, threads_per_worker: int = None, chunksize: int = 1,
+                 config_overrides: dict = None):
+    """
+    Processes images across a pool of worker processes, each holding its own
+    copy of the models.
+
+    Args:
+        image_paths (list): Images to process.
+        workers (int): Number of worker processes (defaults to config.PARALLEL_WORKERS or the CPU count).
+        threads_per_worker (int): Torch/OpenCV threads per worker (defaults to config.THREADS_PER_WORKER).
+        chunksize (int): Number of images handed to a worker at a time.
+        config_overrides (dict): config.py values to set in every worker (spawned
+                                 workers re-import config and don't see runtime changes).
+
+    Yields:
+        dict: One schema payload per image, in input order.
+    """
+    workers = resolve_worker_count(workers)
+    if threads_per_worker is None:
+        threads_per_worker = config.THREADS_PER_WORKER
+
+    log.info(f"Starting process pool with {workers} workers x {threads_per_worker} thread(s).")
+    # 'spawn' avoids inheriting torch/OpenMP state from the parent and behaves the same on Windows
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=workers, initializer=_init_worker, initargs=(threads_per_worker, log.disabled, config_overrides)) as pool:
+        for payload in pool.imap(_run_one, image_paths, chunksize=chunksize):
+            # Stage histograms live per process, so rebuild the aggregate from the payloads
+            for stage, seconds in payload['timings'].items():
+                profiling.observe(stage, seconds)
+            yield payload
+        # Leaving the block terminates the workers; close and join first so they exit
+        # normally and their Finalize hooks flush the artifacts they still have queued
+        pool.close()
+        pool.join()
+
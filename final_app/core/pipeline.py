@@ -0,0 +1,215 @@
+# core/pipeline.py
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from core.backends.base import Detector, TextRecognizer
+from contextlib import contextmanager
+from core.models import registry as default_registry, use_models
+from core.preprocessing import PRESET_FILES, FAST_PRESET_FILES, PlanCache, use_plans
+from core.processing import process_image, process_image_bytes
+from core.result_schema import build_result_payload
+from core.settings import check_settings, use_settings
+from utils.logger import log
+import config
+
+# --- Threaded Pipeline ---
+# A Pipeline runs several scans at once on a thread pool in one process, with
+# one copy of the weights. OpenCV and torch release the GIL inside their
+# kernels, so the preprocessing of one scan overlaps with the inference of
+# another instead of needing a process (and a model copy) per scan.
+#
+# A Pipeline owns what its scans run with, so several Pipelines with
+# different settings can run in one process:
+#   settings  config.py overrides, seen as config.NAME by its scans (core/settings.py)
+#   models    its own model registry, loaded under those settings, and handed
+#             to the threads by the ModelContext below
+#   presets   its own PlanCache of compiled preprocessing presets
+# The pipeline code fetches them with core.models.get_model() and
+# core.preprocessing.get_preprocessing_plan(), which resolve to the Pipeline
+# running the scan. Each model is handed to the threads according to its
+# concurrency mode (config.MODEL_CONCURRENCY):
+#   "shared"      the one instance, called from any thread at any time
+#   "locked"      the one instance, one call at a time
+#   "per_thread"  a separate instance per thread
+# The stage functions themselves keep no per-scan module state: the result
+# cache and the artifact writer are guarded by locks and the profiling scope
+# is a context variable.
+
+CONCURRENCY_MODES = ("shared", "locked", "per_thread")
+
+
+class LockedDetector(Detector):
+    """Serialises the calls to a detector that isn't thread-safe."""
+
+    def __init__(self, model: Detector):
+        self.model = model
+        self._lock = threading.Lock()
+
+    @property
+    def names(self) -> dict:
+        return self.model.names
+
+    def predict(self, images: list, regions: list = None) -> list:
+        with self._lock:
+            return self.model.predict(images, regions)
+
+
+class LockedRecognizer(TextRecognizer):
+    """Serialises the calls to a text recogniser that isn't thread-safe."""
+
+    def __init__(self, model: TextRecognizer):
+        self.model = model
+        self._lock = threading.Lock()
+
+    def readtext(self, image):
+        with self._lock:
+            return self.model.readtext(image)
+
+    def readtext_batch(self, images: list, regions: list = None) -> list:
+        with self._lock:
+            return self.model.readtext_batch(images, regions)
+
+    def recognize(self, image, horizontal_list: list, free_list: list, allowlist: str = None):
+        with self._lock:
+            return self.model.recognize(image, horizontal_list, free_list, allowlist)
+
+
+def _locked(model):
+    if isinstance(model, Detector):
+        return LockedDetector(model)
+    if isinstance(model, TextRecognizer):
+        return LockedRecognizer(model)
+    raise TypeError(f"Can't serialise calls to {type(model).__name__}, "
+                    f"expected a Detector or TextRecognizer (core/backends/base.py)")
+
+
+class ModelContext:
+    """The models of one Pipeline, handed to its threads according to their concurrency mode."""
+
+    def __init__(self, registry, modes: dict):
+        for name, mode in modes.items():
+            if mode not in CONCURRENCY_MODES:
+                raise ValueError(f"Unknown concurrency mode '{mode}' for model '{name}', "
+                                 f"expected one of {CONCURRENCY_MODES}")
+        self.registry = registry
+        self.modes = dict(modes)
+        self._wrapped = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get(self, name: str):
+        """Returns the model to use from the calling thread (None if it can't be loaded)."""
+        mode = self.modes.get(name, "locked")
+        if mode == "per_thread":
+            models = self._local.__dict__.setdefault('models', {})
+            if name not in models:
+                log.info(f"Loading a copy of model '{name}' for thread {threading.current_thread().name}")
+                models[name] = self.registry.create(name)
+            return models[name]
+
+        model = self.registry.get(name)
+        if mode == "shared" or model is None:
+            return model
+        with self._lock:
+            wrapped = self._wrapped.get(name)
+            # The registry may hand out a new instance after a re-register
+            if wrapped is None or wrapped.model is not model:
+                wrapped = self._wrapped[name] = _locked(model)
+        return wrapped
+
+
+class Pipeline:
+    """
+    Scans images concurrently on a thread pool with one set of models.
+
+    Usage:
+        with Pipeline(threads=4) as pipeline:
+            pipeline.preload()
+            for payload in pipeline.map(image_paths):
+                ...
+    """
+
+    def __init__(self, threads: int = None, model_concurrency: dict = None, registry=None, settings: dict = None):
+        """
+        Args:
+            threads (int): Scans run at the same time (defaults to config.PIPELINE_THREADS).
+            model_concurrency (dict): Per-model concurrency modes, on top of config.MODEL_CONCURRENCY.
+            registry: Model registry to load from (defaults to a new registry with the
+                      loaders of the one in core/models.py).
+            settings (dict): config.py values to use for this pipeline's scans,
+                             e.g. {'CASCADE_ENABLED': True}.
+        """
+        self.settings = check_settings(settings or {})
+        with use_settings(self.settings):
+            self.threads = max(1, threads or config.PIPELINE_THREADS)
+            modes = {**config.MODEL_CONCURRENCY, **(model_concurrency or {})}
+        self.models = ModelContext(registry or default_registry.clone(), modes)
+        self.plans = PlanCache()
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="scan")
+
+    @contextmanager
+    def activate(self):
+        """Runs the enclosed code with this pipeline's settings, models and presets."""
+        with use_settings(self.settings), use_models(self.models), use_plans(self.plans):
+            yield self
+
+    def preload(self, names=None) -> dict:
+        """
+        Loads the shared/locked models and compiles the presets up front, so no
+        scan pays for them. Per-thread copies are loaded by each thread on first use.
+
+        Returns:
+            dict: The model load statistics (see ModelRegistry.stats).
+        """
+        with use_settings(self.settings):
+            for name in (names if names is not None else config.PRELOAD_MODELS):
+                if self.models.modes.get(name, "locked") != "per_thread":
+                    self.models.get(name)
+            for presets in (PRESET_FILES, FAST_PRESET_FILES, config.PRESET_OVERRIDES):
+                for preset_path in presets.values():
+                    if os.path.exists(preset_path):
+                        self.plans.get(preset_path)
+        return self.models.registry.stats()
+
+    def scan(self, image_path: str = None, data=None) -> dict:
+        """
+        Processes one image in the calling thread and returns its schema payload.
+
+        Args:
+            image_path (str): The image file, or with `data` the path the image is
+                              stored under (used for artifacts and echoed back).
+            data: The encoded image in memory (see process_image_bytes), read
+                  instead of image_path.
+        """
+        start_time = time.perf_counter()
+        with self.activate():
+            try:
+                if data is not None:
+                    result = process_image_bytes(data, artifact_path=image_path)
+                else:
+                    result = process_image(image_path)
+            except Exception as e:
+                log.error(f"Failed to process image {image_path or '<memory>'}: {e}", exc_info=True)
+                result = {'error': str(e)}
+        payload = build_result_payload(result, image_path)
+        payload['timings']['total'] = time.perf_counter() - start_time
+        return payload
+
+    def submit(self, image_path: str = None, data=None):
+        """Schedules a scan on the pool. Returns a Future of its schema payload."""
+        return self._executor.submit(self.scan, image_path, data)
+
+    def map(self, image_paths):
+        """Scans the images on the pool and yields their schema payloads in input order."""
+        return self._executor.map(self.scan, image_paths)
+
+    def close(self):
+        """Waits for the running scans and stops the pool."""
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
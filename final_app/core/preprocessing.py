@@ -1,9 +1,17 @@
 # core/preprocessing.py
 import cv2
 import numpy as np
+import contextvars
 import json
 import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from types import MappingProxyType
 from utils.logger import log
+from utils import profiling
+import config
 
 # --- Configuration for Preset Paths ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -15,9 +23,22 @@ PRESET_FILES = {
     "BOX": os.path.join(PRESET_BASE_PATH, "final_lotno_box_preproc (used).json"),
     "SOYJOY": os.path.join(PRESET_BASE_PATH, "final_lotno_soyjoy_preproc (used).json"),
 }
+# Cheap first-tier presets for cascaded OCR: the full presets without the slow denoising filters
+FAST_PRESET_FILES = {
+    "CAP": os.path.join(PRESET_BASE_PATH, "fast_cap_preproc.json"),
+    "BOX": os.path.join(PRESET_BASE_PATH, "fast_lotno_box_preproc.json"),
+    "SOYJOY": os.path.join(PRESET_BASE_PATH, "fast_lotno_soyjoy_preproc.json"),
+}
 
 # --- Mapping from JSON function names to OpenCV functions ---
 # Each function here should accept the image and a dictionary of parameters
+def _get_kernel(params, kernel_size):
+    """Returns the structuring element prebuilt by the compiled plan, or builds one."""
+    kernel = params.get("kernel")
+    if kernel is None:
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
+    return kernel
+
 def apply_grayscale(image, params):
     log.debug("Applying Grayscale")
     return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
@@ -63,20 +84,20 @@ def apply_adaptive_threshold(image, params):
 def apply_morph_opening(image, params):
     kernel_size = params.get("kernel_size", 3)
     log.debug(f"Applying Morphological Opening: kernel_size={kernel_size}")
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
+    kernel = _get_kernel(params, kernel_size)
     return cv2.morphologyEx(image, cv2.MORPH_OPEN, kernel)
 
 def apply_morph_closing(image, params):
     kernel_size = params.get("kernel_size", 3)
     log.debug(f"Applying Morphological Closing: kernel_size={kernel_size}")
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
+    kernel = _get_kernel(params, kernel_size)
     return cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel)
 
 def apply_dilate(image, params):
     kernel_size = params.get("kernel_size", 3)
     iterations = params.get("iterations", 1)
     log.debug(f"Applying Dilate: kernel_size={kernel_size}, iterations={iterations}")
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
+    kernel = _get_kernel(params, kernel_size)
     return cv2.dilate(image, kernel, iterations=iterations)
 
 # Add other functions as needed...
@@ -93,47 +114,212 @@ PROCESSING_FUNCTIONS = {
     # Add mappings for any other functions defined in your JSON files
 }
 
+# --- Parameter Normalisation ---
+# Each normaliser fills in defaults, fixes invalid values and prebuilds anything
+# (e.g. structuring elements) that would otherwise be recreated on every image.
+def _odd_at_least_3(value):
+    value = int(value)
+    if value <= 1: value = 3
+    if value % 2 == 0: value += 1
+    return value
+
+def _normalize_bilateral(params):
+    return {"d": int(params.get("d", 9)),
+            "sigmaColor": params.get("sigmaColor", 75),
+            "sigmaSpace": params.get("sigmaSpace", 75)}
+
+def _normalize_nl_means(params):
+    return {"h": params.get("h", 10),
+            "templateWindowSize": int(params.get("templateWindowSize", 7)),
+            "searchWindowSize": int(params.get("searchWindowSize", 21))}
+
+def _normalize_convert_scale_abs(params):
+    return {"alpha": params.get("alpha", 1.0), "beta": params.get("beta", 0)}
+
+def _normalize_adaptive_threshold(params):
+    return {"block_size": _odd_at_least_3(params.get("block_size", 11)), "C": params.get("C", 2)}
+
+def _normalize_morphology(params):
+    kernel_size = int(params.get("kernel_size", 3))
+    normalized = {"kernel_size": kernel_size,
+                  "kernel": cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))}
+    if "iterations" in params:
+        normalized["iterations"] = int(params["iterations"])
+    return normalized
+
+PARAM_NORMALIZERS = {
+    "Grayscale": lambda params: {},
+    "Bilateral Filtered Image": _normalize_bilateral,
+    "Fast Non-Local Means Denoising": _normalize_nl_means,
+    "Convert Scale Abs": _normalize_convert_scale_abs,
+    "Adaptive Threshold": _normalize_adaptive_threshold,
+    "Morphological Opening": _normalize_morphology,
+    "Morphological Closing": _normalize_morphology,
+    "Dilate": _normalize_morphology,
+}
+
+# --- Compiled Presets ---
+# A preset JSON file is compiled once into an immutable plan of resolved steps.
+# Plans are cached per file in a PlanCache and recompiled when the file's mtime
+# changes; the mtime is checked at most every PRESET_RECHECK_SECONDS, not for
+# every crop. Each Pipeline (core/pipeline.py) owns a PlanCache, selected for
+# its scans with use_plans(); other callers share the module's default one.
+PlanStep = namedtuple("PlanStep", ["name", "function", "params"])
+PreprocessingPlan = namedtuple("PreprocessingPlan", ["path", "mtime", "steps"])
+
+PRESET_RECHECK_SECONDS = 2.0
+
+def compile_preset(preset_path: str) -> PreprocessingPlan:
+    """
+    Loads a preset JSON file and compiles it into a PreprocessingPlan.
+
+    Steps that aren't implemented (e.g. 'Fill Black Corners') are left out of
+    the plan with a warning, logged once per compile instead of per image.
+
+    Raises:
+        ValueError: If the file is malformed.
+        OSError: If the file can't be read.
+    """
+    mtime = os.path.getmtime(preset_path)
+    with open(preset_path, 'r') as f:
+        pipeline_steps = json.load(f)
+
+    if not isinstance(pipeline_steps, list):
+        raise ValueError(f"Preset {preset_path} must contain a list of steps")
+
+    steps = []
+    for step in pipeline_steps:
+        func_name = step.get("function")
+        if func_name not in PROCESSING_FUNCTIONS:
+            log.warning(f"Preprocessing function '{func_name}' in {preset_path} not implemented or mapped, skipping it.")
+            continue
+        params = PARAM_NORMALIZERS[func_name](step.get("params", {}))
+        steps.append(PlanStep(func_name, PROCESSING_FUNCTIONS[func_name], MappingProxyType(params)))
+
+    log.info(f"Compiled preprocessing preset {preset_path} ({len(steps)} steps)")
+    return PreprocessingPlan(preset_path, mtime, tuple(steps))
+
+class PlanCache:
+    """Compiled plans per preset file."""
+
+    def __init__(self):
+        self._plans = {}
+        self._checked_at = {} # preset path -> time.monotonic() of the last mtime check
+        self._lock = threading.Lock()
+
+    def get(self, preset_path: str) -> PreprocessingPlan:
+        """
+        Returns the compiled plan for a preset file, recompiling it if the
+        file changed (noticed within PRESET_RECHECK_SECONDS).
+        """
+        now = time.monotonic()
+        plan = self._plans.get(preset_path)
+        if plan is not None and now - self._checked_at.get(preset_path, float('-inf')) < PRESET_RECHECK_SECONDS:
+            return plan
+
+        mtime = os.path.getmtime(preset_path)
+        if plan is not None and plan.mtime == mtime:
+            self._checked_at[preset_path] = now
+            return plan
+
+        with self._lock:
+            plan = self._plans.get(preset_path)
+            if plan is None or plan.mtime != mtime:
+                plan = compile_preset(preset_path)
+                self._plans[preset_path] = plan
+            self._checked_at[preset_path] = now
+        return plan
+
+_default_plans = PlanCache()
+# Plan cache of the scan running in the current thread (see core/pipeline.py)
+_active_plans = contextvars.ContextVar("active_plans", default=None)
+
+@contextmanager
+def use_plans(plans: PlanCache):
+    """Makes get_preprocessing_plan() use `plans` inside the block."""
+    token = _active_plans.set(plans)
+    try:
+        yield plans
+    finally:
+        _active_plans.reset(token)
+
+def get_preprocessing_plan(preset_path: str) -> PreprocessingPlan:
+    """Returns the compiled plan for a preset file from the active PlanCache (the default one unless set by use_plans)."""
+    plans = _active_plans.get()
+    return (plans if plans is not None else _default_plans).get(preset_path)
+
+def run_preprocessing_plan(image: np.ndarray, plan: PreprocessingPlan, category: str = None, timings: dict = None) -> np.ndarray:
+    """Applies the steps of a compiled plan to an image, timing each step as 'preprocessing.<step name>'."""
+    processed_image = image.copy() # Work on a copy
+
+    for step in plan.steps:
+        try:
+            log.debug(f"Applying step: {step.name} with params: {dict(step.params)}")
+            with profiling.stage(f"preprocessing.{step.name}", timings):
+                processed_image = step.function(processed_image, step.params)
+        except Exception as e:
+            log.error(f"Error applying step '{step.name}' for category '{category}': {e}", exc_info=True)
+            # Decide if you want to stop or continue on error
+            # return image # Option: return original image on error
+            continue # Option: skip failed step and continue
+
+    return processed_image
+
+# --- Crop Normalisation ---
+def normalize_crop(image: np.ndarray, category: str):
+    """
+    Rescales a crop to config.CROP_TARGET_HEIGHTS[category] so preprocessing and
+    OCR cost doesn't depend on how close the camera was. Crops are only enlarged
+    when CROP_NORMALIZATION_UPSCALE is set.
+
+    Returns:
+        tuple: (image, scale) where scale is new size / original size (1.0 if unchanged).
+    """
+    target_height = config.CROP_TARGET_HEIGHTS.get(category) if config.CROP_NORMALIZATION else None
+    if not target_height or image is None or image.shape[0] == 0:
+        return image, 1.0
+
+    scale = target_height / float(image.shape[0])
+    if scale == 1.0 or (scale > 1.0 and not config.CROP_NORMALIZATION_UPSCALE):
+        return image, 1.0
+
+    width = max(1, round(image.shape[1] * scale))
+    interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+    resized = cv2.resize(image, (width, int(target_height)), interpolation=interpolation)
+    log.debug(f"Normalised {category} crop from {image.shape[1]}x{image.shape[0]} to {width}x{target_height}")
+    # Report the scale actually applied on both axes (width is rounded)
+    return resized, target_height / float(image.shape[0])
+
 # --- Main Pipeline Function ---
-def apply_preprocessing_pipeline(image: np.ndarray, category: str) -> np.ndarray:
+def apply_preprocessing_pipeline(image: np.ndarray, category: str, preset_path: str = None) -> np.ndarray:
     """
-    Loads the preprocessing pipeline JSON for the category and applies the steps.
+    Applies the compiled preprocessing preset for the category to the image.
+
+    Args:
+        image (np.ndarray): The cropped image.
+        category (str): The detected category.
+        preset_path (str): Preset to use instead of the category's default
+                           (config.PRESET_OVERRIDES, else PRESET_FILES), e.g.
+                           a FAST_PRESET_FILES entry for cascaded runs.
     """
     log.info(f"Starting preprocessing pipeline for category: {category}")
-    preset_path = PRESET_FILES.get(category)
+    if preset_path is None:
+        preset_path = config.PRESET_OVERRIDES.get(category) or PRESET_FILES.get(category)
 
     if not preset_path:
         log.error(f"No preset file defined for category: {category}")
         return image # Return original image if no preset found
 
-    if not os.path.exists(preset_path):
+    try:
+        plan = get_preprocessing_plan(preset_path)
+    except FileNotFoundError:
         log.error(f"Preset file not found: {preset_path}")
         return image # Return original image if file is missing
-
-    try:
-        with open(preset_path, 'r') as f:
-            pipeline_steps = json.load(f)
     except Exception as e:
-        log.error(f"Failed to load or parse JSON preset file {preset_path}: {e}")
+        log.error(f"Failed to load or compile preset file {preset_path}: {e}")
         return image
 
-    processed_image = image.copy() # Work on a copy
-
-    for step in pipeline_steps:
-        func_name = step.get("function")
-        params = step.get("params", {})
-
-        if func_name in PROCESSING_FUNCTIONS:
-            try:
-                log.debug(f"Applying step: {func_name} with params: {params}")
-                processing_func = PROCESSING_FUNCTIONS[func_name]
-                processed_image = processing_func(processed_image, params)
-            except Exception as e:
-                log.error(f"Error applying step '{func_name}' for category '{category}': {e}", exc_info=True)
-                # Decide if you want to stop or continue on error
-                # return image # Option: return original image on error
-                continue # Option: skip failed step and continue
-        else:
-            log.warning(f"Preprocessing function '{func_name}' not implemented or mapped.")
+    processed_image = run_preprocessing_plan(image, plan, category)
 
     log.info(f"Preprocessing pipeline for category {category} completed.")
-    return processed_image
\ No newline at end of file
+    return processed_image
@@ -1,110 +1,294 @@
 # core/processing.py
-import os
 import cv2
-from core.detection import detect_objects
+from core.artifacts import ArtifactSession
+from core.cache import get_result_cache, is_cacheable
+from core.detection import (detect_objects_by_image, read_detection_frame, decode_detection_frame, decode_image,
+                            array_detection_frame, map_detection_to_source, select_detections)
 from core.ocr_pipeline import run_ocr_pipeline
+from core.orientation import orient_crop
+from core.quality import check_crop_quality
+from core.token_store import record_tokens
 from utils.logger import log
+from utils import profiling
+import config
+
+# Small margin (in pixels) added around the detection before cropping
+CROP_MARGIN = 5
+
+def render_detection(image, box, category: str):
+    """Returns a copy of the frame with the detection box and category drawn on it."""
+    x1, y1, x2, y2 = box
+    image_with_box = image.copy()
+    cv2.rectangle(image_with_box, (x1, y1), (x2, y2), (0, 255, 0), 2)
+    cv2.putText(image_with_box, category,
+               (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+    return image_with_box
+
+def crop_detection(image, detection: dict, artifacts: ArtifactSession = None):
+    """
+    Crops the image to the detection box (plus CROP_MARGIN) and registers the
+    frame with the detection box drawn on it and the raw crop (before the
+    orientation and normalisation steps) as artifacts.
+
+    Returns:
+        np.ndarray: The cropped image.
+    """
+    x1, y1, x2, y2 = detection['box']
+    x1 = max(0, x1 - CROP_MARGIN)
+    y1 = max(0, y1 - CROP_MARGIN)
+    x2 = min(image.shape[1], x2 + CROP_MARGIN)
+    y2 = min(image.shape[0], y2 + CROP_MARGIN)
+
+    cropped_image = image[y1:y2, x1:x2]
+
+    if artifacts:
+        # Save the original image with detection box (drawn on the artifact writer thread)
+        artifacts.add("00_detection", lambda: render_detection(image, (x1, y1, x2, y2), detection['category']))
+        artifacts.add("01_raw", lambda: cropped_image)
+
+    return cropped_image
+
+def attach_detection(ocr_result: dict, detection: dict, detection_time: float) -> dict:
+    """Adds the detection info and detection timing to an OCR pipeline result."""
+    ocr_result['detection'] = {
+        'box': detection['box'],
+        'confidence': detection['confidence']
+    }
+    ocr_result['timings'] = {
+        'detection': detection_time,
+        **ocr_result.get('timings', {}),
+    }
+    return ocr_result
+
+def select_for_ocr(detection_result, model) -> list:
+    """
+    Selects the detections to OCR for one image using the configured confidence
+    floor and top-k. Boxes keep the detector's float coordinates; pass them
+    through map_detection_to_source before cropping.
+    """
+    return select_detections(detection_result, model.names,
+                             config.DETECTION_MIN_CONFIDENCE, config.DETECTION_TOP_K, exact=True)
+
+# --- Per-Crop Stages ---
+# Every selected detection (the largest one and, with DETECTION_TOP_K > 1, the
+# extra objects; in single-image and batch mode alike) goes through the same
+# stages: prepare_crop, the OCR pipeline, then finish_crop.
+
+def prepare_crop(image, detection: dict, artifacts: ArtifactSession = None, timings: dict = None):
+    """
+    Runs the stages before OCR on one detection: full-resolution crop, quality
+    gate and orientation.
+
+    Returns:
+        tuple: (cropped_image, angle, rejection) with the possibly rotated crop, the
+               clockwise rotation applied to it and the quality gate's 'retake: ...'
+               result (None if the crop goes on to OCR; the angle is then 0).
+    """
+    category = detection['category']
+    with profiling.stage('crop', timings):
+        cropped_image = crop_detection(image, detection, artifacts)
+
+    # Reject crops that can never be read, before preprocessing and OCR
+    with profiling.stage('quality', timings):
+        rejection = check_crop_quality(cropped_image, category)
+    if rejection is not None:
+        if artifacts:
+            artifacts.commit(False)
+        return cropped_image, 0, rejection
+
+    # Turn sideways or upside-down crops upright
+    with profiling.stage('orientation', timings):
+        cropped_image, angle = orient_crop(cropped_image, category)
+    return cropped_image, angle, None
+
+def finish_crop(label: str, ocr_result: dict, cropped_image, angle: int, artifacts: ArtifactSession = None) -> dict:
+    """Records the orientation, commits the artifacts and stores the tokens of one OCR pipeline result."""
+    if angle:
+        ocr_result['orientation'] = angle
+    if artifacts:
+        artifacts.commit(ocr_result.get('status') == 'success')
+    record_tokens(label, ocr_result, cropped_image.shape[0])
+    return ocr_result
+
+def summarize_object(result: dict, detection: dict) -> dict:
+    """Compact summary of an extra object's result, as listed under 'objects'."""
+    summary = {
+        'category': detection['category'],
+        'status': result.get('status'),
+        'message': result.get('message', ''),
+        'formatted_top': result.get('formatted_top', ''),
+        'formatted_bottom': result.get('formatted_bottom', ''),
+        'detection': {'box': detection['box'], 'confidence': detection['confidence']},
+    }
+    for optional in ('orientation', 'quality'):
+        if optional in result:
+            summary[optional] = result[optional]
+    return summary
+
+def process_additional_objects(image, detections: list, label: str = None) -> list:
+    """
+    Runs the detections after the largest one (when DETECTION_TOP_K > 1)
+    through the per-crop stages and returns a compact summary per object.
+    """
+    objects = []
+    for detection in detections:
+        cropped_image, angle, rejection = prepare_crop(image, detection)
+        if rejection is None:
+            result = finish_crop(label, run_ocr_pipeline(cropped_image, detection['category']), cropped_image, angle)
+        else:
+            result = rejection
+        objects.append(summarize_object(result, detection))
+    return objects
 
 def process_image(image_path: str):
     """
     Processes the image: detects objects, finds the largest, crops, and runs OCR pipeline.
+
+    Dict results carry the per-stage wall times under 'timings' and the per-stage
+    memory readings in MB under 'memory', with 'memory_metric' saying what they
+    are: "rss_delta" (change in resident memory, not a peak) or "traced_peak"
+    (tracemalloc peak, single-threaded scans only). See utils/profiling.py.
     """
     if not image_path:
         log.error("No image path provided.")
         return
 
+    return _profiled_scan(image_path, lambda: read_detection_frame(image_path),
+                          lambda: cv2.imread(image_path), image_path)
+
+def process_image_bytes(data, label: str = None, artifact_path: str = None):
+    """
+    Processes an encoded image (JPEG, PNG, ...) held in memory, e.g. an upload
+    that hasn't been written to disk. Same result as process_image.
+
+    Args:
+        data: The encoded image: bytes, bytearray, memoryview, mmap or a uint8 array.
+        label (str): Name of the image in logs and profiles (defaults to artifact_path).
+        artifact_path (str): Where the image is (or will be) stored; debug artifacts
+                             are written next to it. No artifacts are written without it.
+    """
+    if data is None or len(data) == 0:
+        log.error("No image data provided.")
+        return
+
+    return _profiled_scan(label or artifact_path or "<memory>", lambda: decode_detection_frame(data),
+                          lambda: decode_image(data), artifact_path)
+
+def process_array(image, label: str = None, artifact_path: str = None):
+    """
+    Processes an already decoded BGR image (e.g. a video frame or an array in
+    shared memory). Same result as process_image.
+
+    Args:
+        image (np.ndarray): The BGR image (H x W x 3, uint8). It is not modified.
+        label (str): Name of the image in logs and profiles.
+        artifact_path (str): Debug artifacts are written next to this path (none without it).
+    """
+    if image is None:
+        log.error("No image provided.")
+        return
+
+    return _profiled_scan(label or artifact_path or "<array>", lambda: array_detection_frame(image),
+                          lambda: image, artifact_path)
+
+def _profiled_scan(label: str, read_frames, read_full, artifact_path: str = None):
+    with profiling.scan(label) as profile:
+        result = _process_image(label, read_frames, read_full, artifact_path)
+
+    if isinstance(result, dict) and 'error' not in result:
+        result['timings'] = dict(profile.timings)
+        result['memory'] = dict(profile.memory)
+        if profile.memory_metric is not None:
+            result['memory_metric'] = profile.memory_metric
+    return result
+
+def _process_image(label: str, read_frames, read_full, artifact_path: str = None):
+    """
+    Args:
+        label (str): Name of the image in logs.
+        read_frames: Returns (detection_frame, full_frame), see read_detection_frame.
+        read_full: Returns the full-resolution frame when read_frames didn't.
+        artifact_path (str): Image path the debug artifacts are written next to.
+    """
     final_ocr_result = "N/A" # Default result if processing fails
+    timings = {}
 
     try:
-        # --- Step 1: Perform YOLO detection ---
-        detections, image, model = detect_objects(image_path)
+        # --- Step 1: Perform YOLO detection (possibly on a downscaled frame) ---
+        with profiling.stage('decode', timings):
+            detection_frame, image = read_frames()
 
-        if image is None:
-            log.error("Failed to load image. Aborting processing.")
-            return # Exit if image loading failed in detect_objects
+        if detection_frame is None:
+            log.error(f"Could not read image file for detection: {label}. Aborting processing.")
+            return # Exit if image loading failed
+
+        # Re-uploads of an image already scanned with the same models/presets skip inference
+        result_cache = get_result_cache()
+        cache_probe = None
+        if result_cache is not None:
+            with profiling.stage('cache_lookup', timings):
+                cache_probe = result_cache.probe(detection_frame)
+                cached_result = result_cache.get(cache_probe)
+            if cached_result is not None:
+                log.info(f"Result cache hit ({cached_result['cache']['layer']}) for {label}")
+                return cached_result
+
+        with profiling.stage('detection', timings):
+            detections, _, model = detect_objects_by_image(detection_frame)
 
         if detections is None:
             log.error("Detection failed. Aborting processing.")
             return # Exit if detection itself failed critically
 
         if not detections:
-            log.warning(f"No objects ('CAP', 'BOX', 'SOYJOY') detected in image: {image_path}")
+            log.warning(f"No objects ('CAP', 'BOX', 'SOYJOY') detected in image: {label}")
             # Decide how to handle no detections: return, log, etc.
             final_ocr_result = "No objects detected"
 
         else:
-            # --- Step 2: Find the detection with the largest area ---
-            largest_detection = None
-            max_area = -1
-
-            # Ensure valid categories are uppercase
-            valid_categories = {"CAP", "BOX", "SOYJOY"}
-            for det in detections:
-                boxes = det.boxes   
-                for box in boxes:
-                    
-                    # Get the class name and convert to uppercase
-                    class_id = int(box.cls[0].item())
-                    class_name = model.names[class_id].upper()
-                    
-                    # Skip if not a valid category
-                    if class_name not in valid_categories:
-                        continue
-                    
-                    # Get bounding box coordinates
-                    x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
-                    
-                    # Calculate area
-                    area = (x2 - x1) * (y2 - y1)
-                    
-                    # Update if this is the largest area so far
-                    if area > max_area:
-                        max_area = area
-                        largest_detection = {
-                            'category': class_name,
-                            'box': [x1, y1, x2, y2],
-                            'confidence': float(box.conf[0].item())
-                        }
-            
-            # --- Step 3: Crop the image to the largest detection ---
-            if largest_detection:
-                x1, y1, x2, y2 = largest_detection['box']
-                # Add a small margin (e.g., 5 pixels) around the detection
-                margin = 5
-                x1 = max(0, x1 - margin)
-                y1 = max(0, y1 - margin)
-                x2 = min(image.shape[1], x2 + margin)
-                y2 = min(image.shape[0], y2 + margin)
-                
-                cropped_image = image[y1:y2, x1:x2]
-                
-                # Create a folder for the image results
-                base_name = os.path.splitext(os.path.basename(image_path))[0]
-                output_dir = os.path.join(os.path.dirname(image_path), base_name)
-                os.makedirs(output_dir, exist_ok=True)
-                
-                # Save the original image with detection box
-                image_with_box = image.copy()
-                cv2.rectangle(image_with_box, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                cv2.putText(image_with_box, largest_detection['category'], 
-                           (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-                cv2.imwrite(os.path.join(output_dir, "00_detection.jpg"), image_with_box)
-                
-                # --- Step 4: Run the OCR pipeline on the cropped image ---
+            # --- Step 2: Find the detection(s) with the largest area ---
+            selected = select_for_ocr(detections[0], model)
+
+            # --- Step 3: Crop the full-resolution image to the largest detection ---
+            if selected:
+                if image is None:
+                    # Only decode the full-resolution frame once we know there is something to crop
+                    with profiling.stage('decode', timings):
+                        image = read_full()
+                    if image is None:
+                        log.error(f"Could not read image file: {label}. Aborting processing.")
+                        return
+                with profiling.stage('crop', timings):
+                    selected = [map_detection_to_source(d, detection_frame.shape, image.shape) for d in selected]
+                    largest_detection = selected[0]
+                    artifacts = ArtifactSession(artifact_path)
+
+                # --- Step 4: Crop, reject unreadable crops and turn the crop upright ---
+                cropped_image, angle, rejection = prepare_crop(image, largest_detection, artifacts, timings)
+                if rejection is not None:
+                    return attach_detection(rejection, largest_detection, timings['detection'])
+
+                # --- Step 5: Run the OCR pipeline on the cropped image ---
                 category = largest_detection['category']
-                final_ocr_result = run_ocr_pipeline(cropped_image, category, image_path)
-                
+                final_ocr_result = run_ocr_pipeline(cropped_image, category, artifacts=artifacts)
+                finish_crop(label, final_ocr_result, cropped_image, angle, artifacts)
+
                 # Add detection info to the result
-                final_ocr_result['detection'] = {
-                    'box': largest_detection['box'],
-                    'confidence': largest_detection['confidence']
-                }
+                attach_detection(final_ocr_result, largest_detection, timings['detection'])
+
+                # --- Step 6: The further objects go through the same stages ---
+                if len(selected) > 1:
+                    final_ocr_result['objects'] = process_additional_objects(image, selected[1:], label)
+
+                if cache_probe is not None and is_cacheable(final_ocr_result):
+                    result_cache.put(cache_probe, final_ocr_result)
+                    final_ocr_result['cache'] = {'hit': False}
             else:
                 log.warning("No valid detections found.")
                 final_ocr_result = "No valid detections"
 
         return final_ocr_result
-        
+
     except Exception as e:
-        log.error(f"Error processing image {image_path}: {e}", exc_info=True)
-        return {"error": str(e)}
\ No newline at end of file
+        log.error(f"Error processing image {label}: {e}", exc_info=True)
+        return {"error": str(e)}
@@ -0,0 +1,100 @@
+# core/quality.py
+import cv2
+import numpy as np
+from utils.logger import log
+import config
+
+# --- Crop Quality Gate ---
+# A crop that is too small, badly exposed or blurred can't be read however
+# long preprocessing and OCR work on it. With config.QUALITY_GATE_ENABLED the
+# crop is measured right after cropping (a few milliseconds on a small
+# grayscale copy) and rejected with a "retake: ..." status that tells the
+# operator what to change, instead of failing validation after the full pipeline.
+#
+# Sharpness is the variance of the Laplacian after scaling the crop to
+# QUALITY_ANALYSIS_HEIGHT, so the threshold doesn't depend on camera resolution.
+# Exposure is the share of clipped pixels at either end of the histogram.
+
+# Checks in order (the first failing one is reported): reason -> (status, operator hint)
+RETAKE_REASONS = {
+    "too_small": ("retake: too small", "move the camera closer to the print"),
+    "overexposed": ("retake: over-exposed", "avoid glare or reduce the light"),
+    "underexposed": ("retake: under-exposed", "add light"),
+    "blurry": ("retake: blurry", "hold the camera still and refocus"),
+}
+# Grey levels counted as clipped highlights / crushed shadows
+HIGHLIGHT_LEVEL = 250
+SHADOW_LEVEL = 10
+
+
+def measure_crop(image: np.ndarray) -> dict:
+    """
+    Returns the quality metrics of a crop: 'width', 'height' (pixels),
+    'sharpness' (Laplacian variance at QUALITY_ANALYSIS_HEIGHT), 'overexposed'
+    and 'underexposed' (share of clipped pixels).
+    """
+    height, width = image.shape[:2]
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    target_height = config.QUALITY_ANALYSIS_HEIGHT
+    scale = target_height / float(max(1, height))
+    gray = cv2.resize(gray, (max(1, round(width * scale)), target_height),
+                      interpolation=cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR)
+
+    histogram = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    total = float(histogram.sum())
+    return {
+        'width': int(width),
+        'height': int(height),
+        'sharpness': round(float(cv2.Laplacian(gray, cv2.CV_32F).var()), 1),
+        'overexposed': round(float(histogram[HIGHLIGHT_LEVEL:].sum() / total), 3),
+        'underexposed': round(float(histogram[:SHADOW_LEVEL + 1].sum() / total), 3),
+    }
+
+
+def _failed_check(metrics: dict, thresholds: dict):
+    """Returns (reason, detail) of the first failing check, or None."""
+    # Compare long and short sides: a sideways crop is turned upright later (core/orientation.py)
+    long_side, short_side = max(metrics['width'], metrics['height']), min(metrics['width'], metrics['height'])
+    if long_side < thresholds['min_width'] or short_side < thresholds['min_height']:
+        return "too_small", (f"{metrics['width']}x{metrics['height']} px < "
+                             f"{thresholds['min_width']}x{thresholds['min_height']} px")
+    if metrics['overexposed'] > thresholds['max_overexposed']:
+        return "overexposed", f"{metrics['overexposed']:.0%} clipped highlights"
+    if metrics['underexposed'] > thresholds['max_underexposed']:
+        return "underexposed", f"{metrics['underexposed']:.0%} crushed shadows"
+    if metrics['sharpness'] < thresholds['min_sharpness']:
+        return "blurry", f"sharpness {metrics['sharpness']:.0f} < {thresholds['min_sharpness']:g}"
+    return None
+
+
+def check_crop_quality(image: np.ndarray, category: str):
+    """
+    Checks a crop against the thresholds of its category (config.QUALITY_THRESHOLDS).
+
+    Returns:
+        dict: None if the crop is fine (or the gate is off / has no thresholds for
+              the category), otherwise a pipeline result with a 'retake: ...'
+              status, an operator hint in 'message' and the metrics under 'quality'.
+    """
+    if not config.QUALITY_GATE_ENABLED:
+        return None
+    thresholds = config.QUALITY_THRESHOLDS.get(category)
+    if not thresholds:
+        return None
+
+    metrics = measure_crop(image)
+    failed = _failed_check(metrics, thresholds)
+    if failed is None:
+        return None
+
+    reason, detail = failed
+    status, hint = RETAKE_REASONS[reason]
+    log.info(f"Rejected {category} crop before OCR: {status} ({detail})")
+    return {
+        'category': category,
+        'status': status,
+        'message': f"{status} ({detail}), {hint}",
+        'formatted_top': '',
+        'formatted_bottom': '',
+        'quality': {'reason': reason, **metrics},
+    }
@@ -0,0 +1,111 @@
+# core/result_schema.py
+import json
+import numpy as np
+
+# --- Versioned Result Schema ---
+# Bump SCHEMA_VERSION whenever a field is renamed, removed or changes meaning.
+# Adding new optional fields does not require a bump.
+SCHEMA_VERSION = 1
+
+# Shape of a version 1 payload:
+# {
+#   "schema_version": 1,
+#   "image_path": str | null,
+#   "status": "success" | "error",
+#   "message": str,
+#   "category": "CAP" | "BOX" | "SOYJOY" | null,
+#   "formatted_top": str,
+#   "formatted_bottom": str,
+#   "detection": {"box": [x1, y1, x2, y2], "confidence": float} | null,
+#   "tokens": [{"text": str, "box": [x1, y1, x2, y2], "confidence": float}, ...],
+#             (tokens read with BAND_OCR_ENABLED also carry "line": "top" | "bottom")
+#   "timings": {"<stage>": seconds, ...},
+#   "memory": {"<stage>": megabytes, ...}   (optional: see utils/profiling.py)
+#   "memory_metric": "rss_delta" | "traced_peak"  (optional: what "memory" holds, the change in
+#                                             resident memory or the tracemalloc peak per stage)
+#   "cache": {"hit": bool, "layer": str}    (optional: when the result cache is enabled; on a
+#                                             "near_duplicate" hit "detection" is null and the
+#                                             similar frame's box is under "matched_detection")
+#   "tier": "fast" | "full"                  (optional: cascade tier that produced the result)
+#   "orientation": 90 | 180 | 270            (optional: clockwise rotation applied to the crop)
+#   "quality": {"reason": str, ...metrics}   (optional: crop rejected by the quality gate, the
+#                                             message then starts with "retake: ...")
+#   "objects": [...]   (optional: further objects when DETECTION_TOP_K > 1, each with
+#                       "category", "status", "message", "formatted_top", "formatted_bottom",
+#                       "detection" and, when set, "orientation" / "quality")
+# }
+
+
+def _json_default(obj):
+    """Converts NumPy scalars/arrays (EasyOCR and YOLO outputs) to plain Python types."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> str:
+    """Serializes a payload or protocol message to a single JSON line (without the newline)."""
+    return json.dumps(obj, default=_json_default, ensure_ascii=False)
+
+
+def build_result_payload(result, image_path: str = None) -> dict:
+    """
+    Normalises whatever process_image returned into the versioned result schema.
+
+    Args:
+        result: The value returned by core.processing.process_image. This is a dict
+                on success, but may also be None, a plain status string or {'error': ...}.
+        image_path (str): The processed image path, echoed back for correlation.
+
+    Returns:
+        dict: A payload following the SCHEMA_VERSION layout.
+    """
+    payload = {
+        'schema_version': SCHEMA_VERSION,
+        'image_path': image_path,
+        'status': 'error',
+        'message': '',
+        'category': None,
+        'formatted_top': '',
+        'formatted_bottom': '',
+        'detection': None,
+        'tokens': [],
+        'timings': {},
+    }
+
+    if result is None:
+        payload['message'] = 'Processing failed'
+        return payload
+
+    if isinstance(result, str):
+        payload['message'] = result
+        return payload
+
+    if 'error' in result and 'status' not in result:
+        payload['message'] = f"Error: {result['error']}"
+        return payload
+
+    status = result.get('status', 'error')
+    # Pipeline errors are reported as 'Error: ...' in the status field itself
+    if status not in ('success', 'error'):
+        payload['message'] = status
+        status = 'error'
+
+    payload.update({
+        'status': status,
+        'message': result.get('message', payload['message']),
+        'category': result.get('category'),
+        'formatted_top': result.get('formatted_top', ''),
+        'formatted_bottom': result.get('formatted_bottom', ''),
+        'detection': result.get('detection'),
+        'tokens': result.get('tokens', []),
+        'timings': result.get('timings', {}),
+    })
+    for optional in ('memory', 'memory_metric', 'cache', 'tier', 'orientation', 'quality'):
+        if optional in result:
+            payload[optional] = result[optional]
+    if 'objects' in result:
+        payload['objects'] = result['objects']
+    return payload
@@ -0,0 +1,213 @@
+# core/server.py
+import base64
+import binascii
+import json
+import os
+import sys
+import threading
+import time
+from core.models import registry
+from core.processing import process_image, process_image_bytes
+from core.result_schema import build_result_payload, dumps
+from utils.logger import log
+from utils import profiling
+import config
+
+# --- Line Protocol ---
+# The server reads one JSON object per line on stdin and answers with one JSON
+# object per line on stdout. Requests:
+#   {"id": "<any>", "image_path": "/abs/path.jpg"}   -> process an image file
+#   {"id": "<any>", "image_base64": "<jpeg/png>",
+#    "image_path": "/abs/path.jpg"}                   -> process an image sent inline;
+#                                                        the optional image_path is where
+#                                                        the caller stores it (artifacts
+#                                                        go next to it, it is not read)
+#   {"id": "<any>", "cmd": "ping"}                    -> health check
+#   {"id": "<any>", "cmd": "metrics"}                 -> per-stage latency histograms
+#   {"id": "<any>", "cmd": "shutdown"}                -> stop the loop
+# Responses always echo the request id:
+#   {"id": ..., "ok": true, "result": {...}, "duration": 0.123}
+#   {"id": ..., "ok": false, "error": "..."}
+# where "result" follows the versioned layout in core/result_schema.py.
+# A single {"event": "ready", "models": {...}} line is written once the models
+# in config.PRELOAD_MODELS are loaded; "models" holds their load time and memory.
+# With threads > 1 several images are processed at once (core/pipeline.py) and
+# responses are written as the scans finish, so they may arrive out of order.
+
+
+def read_image_payload(request: dict):
+    """
+    Returns the (image_path, image_data) of a process request. image_data is the
+    decoded 'image_base64' field, or None when the image is to be read from image_path.
+
+    Raises:
+        ValueError: If the request carries no image or an invalid base64 payload.
+    """
+    image_path = request.get('image_path')
+    encoded = request.get('image_base64')
+    if encoded is None:
+        if not image_path:
+            raise ValueError("Missing 'image_path' or 'image_base64'")
+        return image_path, None
+    try:
+        data = base64.b64decode(encoded, validate=True)
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid 'image_base64': {e}")
+    if not data:
+        raise ValueError("Empty 'image_base64'")
+    return image_path, data
+
+
+def handle_request(request: dict, models=None) -> dict:
+    """
+    Handles a single decoded protocol request.
+
+    Args:
+        request (dict): The decoded request object.
+        models: Model registry reported by 'metrics' (defaults to the one in core/models.py).
+
+    Returns:
+        dict: The response object to send back to the client.
+    """
+    request_id = request.get('id')
+    command = request.get('cmd', 'process')
+
+    if command == 'ping':
+        return {'id': request_id, 'ok': True, 'pong': True}
+
+    if command == 'metrics':
+        return {
+            'id': request_id,
+            'ok': True,
+            'metrics': profiling.metrics_json(),
+            'prometheus': profiling.metrics_prometheus(),
+            'models': (models or registry).stats(),
+        }
+
+    if command != 'process':
+        return {'id': request_id, 'ok': False, 'error': f"Unknown command: {command}"}
+
+    try:
+        image_path, image_data = read_image_payload(request)
+    except ValueError as e:
+        return {'id': request_id, 'ok': False, 'error': str(e)}
+    image_name = image_path or "inline image"
+
+    start_time = time.perf_counter()
+    try:
+        if image_data is not None:
+            result = process_image_bytes(image_data, artifact_path=image_path)
+        else:
+            result = process_image(image_path)
+    except Exception as e:
+        log.error(f"Failed to process image {image_name}: {e}", exc_info=True)
+        return {'id': request_id, 'ok': False, 'error': str(e)}
+
+    duration = time.perf_counter() - start_time
+    log.info(f"Processed {image_name} in {duration:.3f} seconds")
+    payload = build_result_payload(result, image_path)
+    payload['timings']['total'] = duration
+    return {'id': request_id, 'ok': True, 'result': payload, 'duration': duration}
+
+
+def claim_stdout():
+    """
+    Reserves the real stdout for protocol messages.
+
+    Anything else that writes to file descriptor 1 (our logger, ultralytics'
+    progress output, stray prints from native code) is redirected to stderr so
+    it can never corrupt the protocol stream.
+    """
+    sys.stdout.flush()
+    protocol_fd = os.dup(sys.stdout.fileno())
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return os.fdopen(protocol_fd, 'w', encoding='utf-8', buffering=1)
+
+
+def _submit_request(pipeline, request: dict, send):
+    """Schedules a process request on the pipeline's pool; the response is sent when the scan finishes."""
+    request_id = request.get('id')
+    try:
+        image_path, image_data = read_image_payload(request)
+    except ValueError as e:
+        send({'id': request_id, 'ok': False, 'error': str(e)})
+        return
+    image_name = image_path or "inline image"
+
+    def respond(future):
+        try:
+            payload = future.result()
+        except Exception as e:
+            send({'id': request_id, 'ok': False, 'error': str(e)})
+            return
+        log.info(f"Processed {image_name} in {payload['timings']['total']:.3f} seconds")
+        send({'id': request_id, 'ok': True, 'result': payload, 'duration': payload['timings']['total']})
+
+    pipeline.submit(image_path, image_data).add_done_callback(respond)
+
+
+def serve(input_stream=None, output_stream=None, threads: int = 1):
+    """
+    Runs the long-lived worker loop. The models in config.PRELOAD_MODELS are
+    loaded before the ready event, so requests only pay for inference.
+
+    Args:
+        input_stream: Stream to read requests from (defaults to stdin).
+        output_stream: Stream to write responses to (defaults to the real stdout).
+        threads (int): Images processed at the same time (1 = one request after the other).
+    """
+    if input_stream is None:
+        input_stream = sys.stdin
+    if output_stream is None:
+        output_stream = claim_stdout()
+
+    send_lock = threading.Lock()
+
+    def send(message):
+        line = dumps(message) + "\n"
+        # Responses of concurrent scans are written from the pool threads
+        with send_lock:
+            output_stream.write(line)
+            output_stream.flush()
+
+    pipeline = None
+    if threads > 1:
+        from core.pipeline import Pipeline
+        pipeline = Pipeline(threads)
+        model_stats = pipeline.preload(config.PRELOAD_MODELS)
+    else:
+        model_stats = registry.preload(config.PRELOAD_MODELS)
+    log.info(f"OCR worker ready ({threads} thread(s)), waiting for requests on stdin.")
+    send({'event': 'ready', 'pid': os.getpid(), 'models': model_stats})
+
+    shutdown_request = None
+    for line in input_stream:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            send({'id': None, 'ok': False, 'error': f"Invalid JSON request: {e}"})
+            continue
+
+        if not isinstance(request, dict):
+            send({'id': None, 'ok': False, 'error': "Request must be a JSON object"})
+            continue
+
+        if request.get('cmd') == 'shutdown':
+            shutdown_request = request
+            break
+
+        if pipeline is not None and request.get('cmd', 'process') == 'process':
+            _submit_request(pipeline, request, send)
+        else:
+            send(handle_request(request, pipeline.models.registry if pipeline is not None else None))
+
+    # Let the scans still running answer before acknowledging the shutdown
+    if pipeline is not None:
+        pipeline.close()
+    if shutdown_request is not None:
+        send({'id': shutdown_request.get('id'), 'ok': True})
+    log.info("OCR worker shutting down.")
@@ -0,0 +1,57 @@
+# core/settings.py
+import contextvars
+import types
+from contextlib import contextmanager
+import config
+
+# --- Scoped Settings ---
+# The pipeline reads its settings as config.NAME throughout. A Pipeline
+# (core/pipeline.py) runs its scans under its own settings: inside
+# use_settings(overrides), config.NAME resolves to the override for the code
+# running in that context (thread) only, so Pipelines with different settings
+# can scan at the same time in one process. Outside any block, and for names
+# that aren't overridden, config.py's values apply as before.
+#
+# Process-wide resources are created once from the settings of their first
+# user and then shared: the result cache, the token store and the artifact
+# writer.
+
+# Overrides of the scan running in the current thread
+_active_settings = contextvars.ContextVar("active_settings", default=None)
+
+
+class _ScopedConfig(types.ModuleType):
+    """Module type of `config` that looks names up in the active overrides first."""
+
+    def __getattribute__(self, name):
+        overrides = _active_settings.get()
+        if overrides is not None and name in overrides:
+            return overrides[name]
+        return super().__getattribute__(name)
+
+
+config.__class__ = _ScopedConfig
+
+
+def check_settings(settings: dict) -> dict:
+    """
+    Returns a copy of `settings` after checking that every name is a config.py setting.
+
+    Raises:
+        ValueError: For names config.py doesn't define.
+    """
+    unknown = [name for name in settings if not hasattr(config, name)]
+    if unknown:
+        raise ValueError(f"Unknown settings {unknown}, expected config.py names")
+    return dict(settings)
+
+
+@contextmanager
+def use_settings(settings: dict):
+    """Makes config.NAME resolve to settings[NAME] inside the block (on top of any outer overrides)."""
+    outer = _active_settings.get()
+    token = _active_settings.set({**outer, **settings} if outer else settings)
+    try:
+        yield settings
+    finally:
+        _active_settings.reset(token)
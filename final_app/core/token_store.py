@@ -0,0 +1,290 @@
+# core/token_store.py
+import csv
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from core.ocr import split_text_top_bottom
+from core.postprocessing import apply_post_processing
+from utils.logger import log
+import config
+
+# --- Token Store ---
+# With config.TOKEN_STORE_ENABLED the raw OCR tokens of every scan are kept in
+# a SQLite sidecar (TOKEN_STORE_PATH), one row per scan. Post-processing rule
+# changes can then be replayed over the whole history (main.py --replay)
+# without running a model: replay only re-runs split_text_top_bottom and
+# apply_post_processing on the stored tokens.
+#
+# The tokens of a scan are stored column-wise to keep rows small and cheap to
+# decode in bulk:
+#   texts        the token texts joined by TEXT_SEPARATOR
+#   boxes        float32 [x1, y1, x2, y2] per token (crop coordinates)
+#   confidences  float32 per token
+#   height       height of the crop the boxes refer to (split at a third of it)
+#   lines        one LINE_CODES character per token when the tokens were read
+#                line by line (BAND_OCR_ENABLED), empty otherwise
+# next to the category, the result the scan produced and the pipeline
+# fingerprint (models, presets and config, see core/cache.py) it ran under.
+
+# Joins the token texts of a scan (never produced by the OCR models)
+TEXT_SEPARATOR = "\x1f"
+# Stored code of each token 'line' label
+LINE_CODES = {"top": "t", "bottom": "b"}
+LINE_LABELS = {code: line for line, code in LINE_CODES.items()}
+# Rows read and replayed per chunk
+REPLAY_CHUNK_SIZE = 10000
+
+REPLAY_CSV_COLUMNS = [
+    "id", "image", "category", "old_status", "new_status",
+    "old_formatted_top", "new_formatted_top", "old_formatted_bottom", "new_formatted_bottom",
+]
+
+
+def encode_tokens(tokens: list):
+    """Packs a list of {'text', 'box', 'confidence'[, 'line']} tokens into the (texts, boxes, confidences, lines) columns."""
+    texts = TEXT_SEPARATOR.join(str(token['text']) for token in tokens)
+    boxes = np.asarray([token['box'] for token in tokens], dtype=np.float32).reshape(-1, 4)
+    confidences = np.asarray([token['confidence'] for token in tokens], dtype=np.float32).reshape(-1)
+    lines = ''
+    if tokens and all(token.get('line') in LINE_CODES for token in tokens):
+        lines = ''.join(LINE_CODES[token['line']] for token in tokens)
+    return texts, boxes.tobytes(), confidences.tobytes(), lines
+
+
+def decode_tokens(texts: str, boxes: bytes, confidences: bytes, lines: str = '') -> list:
+    """Unpacks the stored columns into the token dicts split_text_top_bottom expects."""
+    box_array = np.frombuffer(boxes, dtype=np.float32).reshape(-1, 4)
+    if len(box_array) == 0:
+        return []
+    confidence_array = np.frombuffer(confidences, dtype=np.float32)
+    tokens = [{'text': text, 'box': box, 'confidence': confidence}
+              for text, box, confidence in zip(texts.split(TEXT_SEPARATOR), box_array.tolist(),
+                                               confidence_array.tolist())]
+    if lines:
+        for token, code in zip(tokens, lines):
+            token['line'] = LINE_LABELS[code]
+    return tokens
+
+
+def replay_tokens(category: str, tokens: list, height: float) -> dict:
+    """Re-runs the text split and the category post-processing rules on stored tokens."""
+    split_texts = split_text_top_bottom(tokens, height)
+    return apply_post_processing(category, split_texts)
+
+
+class TokenStore:
+    """Append-only SQLite table of the raw OCR tokens per scan."""
+
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, timeout=5.0, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS scans ("
+            " id INTEGER PRIMARY KEY, image TEXT, category TEXT NOT NULL, height REAL NOT NULL,"
+            " texts TEXT NOT NULL, boxes BLOB NOT NULL, confidences BLOB NOT NULL,"
+            " status TEXT, formatted_top TEXT, formatted_bottom TEXT,"
+            " fingerprint TEXT, created_at REAL NOT NULL, lines TEXT NOT NULL DEFAULT '')")
+        # Stores created before tokens had line labels
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(scans)")]
+        if "lines" not in columns:
+            self._db.execute("ALTER TABLE scans ADD COLUMN lines TEXT NOT NULL DEFAULT ''")
+        self._db.execute("CREATE INDEX IF NOT EXISTS scans_category ON scans(category)")
+        self._db.commit()
+
+    def record(self, image: str, result: dict, height: float, fingerprint: str = None):
+        """
+        Stores the tokens of one OCR pipeline result.
+
+        Args:
+            image (str): Path or label of the scanned image.
+            result (dict): The run_ocr_pipeline result ('category', 'tokens', ...).
+            height (float): Height of the crop the token boxes refer to.
+            fingerprint (str): Pipeline fingerprint the scan ran under.
+        """
+        texts, boxes, confidences, lines = encode_tokens(result.get('tokens', []))
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO scans (image, category, height, texts, boxes, confidences, lines,"
+                " status, formatted_top, formatted_bottom, fingerprint, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (image, result['category'], float(height), texts, boxes, confidences, lines,
+                 result.get('status'), result.get('formatted_top', ''), result.get('formatted_bottom', ''),
+                 fingerprint, time.time()))
+            self._db.commit()
+
+    def count(self, category: str = None) -> int:
+        query, params = _filter_clause(category)
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM scans{query}", params).fetchone()[0]
+
+
+def _filter_clause(category: str = None, first_id: int = None, last_id: int = None):
+    """WHERE clause (with its parameters) selecting scans by category and id range."""
+    conditions, params = [], []
+    if category:
+        conditions.append("category = ?")
+        params.append(category.upper())
+    if first_id is not None:
+        conditions.append("id >= ?")
+        params.append(first_id)
+    if last_id is not None:
+        conditions.append("id <= ?")
+        params.append(last_id)
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+
+def is_recordable(result) -> bool:
+    """Only results that went through the OCR pipeline carry tokens worth keeping."""
+    return isinstance(result, dict) and 'tokens' in result and bool(result.get('category'))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_token_store():
+    """Returns the process-wide token store, or None when TOKEN_STORE_ENABLED is off."""
+    global _store
+    if not config.TOKEN_STORE_ENABLED:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TokenStore(config.TOKEN_STORE_PATH)
+    return _store
+
+
+def record_tokens(image: str, result, height: float):
+    """Stores the tokens of a scan if the token store is enabled. Never raises into the scan."""
+    store = get_token_store()
+    if store is None or not is_recordable(result):
+        return
+    # Imported here: core.cache pulls in the model registry
+    from core.cache import pipeline_fingerprint
+    try:
+        store.record(image, result, height, pipeline_fingerprint())
+    except sqlite3.Error as e:
+        log.error(f"Could not store the OCR tokens of {image}: {e}")
+
+
+# --- Replay ---
+def _replay_range(db_path: str, category: str, first_id: int, last_id: int) -> list:
+    """Replays the scans with ids in [first_id, last_id]. Returns one row per scan (see REPLAY_CSV_COLUMNS)."""
+    db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=5.0)
+    try:
+        query, params = _filter_clause(category, first_id, last_id)
+        cursor = db.execute(
+            "SELECT id, image, category, height, texts, boxes, confidences, lines,"
+            f" status, formatted_top, formatted_bottom FROM scans{query} ORDER BY id", params)
+        rows = []
+        for (scan_id, image, scan_category, height, texts, boxes, confidences, lines,
+             status, formatted_top, formatted_bottom) in cursor:
+            replayed = replay_tokens(scan_category, decode_tokens(texts, boxes, confidences, lines), height)
+            rows.append({
+                "id": scan_id,
+                "image": image,
+                "category": scan_category,
+                "old_status": status,
+                "new_status": replayed.get('status'),
+                "old_formatted_top": formatted_top,
+                "new_formatted_top": replayed.get('formatted_top', ''),
+                "old_formatted_bottom": formatted_bottom,
+                "new_formatted_bottom": replayed.get('formatted_bottom', ''),
+            })
+        return rows
+    finally:
+        db.close()
+
+
+def _replay_range_star(args) -> list:
+    return _replay_range(*args)
+
+
+def _init_replay_worker(log_disabled: bool):
+    # Spawned workers don't run main(), so mirror the parent's logging switch
+    log.disabled = log_disabled
+
+
+def _is_changed(row: dict) -> bool:
+    return (row['old_status'], row['old_formatted_top'], row['old_formatted_bottom']) != \
+           (row['new_status'], row['new_formatted_top'], row['new_formatted_bottom'])
+
+
+def replay(db_path: str = None, output_path: str = None, category: str = None, workers: int = 1,
+           changed_only: bool = True, chunk_size: int = REPLAY_CHUNK_SIZE) -> dict:
+    """
+    Re-runs the split and post-processing rules over every stored scan and
+    compares the outcome with what the scan originally produced.
+
+    Args:
+        db_path (str): The token store (defaults to config.TOKEN_STORE_PATH).
+        output_path (str): Optional CSV with one row per replayed scan.
+        category (str): Only replay scans of this category.
+        workers (int): Processes replaying chunks of REPLAY_CHUNK_SIZE scans in parallel.
+        changed_only (bool): Only write the scans whose result changed.
+        chunk_size (int): Scans per chunk.
+
+    Returns:
+        dict: Summary {'total', 'changed', 'old_success', 'new_success', 'duration', 'scans_per_second'}.
+    """
+    db_path = db_path or config.TOKEN_STORE_PATH
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"Token store not found: {db_path}")
+
+    start_time = time.perf_counter()
+    db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=5.0)
+    try:
+        query, params = _filter_clause(category)
+        first_id, last_id = db.execute(f"SELECT MIN(id), MAX(id) FROM scans{query}", params).fetchone()
+    finally:
+        db.close()
+
+    ranges = []
+    if first_id is not None:
+        ranges = [(db_path, category, start, min(start + chunk_size - 1, last_id))
+                  for start in range(first_id, last_id + 1, chunk_size)]
+
+    summary = {'total': 0, 'changed': 0, 'old_success': 0, 'new_success': 0}
+    output = open(output_path, 'w', encoding='utf-8', newline='') if output_path else None
+    pool = None
+    try:
+        writer = None
+        if output:
+            writer = csv.DictWriter(output, fieldnames=REPLAY_CSV_COLUMNS)
+            writer.writeheader()
+
+        if workers > 1 and len(ranges) > 1:
+            pool = multiprocessing.get_context("spawn").Pool(
+                min(workers, len(ranges)), initializer=_init_replay_worker, initargs=(log.disabled,))
+            chunks = pool.imap(_replay_range_star, ranges)
+        else:
+            chunks = (_replay_range_star(r) for r in ranges)
+
+        for rows in chunks:
+            for row in rows:
+                changed = _is_changed(row)
+                summary['total'] += 1
+                summary['changed'] += changed
+                summary['old_success'] += row['old_status'] == 'success'
+                summary['new_success'] += row['new_status'] == 'success'
+                if writer and (changed or not changed_only):
+                    writer.writerow(row)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if output:
+            output.close()
+
+    summary['duration'] = time.perf_counter() - start_time
+    summary['scans_per_second'] = summary['total'] / summary['duration'] if summary['duration'] > 0 else 0.0
+    return summary
@@ -0,0 +1,262 @@
+# core/video.py
+import os
+import time
+import cv2
+import numpy as np
+from core.batch import IMAGE_EXTENSIONS
+from core.detection import array_detection_frame, detect_objects_by_image, map_detection_to_source
+from core.ocr import calculate_iou
+from core.ocr_pipeline import run_ocr_pipeline
+from core.orientation import orient_crop
+from core.processing import select_for_ocr, crop_detection
+from utils import profiling
+import config
+
+# --- Video Mode ---
+# Reads lot numbers off a camera pointed at the line instead of one photo per
+# product. Each frame goes through increasingly expensive stages and most stop early:
+#   stride        only every VIDEO_FRAME_STRIDE-th frame is looked at
+#   gate          sharpness (Laplacian variance) and motion (difference to the
+#                 previous frame) on a small grayscale thumbnail; blurred or
+#                 moving frames are skipped
+#   localization  the detector, on the frames that pass the gate
+#   OCR           only once the product box has held still for
+#                 VIDEO_STABLE_FRAMES localized frames, and at most
+#                 VIDEO_MAX_OCR_PER_TRACK times per product
+# The readings of one product (a "track": the same category at an overlapping
+# box, until it is gone for VIDEO_TRACK_GAP frames) are fused by
+# confidence-weighted voting, line by line, and reported once per product.
+
+
+def open_frames(source: str, stride: int = 1):
+    """
+    Yields (frame_index, frame) of a video file, a camera (device index like
+    "0" or a V4L2 path like /dev/video0) or a directory of frame images
+    (sorted by name). Only every `stride`-th frame is decoded.
+    """
+    stride = max(1, stride)
+    if os.path.isdir(source):
+        names = sorted(name for name in os.listdir(source) if name.lower().endswith(IMAGE_EXTENSIONS))
+        for index in range(0, len(names), stride):
+            frame = cv2.imread(os.path.join(source, names[index]))
+            if frame is not None:
+                yield index, frame
+        return
+
+    capture = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not capture.isOpened():
+        raise IOError(f"Could not open video source: {source}")
+    try:
+        index = 0
+        while True:
+            # grab() skips the colour conversion of the frames we don't look at
+            if index % stride:
+                if not capture.grab():
+                    break
+            else:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield index, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+class FrameGate:
+    """Cheap per-frame check for a sharp, still frame, measured on a small grayscale thumbnail."""
+
+    def __init__(self, min_sharpness: float = None, max_motion: float = None, size: int = None):
+        self.min_sharpness = config.VIDEO_MIN_SHARPNESS if min_sharpness is None else min_sharpness
+        self.max_motion = config.VIDEO_MAX_MOTION if max_motion is None else max_motion
+        self.size = size or config.VIDEO_GATE_SIZE
+        self._previous = None
+
+    def measure(self, frame: np.ndarray):
+        """Returns (sharpness, motion) of the frame; motion is 0 for the first frame."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        scale = self.size / float(max(gray.shape[:2]))
+        if scale < 1.0:
+            gray = cv2.resize(gray, (max(1, round(gray.shape[1] * scale)), max(1, round(gray.shape[0] * scale))),
+                              interpolation=cv2.INTER_AREA)
+        sharpness = cv2.Laplacian(gray, cv2.CV_32F).var()
+        motion = 0.0
+        if self._previous is not None and self._previous.shape == gray.shape:
+            motion = float(cv2.absdiff(gray, self._previous).mean())
+        self._previous = gray
+        return float(sharpness), motion
+
+    def passes(self, frame: np.ndarray) -> bool:
+        sharpness, motion = self.measure(frame)
+        return sharpness >= self.min_sharpness and motion <= self.max_motion
+
+
+def _reading_weight(result: dict) -> float:
+    """Vote weight of one OCR reading: its mean token confidence."""
+    confidences = [token['confidence'] for token in result.get('tokens', [])]
+    return float(np.mean(confidences)) if confidences else 0.0
+
+
+def vote(readings: list) -> dict:
+    """
+    Fuses the OCR results of one product. Each line is voted on separately,
+    weighted by the reading's mean token confidence; only readings that passed
+    post-processing vote, unless none did.
+
+    Returns:
+        dict: 'status', 'message', 'formatted_top', 'formatted_bottom', 'votes'
+              (readings that voted) and 'agreement' (winning weight share, the
+              lower of the two lines).
+    """
+    valid = [r for r in readings if r.get('status') == 'success']
+    voters = valid or readings
+    fused = {'status': 'success' if valid else 'error', 'message': '', 'votes': len(voters)}
+    if not valid and voters:
+        # Pipeline errors only carry an 'Error: ...' status
+        fused['message'] = voters[-1].get('message') or voters[-1].get('status', '')
+    agreement = 1.0
+    for line in ('formatted_top', 'formatted_bottom'):
+        totals = {}
+        for reading in voters:
+            # A reading without any token confidence still counts, just barely
+            totals[reading.get(line, '')] = totals.get(reading.get(line, ''), 0.0) + max(_reading_weight(reading), 1e-3)
+        if totals:
+            winner = max(totals, key=totals.get)
+            fused[line] = winner
+            agreement = min(agreement, totals[winner] / sum(totals.values()))
+        else:
+            fused[line] = ''
+    fused['agreement'] = round(agreement, 3) if voters else 0.0
+    return fused
+
+
+class Track:
+    """One product passing through the frame: its box history and OCR readings."""
+
+    def __init__(self, frame_index: int, detection: dict):
+        self.first_frame = frame_index
+        self.last_frame = frame_index
+        self.category = detection['category']
+        self.detection = detection
+        self.stable_frames = 1
+        self.readings = []
+
+    def matches(self, detection: dict) -> bool:
+        """True if a detection is the same product (same category, overlapping box)."""
+        return (detection['category'] == self.category
+                and calculate_iou(detection['box'], self.detection['box']) >= config.VIDEO_SAME_OBJECT_IOU)
+
+    def update(self, frame_index: int, detection: dict):
+        if calculate_iou(detection['box'], self.detection['box']) >= config.VIDEO_STABLE_IOU:
+            self.stable_frames += 1
+        else:
+            self.stable_frames = 1
+        self.detection = detection
+        self.last_frame = frame_index
+
+    def wants_ocr(self) -> bool:
+        return (self.stable_frames >= config.VIDEO_STABLE_FRAMES
+                and len(self.readings) < config.VIDEO_MAX_OCR_PER_TRACK)
+
+    def summary(self) -> dict:
+        return {
+            'first_frame': self.first_frame,
+            'last_frame': self.last_frame,
+            'category': self.category,
+            **vote(self.readings),
+            'detection': {'box': self.detection['box'], 'confidence': self.detection['confidence']},
+        }
+
+
+class VideoScanner:
+    """Runs the gated localization/OCR stages over a stream of frames and fuses the readings per product."""
+
+    def __init__(self):
+        self.gate = FrameGate()
+        self.track = None
+        self.stats = {'frames': 0, 'gated': 0, 'localized': 0, 'ocr': 0, 'products': 0}
+
+    def _localize(self, frame: np.ndarray):
+        """Returns the largest detection in full-frame coordinates, or None."""
+        detection_frame, _ = array_detection_frame(frame)
+        detections, _, model = detect_objects_by_image(detection_frame)
+        if not detections:
+            return None
+        selected = select_for_ocr(detections[0], model)
+        if not selected:
+            return None
+        return map_detection_to_source(selected[0], detection_frame.shape, frame.shape)
+
+    def _finish_track(self):
+        """Ends the current track; returns its fused result if it was ever read."""
+        track, self.track = self.track, None
+        if track is None or not track.readings:
+            return None
+        self.stats['products'] += 1
+        return track.summary()
+
+    def feed(self, frame_index: int, frame: np.ndarray) -> list:
+        """
+        Processes one frame.
+
+        Returns:
+            list: The fused results of the products that ended with this frame.
+        """
+        self.stats['frames'] += 1
+        finished = []
+        if self.track is not None and frame_index - self.track.last_frame > config.VIDEO_TRACK_GAP:
+            finished.append(self._finish_track())
+
+        with profiling.stage('video.gate'):
+            passed = self.gate.passes(frame)
+        if not passed:
+            self.stats['gated'] += 1
+            return [r for r in finished if r]
+
+        with profiling.stage('video.localization'):
+            detection = self._localize(frame)
+        if detection is None:
+            return [r for r in finished if r]
+        # Only frames where the detector found a product count as localized
+        self.stats['localized'] += 1
+
+        if self.track is not None and self.track.matches(detection):
+            self.track.update(frame_index, detection)
+        else:
+            finished.append(self._finish_track())
+            self.track = Track(frame_index, detection)
+
+        if self.track.wants_ocr():
+            with profiling.stage('video.ocr'):
+                crop, _ = orient_crop(crop_detection(frame, detection), detection['category'])
+                reading = run_ocr_pipeline(crop, detection['category'])
+            self.stats['ocr'] += 1
+            self.track.readings.append(reading)
+
+        return [r for r in finished if r]
+
+    def finish(self) -> list:
+        """Ends the stream; returns the fused result of the product still in view, if any."""
+        result = self._finish_track()
+        return [result] if result else []
+
+
+def run_video(source: str, on_result, stride: int = None) -> dict:
+    """
+    Scans a video source and passes each product's fused result to `on_result`.
+
+    Returns:
+        dict: Counters {'frames', 'gated', 'localized', 'ocr', 'products', 'duration', 'frames_per_second'}.
+    """
+    start_time = time.perf_counter()
+    scanner = VideoScanner()
+    for frame_index, frame in open_frames(source, stride or config.VIDEO_FRAME_STRIDE):
+        for result in scanner.feed(frame_index, frame):
+            on_result(result)
+    for result in scanner.finish():
+        on_result(result)
+
+    stats = dict(scanner.stats)
+    stats['duration'] = time.perf_counter() - start_time
+    stats['frames_per_second'] = stats['frames'] / stats['duration'] if stats['duration'] > 0 else 0.0
+    return stats
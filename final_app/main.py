@@ -1,38 +1,213 @@
 import argparse
-from core.processing import process_image
+from core import artifacts
 from utils.logger import log
+from utils import profiling
 import config
 import time
 
+def write_profiling_output(metrics_file: str = None):
+    """Writes the stage histograms and any kept slow-scan traces of a long-running mode."""
+    if metrics_file:
+        profiling.write_metrics(metrics_file)
+    profiling.dump_slowest_profiles()
+
 def main():
-    """Main function to parse arguments and trigger processing for a single image."""
+    """Main function to parse arguments and trigger single image, batch or worker processing."""
     parser = argparse.ArgumentParser(description="OCR Lot No Application - Single Image Processing")
     parser.add_argument(
         "--image-path",
         type=str,
-        required=True,
         help="Path to the image file to be processed."
     )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print the result as a single line of JSON (see core/result_schema.py) instead of the human readable output."
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run as a long-lived worker: load the models once and process JSON requests read line by line from stdin."
+    )
+    parser.add_argument(
+        "--input-dir",
+        type=str,
+        help="Batch mode: process every image in this directory."
+    )
+    parser.add_argument(
+        "--glob",
+        type=str,
+        help="Batch mode: process every image matching this glob pattern (supports **)."
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        help="Batch mode: text file with one image path per line."
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=8,
+        help="Batch mode: number of images per model forward pass."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Batch/replay mode: number of worker processes (0 = one per CPU core). Each batch worker loads its own models."
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Serve/batch mode: images processed at the same time by a thread pool sharing one set of models."
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Batch mode: output file, CSV or .jsonl (one row per image, default batch_results.csv). "
+             "Video mode: JSON lines file (one line per product). "
+             "Replay mode: CSV of the scans whose result changed."
+    )
+    parser.add_argument(
+        "--video",
+        type=str,
+        metavar="SOURCE",
+        help="Video mode: read lot numbers from a video file, a camera (device index or /dev/videoN) or a "
+             "directory of frames, printing one JSON line per product (or writing them to --output)."
+    )
+    parser.add_argument(
+        "--replay",
+        nargs="?",
+        const=config.TOKEN_STORE_PATH,
+        metavar="TOKEN_STORE",
+        help="Re-run the text split and post-processing rules over the OCR tokens kept in the token store "
+             f"(default {config.TOKEN_STORE_PATH}, see TOKEN_STORE_ENABLED) and report what changed, without running any model."
+    )
+    parser.add_argument(
+        "--category",
+        type=str,
+        help="Replay mode: only replay scans of this category."
+    )
+    parser.add_argument(
+        "--export-models",
+        choices=["onnx", "openvino"],
+        help="Export both YOLO models for the given inference backend (see INFERENCE_BACKEND in config.py) and exit."
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        help="Serve/batch mode: on exit, write the per-stage latency histograms here (.prom for Prometheus text, JSON otherwise)."
+    )
 
     args = parser.parse_args()
+    batch_mode = bool(args.input_dir or args.glob or args.manifest)
+    if not (args.serve or batch_mode or args.image_path or args.export_models or args.replay or args.video):
+        parser.error("--image-path is required unless --serve, --video, --replay, --export-models or a batch input (--input-dir/--glob/--manifest) is given.")
+
     log.disabled = True
     log.info("Application started.")
     log.debug(f"Arguments received: {args}")
 
+    if args.export_models:
+        from core.models import export_yolo_models
+        for name, path in export_yolo_models(args.export_models).items():
+            print(f"Exported {name} -> {path}")
+        return
+
+    if args.video:
+        from core.result_schema import dumps
+        from core.server import claim_stdout
+        from core.video import run_video
+        output_stream = open(args.output, 'w', encoding='utf-8') if args.output else claim_stdout()
+        try:
+            def write_result(result):
+                output_stream.write(dumps(result) + "\n")
+                output_stream.flush()
+            stats = run_video(args.video, write_result)
+        finally:
+            if args.output:
+                output_stream.close()
+        log.info(f"Video finished: {stats}")
+        if args.output:
+            print(f"Read {stats['products']} products from {stats['frames']} frames in {stats['duration']:.1f} seconds "
+                  f"({stats['frames_per_second']:.1f} frames/s, {stats['localized']} localized, {stats['ocr']} OCRed) "
+                  f"-> {args.output}")
+        artifacts.flush()
+        write_profiling_output(args.metrics_file)
+        log.info("Application finished.")
+        return
+
+    if args.replay:
+        from core.token_store import replay
+        from core.parallel import resolve_worker_count
+        workers = resolve_worker_count(args.workers) if args.workers != 1 else 1
+        summary = replay(args.replay, args.output, args.category, workers)
+        print(f"Replayed {summary['total']} scans in {summary['duration']:.1f} seconds "
+              f"({summary['scans_per_second']:.0f} scans/s): {summary['changed']} changed, "
+              f"success {summary['old_success']} -> {summary['new_success']}"
+              + (f" -> {args.output}" if args.output else ""))
+        log.info("Application finished.")
+        return
+
+    if args.serve:
+        from core.server import serve
+        serve(threads=max(1, args.threads))
+        artifacts.flush()
+        write_profiling_output(args.metrics_file)
+        log.info("Application finished.")
+        return
+
+    if batch_mode:
+        from core.batch import collect_image_paths, run_batch
+        from core.parallel import resolve_worker_count
+        image_paths = collect_image_paths(args.input_dir, args.glob, args.manifest)
+        workers = resolve_worker_count(args.workers) if args.workers != 1 else 1
+        output_path = args.output or "batch_results.csv"
+        summary = run_batch(image_paths, output_path, max(1, args.batch_size), workers, max(1, args.threads))
+        print(f"Processed {summary['total']} images ({summary['success']} success, "
+              f"{summary['error']} error) in {summary['duration']:.1f} seconds "
+              f"({summary['images_per_second']:.2f} images/s) -> {output_path}")
+        artifacts.flush()
+        write_profiling_output(args.metrics_file)
+        log.info("Application finished.")
+        return
+
+    # Imported here so --help doesn't pay for importing the pipeline (models load on first use)
+    from core.processing import process_image
     image_path = args.image_path
     start_time = time.perf_counter()
 
+    if args.json:
+        from core.result_schema import build_result_payload, dumps
+        from core.server import claim_stdout
+        output_stream = claim_stdout()
+        try:
+            result = process_image(image_path)
+        except Exception as e:
+            log.error(f"Failed to process image {image_path}: {e}", exc_info=True)
+            result = {'error': str(e)}
+        payload = build_result_payload(result, image_path)
+        payload['timings']['total'] = time.perf_counter() - start_time
+        output_stream.write(dumps(payload) + "\n")
+        output_stream.flush()
+        artifacts.flush()
+        log.info("Application finished.")
+        return
+
     try:
         result = process_image(image_path)
         processing_duration = time.perf_counter() - start_time
         log.info(f"Processing completed in {processing_duration:.3f} seconds")
         print("Processing Result:", result)
-        
+
     except Exception as e:
         log.error(f"Failed to process image {image_path}: {e}", exc_info=True)
         print(f"Error processing image: {e}")
 
+    # Wait for the background artifact writer before the process exits
+    artifacts.flush()
     log.info("Application finished.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -16,7 +16,7 @@ from utils.logger import log # Optional: Use Streamlit's logging instead if pref
 # Import detection and processing helpers
 from utils.logger import log
 # --- MODIFIED IMPORTS ---
-from core.detection import detect_objects, detect_objects_by_image # Import detection
+from core.detection import detect_objects, detect_objects_by_image, select_detections # Import detection
 
 # --- END MODIFIED IMPORTS ---
 from core.preprocessing import apply_preprocessing_pipeline
@@ -136,22 +136,14 @@ if st.session_state.processing_triggered and st.session_state.image_cv is not No
 
             # --- Step 2: Find the detection with the largest area ---
             largest_detection = None
-            max_area = -1
-            valid_categories = {"CAP", "BOX", "SOYJOY"}
-
-            for det in detections:
-                boxes = det.boxes
-                for box in boxes:
-                    x1, y1, x2, y2 = box.xyxy[0].tolist()
-                    area = (x2 - x1) * (y2 - y1)
-                    name = model.names[int(box.cls)]
-                    if area > max_area and name.upper() in valid_categories:
-                        max_area = area
-                        largest_detection = {
-                            'class_name': name,
-                            'bbox': (x1, y1, x2, y2),
-                            'area': area
-                        }
+            selected = select_detections(detections[0], model.names) if detections else []
+            if selected:
+                x1, y1, x2, y2 = selected[0]['box']
+                largest_detection = {
+                    'class_name': selected[0]['category'],
+                    'bbox': (x1, y1, x2, y2),
+                    'area': (x2 - x1) * (y2 - y1)
+                }
 
             if largest_detection:
                 detected_category = largest_detection['class_name'].upper()
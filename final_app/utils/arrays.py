@@ -0,0 +1,7 @@
+import numpy as np
+
+def to_numpy(values) -> np.ndarray:
+    """Returns a NumPy array for a torch tensor (YOLO results) or any array-like."""
+    if hasattr(values, 'cpu'):
+        values = values.cpu().numpy()
+    return np.asarray(values)
@@ -0,0 +1,312 @@
+import contextvars
+import cProfile
+import heapq
+import io
+import itertools
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from utils.logger import log
+import config
+
+try:
+    import resource # Not available on Windows
+except ImportError:
+    resource = None
+
+# --- Stage Instrumentation ---
+# `stage(name)` times a block of the pipeline. Every measurement goes to:
+#   - an optional per-call `timings` dict (what ends up in the result payload),
+#   - the scan profile of the current request (set up by `scan()`), which also
+#     records the memory of each stage,
+#   - the process-wide histograms exported by `metrics_json()` /
+#     `metrics_prometheus()` in long-running modes.
+#
+# Stage memory is the change in resident set size (MB) across the stage, a
+# delta rather than a peak: memory allocated and freed inside the stage doesn't
+# show up. With config.PROFILE_TRACEMALLOC it is instead the peak of the
+# Python/NumPy allocations made inside the stage, nested stages included.
+# tracemalloc is started once per process and never stopped, but its peak
+# counter is process-wide: the peaks are only valid while a single scan runs.
+# Whenever scans overlap (threaded Pipeline, --threads > 1, threaded --serve)
+# stages fall back to the RSS delta, which then includes the allocations of
+# the other scans too. ScanProfile.memory_metric says which one a scan holds.
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_scan = contextvars.ContextVar("current_scan", default=None)
+
+# Scans currently open in this process (tracemalloc peaks need exactly one)
+_active_scans = 0
+_active_scans_lock = threading.Lock()
+
+
+def _peak_rss_mb():
+    """Peak resident set size of the process so far, in MB (None where unsupported)."""
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _resident_mb():
+    """Current resident set size of the process in MB (None where /proc is missing)."""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def current_rss_mb():
+    """Current resident set size of the process in MB (falls back to the peak where /proc is missing)."""
+    resident = _resident_mb()
+    return _peak_rss_mb() if resident is None else resident
+
+
+def _ensure_tracing():
+    """Starts tracemalloc once for the process when config.PROFILE_TRACEMALLOC is on; it is never stopped."""
+    if config.PROFILE_TRACEMALLOC and not tracemalloc.is_tracing():
+        with _active_scans_lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+
+# memory_metric values of a ScanProfile
+RSS_DELTA = "rss_delta"
+TRACED_PEAK = "traced_peak"
+
+
+class ScanProfile:
+    """Stage timings and memory of a single scan."""
+
+    def __init__(self):
+        self.timings = {}
+        self.memory = {}
+        # RSS_DELTA, or TRACED_PEAK while every stage of the scan was traced
+        self.memory_metric = None
+        self.total = None
+        # [traced bytes at entry, running peak] of the traced stages open in this scan
+        self._peaks = []
+
+    def record(self, name: str, seconds: float, memory_mb=None):
+        # Stages that run more than once in a scan (e.g. cascaded tiers) accumulate
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        if memory_mb is not None:
+            self.memory[name] = max(self.memory.get(name, 0.0), memory_mb)
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        index = len(LATENCY_BUCKETS)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def observe(name: str, seconds: float):
+    """Adds a latency observation for a stage to the process-wide histograms."""
+    with _histograms_lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = _Histogram()
+        histogram.observe(seconds)
+
+
+@contextmanager
+def stage(name: str, timings: dict = None):
+    """
+    Times the enclosed block as pipeline stage `name`.
+
+    Args:
+        name (str): Stage name, e.g. 'detection' or 'preprocessing.Grayscale'.
+        timings (dict): Optional dict that receives the elapsed seconds under `name`.
+    """
+    profile = _current_scan.get()
+    trace_memory = (profile is not None and config.PROFILE_TRACEMALLOC and tracemalloc.is_tracing()
+                    and _active_scans == 1)
+    rss_before = frame = None
+    if trace_memory:
+        # The peak counter is global: fold what the enclosing stage reached so
+        # far into its running peak before resetting the counter for this one
+        current, peak = tracemalloc.get_traced_memory()
+        if profile._peaks:
+            parent = profile._peaks[-1]
+            parent[1] = max(parent[1], peak)
+        tracemalloc.reset_peak()
+        frame = [current, current]
+        profile._peaks.append(frame)
+    elif profile is not None:
+        rss_before = _resident_mb()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+        if profile is not None:
+            memory_mb = None
+            if frame is not None:
+                # Peak Python/NumPy allocations inside this stage; the enclosing
+                # stage inherits it as part of its own peak
+                frame[1] = max(frame[1], tracemalloc.get_traced_memory()[1])
+                profile._peaks.pop()
+                if profile._peaks:
+                    parent = profile._peaks[-1]
+                    parent[1] = max(parent[1], frame[1])
+                memory_mb = (frame[1] - frame[0]) / (1024.0 * 1024.0)
+                if profile.memory_metric is None:
+                    profile.memory_metric = TRACED_PEAK
+            elif rss_before is not None:
+                rss_after = _resident_mb()
+                if rss_after is not None:
+                    memory_mb = rss_after - rss_before
+                    profile.memory_metric = RSS_DELTA
+            profile.record(name, elapsed, memory_mb)
+        observe(name, elapsed)
+
+
+# --- Slowest Request Profiles ---
+_slowest = [] # min-heap of (duration, sequence, label, profiler)
+_slowest_lock = threading.Lock()
+_sequence = itertools.count()
+
+
+def _keep_if_slow(duration: float, label: str, profiler: cProfile.Profile):
+    limit = config.PROFILE_SLOWEST_N
+    with _slowest_lock:
+        entry = (duration, next(_sequence), label, profiler)
+        if len(_slowest) < limit:
+            heapq.heappush(_slowest, entry)
+        elif duration > _slowest[0][0]:
+            heapq.heapreplace(_slowest, entry)
+
+
+@contextmanager
+def scan(label: str = None):
+    """
+    Opens the profile of one scan; stages timed inside it are attached to the
+    returned ScanProfile. When config.PROFILE_SLOWEST_N > 0 the scan also runs
+    under cProfile and the slowest N traces are kept for dump_slowest_profiles().
+    """
+    global _active_scans
+    _ensure_tracing()
+    profile = ScanProfile()
+    token = _current_scan.set(profile)
+    with _active_scans_lock:
+        _active_scans += 1
+
+    profiler = None
+    if config.PROFILE_SLOWEST_N > 0:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    start = time.perf_counter()
+    try:
+        yield profile
+    finally:
+        profile.total = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            _keep_if_slow(profile.total, label or "scan", profiler)
+        with _active_scans_lock:
+            _active_scans -= 1
+        _current_scan.reset(token)
+        observe("total", profile.total)
+
+
+def dump_slowest_profiles(output_dir: str = None) -> list:
+    """
+    Writes the kept cProfile traces (slowest first) as .prof files plus a
+    cumulative-time text summary each.
+
+    Returns:
+        list: The written .prof paths.
+    """
+    output_dir = output_dir or config.PROFILE_DIR
+    with _slowest_lock:
+        entries = sorted(_slowest, reverse=True)
+    if not entries:
+        return []
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for rank, (duration, _, label, profiler) in enumerate(entries, start=1):
+        base = os.path.join(output_dir, f"slowest_{rank:02d}_{duration:.3f}s")
+        profiler.dump_stats(base + ".prof")
+        summary = io.StringIO()
+        summary.write(f"{label}: {duration:.3f} s\n\n")
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(40)
+        with open(base + ".txt", 'w', encoding='utf-8') as f:
+            f.write(summary.getvalue())
+        paths.append(base + ".prof")
+    log.info(f"Wrote {len(paths)} slow-request profiles to {output_dir}")
+    return paths
+
+
+# --- Metrics Export ---
+def metrics_json() -> dict:
+    """Returns the stage histograms as a JSON-serialisable dict."""
+    with _histograms_lock:
+        return {
+            name: {
+                'count': h.count,
+                'sum': h.sum,
+                'mean': h.sum / h.count if h.count else 0.0,
+                'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'],
+                                    itertools.accumulate(h.counts))),
+            }
+            for name, h in sorted(_histograms.items())
+        }
+
+
+def metrics_prometheus() -> str:
+    """Returns the stage histograms in the Prometheus text exposition format."""
+    lines = [
+        "# HELP ocr_stage_seconds Wall time spent per OCR pipeline stage.",
+        "# TYPE ocr_stage_seconds histogram",
+    ]
+    with _histograms_lock:
+        for name, h in sorted(_histograms.items()):
+            for bound, cumulative in zip(LATENCY_BUCKETS, itertools.accumulate(h.counts)):
+                lines.append(f'ocr_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'ocr_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {h.count}')
+            lines.append(f'ocr_stage_seconds_sum{{stage="{name}"}} {h.sum}')
+            lines.append(f'ocr_stage_seconds_count{{stage="{name}"}} {h.count}')
+    peak = _peak_rss_mb()
+    if peak is not None:
+        lines.append("# HELP ocr_peak_rss_megabytes Peak resident memory of the process.")
+        lines.append("# TYPE ocr_peak_rss_megabytes gauge")
+        lines.append(f"ocr_peak_rss_megabytes {peak}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path: str):
+    """Dumps the histograms to `path`: Prometheus text for .prom/.txt, JSON otherwise."""
+    if path.lower().endswith((".prom", ".txt")):
+        content = metrics_prometheus()
+    else:
+        content = json.dumps(metrics_json(), indent=2)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    log.info(f"Wrote pipeline metrics to {path}")
@@ -2,7 +2,7 @@ const path = require('path');
 const multer = require('multer');
 const fs = require('fs');
 const response = require("../tools/response"); // Assuming you have a standard response tool
-const runCommand = require('../tools/processUtils'); // Import the command runner
+const ocrWorker = require('../tools/ocrWorker'); // Persistent Python OCR worker
 const { db } = require("../../config/sequelize");
 const { ocr_results, aio_employee, product_batch } = db.lotnoOcr; // Destructure models
 
@@ -21,17 +21,27 @@ if (!fs.existsSync(uploadDir)) {
 
 
 // Configure Multer storage
-const storage = multer.diskStorage({
-    destination: function (req, file, cb) {
-        cb(null, uploadDir); // Use the calculated absolute path
-    },
-    filename: function (req, file, cb) {
-        // Create a unique filename (e.g., timestamp-originalname)
-        const uniqueSuffix = Date.now() + '-' + Math.round(Math.random() * 1E9);
-        const extension = path.extname(file.originalname);
-        cb(null, file.fieldname + '-' + uniqueSuffix + extension);
-    }
-});
+// Uploads are kept in memory: the scan reads the buffer directly and the file
+// is written to uploadDir in parallel (see saveUpload) instead of before it.
+const storage = multer.memoryStorage();
+
+// Create a unique filename (e.g., fieldname-timestamp-random.ext)
+const createUploadFilename = (file) => {
+    const uniqueSuffix = Date.now() + '-' + Math.round(Math.random() * 1E9);
+    const extension = path.extname(file.originalname);
+    return file.fieldname + '-' + uniqueSuffix + extension;
+};
+
+// Starts writing an in-memory upload to uploadDir. Returns the filename and
+// absolute path right away, and `saved`, a promise that settles once the file is on disk.
+const saveUpload = (file) => {
+    const filename = createUploadFilename(file);
+    const filePath = path.join(uploadDir, filename);
+    const saved = fs.promises.writeFile(filePath, file.buffer);
+    // Keep an early failure from surfacing as an unhandled rejection before it is awaited
+    saved.catch(() => {});
+    return { filename, path: filePath, saved };
+};
 
 // Configure Multer upload middleware
 // You might want to add file filters (e.g., only allow images)
@@ -75,66 +85,20 @@ exports.scanPhoto = (req, res) => {
             return response(req, res, { status: 400, message: 'No photo file was uploaded.' });
         }
 
-        // File uploaded successfully, now run the Python script
-        console.log('File uploaded successfully:', req.file);
-        const uploadedFilePath = req.file.path; // Absolute path from multer
-        const uploadedFilename = req.file.filename; // Get the generated filename
-
-        // Define the path to the Python script relative to the project root or using absolute path
-        const scriptPath = path.resolve(__dirname, '..', '..', 'final_app', 'main.py');
-
-        // Prepare arguments for the Python script
-        const scriptArgs = [
-            scriptPath, // The script to run
-            '--image-path',
-            uploadedFilePath // Pass the absolute path of the uploaded file
-        ];
+        // File uploaded successfully, save it and run the OCR worker at the same time
+        console.log('File uploaded successfully:', req.file.originalname, req.file.size, 'bytes');
+        const savedUpload = saveUpload(req.file);
+        const uploadedFilePath = savedUpload.path; // Absolute path the photo is saved to
+        const uploadedFilename = savedUpload.filename; // Get the generated filename
 
         try {
-            console.log(`Running Python script: ${scriptArgs.join(' ')}`);
-            const scriptOutput = await runCommand(scriptArgs); // Await the promise
-            console.log("Python script raw output:", scriptOutput); // Log the raw output
-
-            // Attempt to parse the specific output format
-            let parsedOutput;
-            const resultPrefix = "Processing Result: ";
-            try {
-                // Find the start of the dictionary after the prefix
-                const dictStartIndex = scriptOutput.indexOf(resultPrefix);
-
-                if (dictStartIndex !== -1) {
-                    // Extract the string starting from '{' after the prefix
-                    const jsonLikeStringStartIndex = scriptOutput.indexOf('{', dictStartIndex + resultPrefix.length);
-                    const jsonLikeStringEndIndex = scriptOutput.lastIndexOf('}');
-
-                    if (jsonLikeStringStartIndex !== -1 && jsonLikeStringEndIndex !== -1 && jsonLikeStringEndIndex > jsonLikeStringStartIndex) {
-                        let jsonLikeString = scriptOutput.substring(jsonLikeStringStartIndex, jsonLikeStringEndIndex + 1);
-
-                        // Replace single quotes with double quotes for valid JSON
-                        // Be careful not to replace single quotes within string values if they exist
-                        // A safer approach might involve more complex regex or specific handling if needed
-                        // This simple replace works if keys and string values don't contain single quotes themselves
-                        const jsonString = jsonLikeString.replace(/'/g, '"');
-                        console.log("jsonString : ", jsonString);
-                        
-
-                        parsedOutput = JSON.parse(jsonString);
-                        console.log("Parsed Python script output:", parsedOutput);
-                    } else {
-                        throw new Error("Could not find valid dictionary braces {} in the script output after prefix.");
-                    }
-                } else {
-                    parsedOutput = { raw_output: scriptOutput }; // Keep raw output if prefix not found
-                    console.warn(`Python script output did not contain the prefix "${resultPrefix}".`);
-                    // Decide if you want to proceed without parsed data or return an error
-                    // For now, we'll let it proceed, but the DB insert might fail or be incomplete
-                }
-            } catch (parseError) {
-                console.error("Failed to parse Python script output:", parseError);
-                parsedOutput = { raw_output: scriptOutput, parse_error: parseError.message };
-                // Decide if you want to proceed or return an error
-                // For now, we'll let it proceed, but the DB insert might fail or be incomplete
-            }
+            console.log(`Sending image to OCR worker: ${uploadedFilename}`);
+            // The worker reads the upload buffer directly, no need to wait for the file on disk
+            const parsedOutput = await ocrWorker.scanImageBuffer(req.file.buffer, uploadedFilePath);
+            console.log("OCR worker result:", parsedOutput);
+
+            // The photo must be on disk before a record points to it
+            await savedUpload.saved;
 
             // --- Create ocr_results record ---
             let newResult = null;
@@ -227,7 +191,7 @@ exports.scanPhoto = (req, res) => {
                 message: "Photo uploaded, but scanning failed.",
                 error: scriptError.message || "Unknown error during script execution.",
                 upload_info: { // Still provide upload info
-                    filename: req.file.filename,
+                    filename: uploadedFilename,
                     path: uploadedFilePath
                 }
             });
@@ -259,11 +223,13 @@ exports.scanPhotoTest = (req, res) => {
         }
 
         // File uploaded successfully, now run the Python script
-        console.log('File uploaded successfully:', req.file);
-        const uploadedFilePath = req.file.path; // Absolute path from multer
-        const uploadedFilename = req.file.filename; // Get the generated filename
+        console.log('File uploaded successfully:', req.file.originalname, req.file.size, 'bytes');
+        const savedUpload = saveUpload(req.file);
+        const uploadedFilePath = savedUpload.path; // Absolute path the photo is saved to
+        const uploadedFilename = savedUpload.filename; // Get the generated filename
 
         try {
+            await savedUpload.saved;
             // --- Create ocr_results record ---
             const parsedOutput = {
                 "status": "success",
@@ -346,7 +312,7 @@ exports.scanPhotoTest = (req, res) => {
                 message: "Photo uploaded and scanned successfully!",
                 data: {
                     upload_info: {
-                        filename: req.file.filename,
+                        filename: uploadedFilename,
                         originalname: req.file.originalname,
                         path: uploadedFilePath,
                         size: req.file.size
@@ -364,7 +330,7 @@ exports.scanPhotoTest = (req, res) => {
                 message: "Photo uploaded, but scanning failed.",
                 error: scriptError.message || "Unknown error during script execution.",
                 upload_info: { // Still provide upload info
-                    filename: req.file.filename,
+                    filename: uploadedFilename,
                     path: uploadedFilePath
                 }
             });
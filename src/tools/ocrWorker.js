@@ -0,0 +1,149 @@
+const { spawn } = require('child_process');
+const path = require("path");
+const os = require('os');
+const readline = require('readline');
+
+// Keeps a single long-lived `main.py --serve` process around so the YOLO and
+// EasyOCR models are loaded once instead of once per scan. Requests and
+// responses are newline-delimited JSON objects matched by `id`.
+
+const REQUEST_TIMEOUT_MS = parseInt(process.env.OCR_WORKER_TIMEOUT_MS || '120000', 10);
+// Must match SCHEMA_VERSION in final_app/core/result_schema.py
+const SUPPORTED_SCHEMA_VERSION = 1;
+
+let worker = null;
+let readyPromise = null;
+let nextRequestId = 1;
+const pending = new Map();
+
+const getPythonExecutable = () => {
+    const isWindows = os.platform() === 'win32';
+    const venvPath = path.resolve(__dirname, '../../final_app/.venv');
+    return isWindows
+        ? path.join(venvPath, 'Scripts', 'python.exe')
+        : path.join(venvPath, 'bin', 'python');
+};
+
+const rejectAllPending = (error) => {
+    for (const { reject, timer } of pending.values()) {
+        clearTimeout(timer);
+        reject(error);
+    }
+    pending.clear();
+};
+
+const startWorker = () => {
+    const pythonExecutable = getPythonExecutable();
+    const scriptPath = path.resolve(__dirname, '..', '..', 'final_app', 'main.py');
+
+    console.log(`Starting OCR worker: ${pythonExecutable} ${scriptPath} --serve`);
+    const child = spawn(pythonExecutable, [scriptPath, '--serve'], {
+        cwd: path.dirname(scriptPath)
+    });
+    worker = child;
+
+    readyPromise = new Promise((resolve, reject) => {
+        const lines = readline.createInterface({ input: child.stdout });
+
+        lines.on('line', (line) => {
+            let message;
+            try {
+                message = JSON.parse(line);
+            } catch (parseError) {
+                console.error("OCR worker sent a malformed line:", line);
+                return;
+            }
+
+            if (message.event === 'ready') {
+                console.log(`OCR worker ready (pid ${message.pid})`);
+                resolve();
+                return;
+            }
+
+            const request = pending.get(message.id);
+            if (!request) {
+                console.warn("OCR worker response for unknown request id:", message.id);
+                return;
+            }
+            pending.delete(message.id);
+            clearTimeout(request.timer);
+
+            if (message.ok && message.result.schema_version !== SUPPORTED_SCHEMA_VERSION) {
+                request.reject(new Error(`Unsupported OCR result schema version: ${message.result.schema_version}`));
+            } else if (message.ok) {
+                request.resolve(message.result);
+            } else {
+                request.reject(new Error(message.error || 'Unknown OCR worker error'));
+            }
+        });
+
+        child.stderr.on('data', (data) => {
+            console.error(`OCR worker: ${data.toString().trimEnd()}`);
+        });
+
+        child.on('error', (err) => {
+            console.error("Failed to start OCR worker:", err);
+            reject(err);
+        });
+
+        child.on('close', (code) => {
+            console.error(`OCR worker exited with code ${code}`);
+            const error = new Error(`OCR worker exited with code ${code}`);
+            reject(error);
+            rejectAllPending(error);
+            if (worker === child) {
+                worker = null;
+                readyPromise = null;
+            }
+        });
+    });
+
+    return readyPromise;
+};
+
+const ensureWorker = () => {
+    if (!worker || !readyPromise) {
+        return startWorker();
+    }
+    return readyPromise;
+};
+
+const sendRequest = async (payload) => {
+    await ensureWorker();
+
+    const id = String(nextRequestId++);
+    return new Promise((resolve, reject) => {
+        const timer = setTimeout(() => {
+            pending.delete(id);
+            reject(new Error(`OCR worker timed out after ${REQUEST_TIMEOUT_MS} ms`));
+        }, REQUEST_TIMEOUT_MS);
+
+        pending.set(id, { resolve, reject, timer });
+        worker.stdin.write(JSON.stringify({ id, ...payload }) + '\n');
+    });
+};
+
+// Runs the OCR pipeline on an image that is already on disk.
+const scanImage = (imagePath) => sendRequest({ image_path: imagePath });
+
+// Runs the OCR pipeline on an image held in memory (e.g. an upload buffer), so
+// the scan doesn't wait for the file to be written. `storedPath` is optional:
+// where the caller saves the image, used for the worker's debug artifacts.
+const scanImageBuffer = (buffer, storedPath) => sendRequest({
+    image_base64: buffer.toString('base64'),
+    ...(storedPath ? { image_path: storedPath } : {}),
+});
+
+const stopWorker = () => {
+    if (worker) {
+        worker.stdin.write(JSON.stringify({ id: 'shutdown', cmd: 'shutdown' }) + '\n');
+        worker.stdin.end();
+    }
+};
+
+module.exports = {
+    scanImage,
+    scanImageBuffer,
+    ensureWorker,
+    stopWorker,
+};